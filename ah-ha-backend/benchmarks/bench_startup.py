@@ -0,0 +1,125 @@
+"""Startup benchmark: import cost of `main` and time to first served request.
+
+Each measurement runs in a fresh interpreter so nothing is already cached in
+sys.modules. "import" times `import main`; "first_request" starts
+`uvicorn main:app` and polls /metrics until the worker answers, which
+includes the lifespan (storage warm-up, index build, ADK agent construction).
+With --importtime the slowest modules from `python -X importtime` are listed.
+
+Run from ah-ha-backend/:
+    python -m benchmarks.bench_startup [--repeat 5] [--port 8765] [--importtime]
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+_IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def _free_port(preferred: int) -> int:
+    with socket.socket() as s:
+        try:
+            s.bind(("127.0.0.1", preferred))
+        except OSError:
+            s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_import() -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SNIPPET], capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def time_first_request(port: int, timeout: float) -> float:
+    url = f"http://127.0.0.1:{port}/metrics"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with status {server.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"No response from {url} after {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def slowest_imports(top: int) -> list:
+    """Cumulative import time per module, from `python -X importtime -c 'import main'`."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        # Each nesting level adds two spaces; children are printed before their parent.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            modules.append({"module": name.strip(), "cumulative_ms": int(cumulative_us) / 1000})
+        elif depth == 0:
+            if name.strip() == "main":
+                break
+            modules = []
+    modules.sort(key=lambda m: m["cumulative_ms"], reverse=True)
+    return modules[:top]
+
+
+def _summary(samples: list) -> dict:
+    return {
+        "median_seconds": statistics.median(samples),
+        "min_seconds": min(samples),
+        "max_seconds": max(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--importtime", action="store_true", help="list the slowest imports")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    # The subprocesses must import main and config from this directory.
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")])
+    )
+    port = _free_port(args.port)
+    result = {
+        "import": _summary([time_import() for _ in range(args.repeat)]),
+        "first_request": _summary(
+            [time_first_request(port, args.timeout) for _ in range(args.repeat)]
+        ),
+    }
+    if args.importtime:
+        result["slowest_imports"] = slowest_imports(args.top)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
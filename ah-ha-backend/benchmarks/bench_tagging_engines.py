@@ -0,0 +1,163 @@
+"""Tagging engine benchmark: ADK runner vs direct GenAI structured output.
+
+Sends the same single-snippet prompts through both engines and reports
+per-call latency and the parse-failure rate: replies that gave no tags,
+or "tags" that are really sentences of model chatter.
+
+By default both engines talk to fakes (benchmarks.fakes) with the same
+simulated model latency, so "overhead" is the time each engine spends
+around the model call: ADK session create/delete and event iteration vs.
+one request and a json.loads. --chatter-rate makes that share of the
+fake ADK replies conversational, as unconstrained output sometimes is.
+With --live both engines call the configured Gemini model
+(GOOGLE_CLOUD_PROJECT / GOOGLE_CLOUD_LOCATION), where overhead can't be
+separated from model latency but parse failures are real.
+
+Run from ah-ha-backend/:
+    python -m benchmarks.bench_tagging_engines [--calls 200] [--concurrency 8] [--live]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from typing import List, Optional
+
+_WORDS = (
+    "retrieval augmented generation embedding vector latency throughput firestore "
+    "snippet capture highlight knowledge enterprise fine tuning prompt engineering "
+    "evaluation benchmark cache index search semantic keyword dashboard metrics"
+).split()
+# Longer than any real tag: the reply's prose ended up in the tag list.
+_MAX_TAG_WORDS = 4
+
+
+def _prompts(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    prompts = []
+    for i in range(count):
+        title = " ".join(rng.choice(_WORDS) for _ in range(5)).title()
+        content = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(40, 200)))
+        prompts.append(f'Title: "{title} {i}"\nContent: "{content}"')
+    return prompts
+
+
+def parse_failed(tags: Optional[List[str]]) -> bool:
+    if not tags:
+        return True
+    return any(len(tag.split()) > _MAX_TAG_WORDS or "\n" in tag for tag in tags)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1)]
+
+
+async def _run(engine_name: str, call, prompts: List[str], concurrency: int, model_seconds: float):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+    errors = 0
+
+    async def one(prompt: str):
+        nonlocal failures, errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                tags = await call(prompt)
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+            failures += parse_failed(tags)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(prompt) for prompt in prompts))
+    elapsed = time.perf_counter() - started
+    result = {
+        "engine": engine_name,
+        "calls": len(prompts),
+        "errors": errors,
+        "parse_failures": failures,
+        "parse_failure_rate": failures / len(latencies) if latencies else 0.0,
+        "throughput_per_second": len(latencies) / elapsed if elapsed else 0.0,
+    }
+    if latencies:
+        result["latency_ms"] = {
+            "p50": _percentile(latencies, 50) * 1000,
+            "p95": _percentile(latencies, 95) * 1000,
+            "p99": _percentile(latencies, 99) * 1000,
+        }
+        if model_seconds:
+            result["overhead_ms_mean"] = (statistics.mean(latencies) - model_seconds) * 1000
+    return result
+
+
+def _adk_call(runner):
+    from services.tagging_service import _run_agent_call, parse_tags
+
+    async def call(prompt: str):
+        # The runner itself, without the gateway's rate limit.
+        return parse_tags(await _run_agent_call(runner, prompt, os.urandom(4).hex()))
+
+    return call
+
+
+def _engines(args):
+    """(name, call) pairs for the two engines, fake or live."""
+    from services.genai_tagging import GenAiTagger
+
+    if args.live:
+        from services.adk_service import get_adk_runner
+
+        runner = get_adk_runner()
+        if runner is None:
+            raise SystemExit("ADK runner unavailable: set GOOGLE_CLOUD_PROJECT and GOOGLE_CLOUD_LOCATION.")
+        tagger = GenAiTagger()
+    else:
+        from benchmarks.fakes import FakeAdkRunner, FakeGenAiClient
+
+        latency = args.model_latency_ms / 1000.0
+        runner = FakeAdkRunner(
+            first_event_latency_seconds=latency / 2,
+            total_latency_seconds=latency,
+            chatter_rate=args.chatter_rate,
+        )
+        tagger = GenAiTagger(client=FakeGenAiClient(latency_seconds=latency))
+    return [("adk", _adk_call(runner)), ("genai", tagger.generate)]
+
+
+async def amain(args):
+    from services.adk_session_manager import session_manager
+
+    prompts = _prompts(args.calls, seed=args.seed)
+    model_seconds = 0.0 if args.live else args.model_latency_ms / 1000.0
+    session_manager.start()
+    try:
+        results = [
+            await _run(name, call, prompts, args.concurrency, model_seconds)
+            for name, call in _engines(args)
+        ]
+    finally:
+        await session_manager.stop()
+    return {"live": args.live, "concurrency": args.concurrency, "engines": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--model-latency-ms", type=float, default=50.0)
+    parser.add_argument("--chatter-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--live", action="store_true", help="call the configured Gemini model")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    print(json.dumps(asyncio.run(amain(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
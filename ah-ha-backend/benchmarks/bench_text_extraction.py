@@ -0,0 +1,95 @@
+"""Micro-benchmark: streaming HTML extractor vs BeautifulSoup get_text().
+
+Checks that services.text_extraction.html_to_text produces the same text
+as the previous BeautifulSoup(html, "html.parser").get_text(separator=" ",
+strip=True) call, then times both (plus the budgeted extraction the
+tagging path actually uses).
+
+Run from ah-ha-backend/:
+    python -m benchmarks.bench_text_extraction [--sizes 10000 200000 2000000] [html files...]
+"""
+
+import argparse
+import json
+import random
+import time
+
+from bs4 import BeautifulSoup
+
+import config
+from services.text_extraction import html_to_text
+
+_WORDS = (
+    "retrieval augmented generation model prompt latency firestore snippet "
+    "capture tag vector index cache & <café> naïve résumé"
+).split()
+
+
+def synthetic_html(target_chars: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    parts = ["<!DOCTYPE html><html><head><title>Captured page</title>"]
+    parts.append("<style>body { color: red; }</style><script>var x = '<b>';</script></head><body>")
+    length = sum(len(p) for p in parts)
+    while length < target_chars:
+        words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 30)))
+        words = words.replace("&", "&amp;").replace("<café>", "&lt;café&gt;")
+        block = rng.choice(
+            [
+                f"<p>{words}</p>\n",
+                f"<div class='c'><span>{words}</span> tail <b>bold</b>&nbsp;x</div>",
+                f"<ul><li>{words}</li><li>  {words}  </li></ul>",
+                f"<!-- comment {words} --><a href='#'>{words}</a><br/>",
+                f"<pre>  {words}\n  {words}  </pre>",
+            ]
+        )
+        parts.append(block)
+        length += len(block)
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench(name: str, html: str, repeat: int) -> dict:
+    expected = BeautifulSoup(html, "html.parser").get_text(separator=" ", strip=True)
+    actual = html_to_text(html, max_chars=None)
+    budget = config.TEXT_EXTRACTION_MAX_OUTPUT_CHARS
+    return {
+        "input": name,
+        "input_chars": len(html),
+        "equivalent": actual == expected,
+        "budgeted_is_prefix": expected.startswith(html_to_text(html, max_chars=budget)),
+        "bs4_seconds": _time(
+            lambda: BeautifulSoup(html, "html.parser").get_text(separator=" ", strip=True),
+            repeat,
+        ),
+        "streaming_seconds": _time(lambda: html_to_text(html, max_chars=None), repeat),
+        "streaming_budgeted_seconds": _time(
+            lambda: html_to_text(html, max_chars=budget), repeat
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", help="HTML files to use in addition to synthetic pages")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[10_000, 200_000, 2_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = [bench(f"synthetic-{size}", synthetic_html(size), args.repeat) for size in args.sizes]
+    for path in args.files:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            results.append(bench(path, f.read(), args.repeat))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""Local stand-ins for Firestore and the ADK tagging runner.
+
+They implement just the subset of google-cloud-firestore's AsyncClient and
+ADK's InMemoryRunner that the services use, with configurable latency, so
+the backend can be benchmarked offline and reproducibly.
+"""
+
+import asyncio
+import copy
+import datetime
+import itertools
+import json
+import os
+import random
+import types
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1 import SERVER_TIMESTAMP, Increment
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+@dataclass
+class FakeWriteResult:
+    update_time: datetime.datetime
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data: Optional[Dict[str, Any]], read_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+        self.read_time = read_time or _now()
+        self.update_time = self.read_time
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str):
+        return (self._data or {}).get(field_path)
+
+
+class FakeDocumentReference:
+    def __init__(self, collection: "FakeCollectionReference", doc_id: str):
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def _store(self) -> Dict[str, Dict[str, Any]]:
+        return self._collection._store
+
+    def _resolve(self, data: Dict[str, Any], now: datetime.datetime) -> Dict[str, Any]:
+        current = self._store.get(self.id) or {}
+        resolved = {}
+        for key, value in data.items():
+            if value is SERVER_TIMESTAMP:
+                resolved[key] = now
+            elif isinstance(value, Increment):
+                resolved[key] = current.get(key, 0) + value.value
+            else:
+                resolved[key] = copy.deepcopy(value)
+        return resolved
+
+    async def set(self, data: Dict[str, Any], merge: bool = False) -> FakeWriteResult:
+        await self._collection._client._rpc()
+        return self._set_now(data, merge)
+
+    def _set_now(self, data, merge=False) -> FakeWriteResult:
+        now = _now()
+        resolved = self._resolve(data, now)
+        if merge and self.id in self._store:
+            self._store[self.id].update(resolved)
+        else:
+            self._store[self.id] = resolved
+        return FakeWriteResult(update_time=now)
+
+    async def update(self, data: Dict[str, Any], option=None) -> FakeWriteResult:
+        await self._collection._client._rpc()
+        return self._update_now(data)
+
+    def _update_now(self, data) -> FakeWriteResult:
+        if self.id not in self._store:
+            raise NotFound(f"No document to update: {self.id}")
+        now = _now()
+        self._store[self.id].update(self._resolve(data, now))
+        return FakeWriteResult(update_time=now)
+
+    async def get(self, field_paths=None) -> FakeDocumentSnapshot:
+        await self._collection._client._rpc()
+        return FakeDocumentSnapshot(self, self._store.get(self.id))
+
+    async def delete(self) -> FakeWriteResult:
+        await self._collection._client._rpc()
+        return self._delete_now()
+
+    def _delete_now(self) -> FakeWriteResult:
+        self._store.pop(self.id, None)
+        return FakeWriteResult(update_time=_now())
+
+
+class FakeQuery:
+    def __init__(self, collection: "FakeCollectionReference"):
+        self._collection = collection
+        self._orders: List[tuple] = []
+        self._filters: List[tuple] = []
+        self._start_after: Optional[FakeDocumentSnapshot] = None
+        self._limit: Optional[int] = None
+        self._fields: Optional[List[str]] = None
+
+    def _copy(self) -> "FakeQuery":
+        query = FakeQuery(self._collection)
+        query._orders = list(self._orders)
+        query._filters = list(self._filters)
+        query._start_after = self._start_after
+        query._limit = self._limit
+        query._fields = self._fields
+        return query
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "FakeQuery":
+        query = self._copy()
+        query._orders.append((field_path, direction))
+        return query
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None) -> "FakeQuery":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        query = self._copy()
+        query._filters.append((field_path, op_string, value))
+        return query
+
+    def start_after(self, snapshot) -> "FakeQuery":
+        query = self._copy()
+        if isinstance(snapshot, dict):
+            # A field-value cursor; only {"__name__": reference} (document ID order) is supported.
+            snapshot = FakeDocumentSnapshot(snapshot["__name__"], {})
+        query._start_after = snapshot
+        return query
+
+    def limit(self, count: int) -> "FakeQuery":
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def select(self, field_paths) -> "FakeQuery":
+        query = self._copy()
+        query._fields = list(field_paths)
+        return query
+
+    def _matches(self, data: Dict[str, Any]) -> bool:
+        for field_path, op, value in self._filters:
+            current = data.get(field_path)
+            if op == "array_contains" and not (isinstance(current, list) and value in current):
+                return False
+            if op == "==" and current != value:
+                return False
+            if op == ">" and not (current is not None and current > value):
+                return False
+            if op == ">=" and not (current is not None and current >= value):
+                return False
+            if op == "<" and not (current is not None and current < value):
+                return False
+        return True
+
+    def _sort_key(self, item):
+        doc_id, data = item
+        key = []
+        for field_path, _ in self._orders:
+            value = data.get(field_path)
+            key.append((value is not None, value))
+        key.append(doc_id)
+        return key
+
+    def _results(self) -> List[tuple]:
+        items = [(doc_id, data) for doc_id, data in self._collection._store.items() if self._matches(data)]
+        if self._orders:
+            descending = self._orders[0][1] == "DESCENDING"
+            items.sort(key=self._sort_key, reverse=descending)
+        if self._start_after is not None:
+            # Like Firestore, resume strictly after the cursor's position in the ordering.
+            cursor = self._sort_key((self._start_after.id, self._start_after._data or {}))
+            descending = bool(self._orders) and self._orders[0][1] == "DESCENDING"
+            items = [
+                item
+                for item in items
+                if (self._sort_key(item) < cursor if descending else self._sort_key(item) > cursor)
+            ]
+        if self._limit is not None:
+            items = items[: self._limit]
+        return items
+
+    async def stream(self):
+        client = self._collection._client
+        await client._rpc()
+        for index, (doc_id, data) in enumerate(self._results()):
+            if self._fields is not None:
+                data = {key: data[key] for key in self._fields if key in data}
+            if index and index % client.page_size == 0:
+                # Firestore streams in pages; each page is another round trip.
+                await client._rpc()
+            yield FakeDocumentSnapshot(self._collection.document(doc_id), data)
+
+    async def get(self):
+        return [snapshot async for snapshot in self.stream()]
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client: "FakeFirestoreClient", name: str):
+        self._client = client
+        self.id = name
+        self._store: Dict[str, Dict[str, Any]] = client._collections.setdefault(name, {})
+        super().__init__(self)
+
+    def document(self, doc_id: Optional[str] = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self, doc_id or os.urandom(10).hex())
+
+
+class FakeWriteBatch:
+    def __init__(self, client: "FakeFirestoreClient"):
+        self._client = client
+        self._ops = []
+
+    def set(self, reference: FakeDocumentReference, data, merge: bool = False):
+        self._ops.append(lambda: reference._set_now(data, merge))
+
+    # Write preconditions (option=) are accepted but not checked.
+    def update(self, reference: FakeDocumentReference, data, option=None):
+        self._ops.append(lambda: reference._update_now(data))
+
+    def delete(self, reference: FakeDocumentReference, option=None):
+        self._ops.append(reference._delete_now)
+
+    async def commit(self) -> List[FakeWriteResult]:
+        await self._client._rpc()
+        results = [op() for op in self._ops]
+        self._ops = []
+        return results
+
+
+class FakeFirestoreClient:
+    """In-memory stand-in for firestore.AsyncClient with simulated RPC latency."""
+
+    def __init__(self, rpc_latency_seconds: float = 0.0, page_size: int = 300):
+        self.rpc_latency_seconds = rpc_latency_seconds
+        self.page_size = page_size
+        self.rpc_count = 0
+        self._collections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    async def _rpc(self):
+        self.rpc_count += 1
+        if self.rpc_latency_seconds:
+            await asyncio.sleep(self.rpc_latency_seconds)
+        else:
+            await asyncio.sleep(0)
+
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, name)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    @staticmethod
+    def write_option(**kwargs):
+        return kwargs
+
+    async def get_all(self, references, field_paths=None):
+        await self._rpc()
+        for reference in references:
+            yield FakeDocumentSnapshot(reference, reference._store.get(reference.id))
+
+    def seed(self, collection: str, documents: Dict[str, Dict[str, Any]]):
+        """Loads documents directly, without simulated latency."""
+        self._collections.setdefault(collection, {}).update(documents)
+
+
+# --- ADK runner -------------------------------------------------------------
+
+
+@dataclass
+class _FakePart:
+    text: Optional[str] = None
+
+
+@dataclass
+class _FakeContent:
+    parts: List[_FakePart]
+    role: str = "model"
+
+
+@dataclass
+class FakeEvent:
+    id: str
+    author: str
+    invocation_id: str
+    content: Optional[_FakeContent]
+    partial: bool = False
+    final: bool = False
+    actions: Any = None
+
+    def is_final_response(self) -> bool:
+        return self.final
+
+
+class FakeSessionService:
+    def __init__(self):
+        self.sessions: Dict[tuple, dict] = {}
+
+    async def create_session(self, app_name, user_id, session_id=None, state=None):
+        self.sessions[(app_name, user_id, session_id)] = {"state": state or {}}
+        return self.sessions[(app_name, user_id, session_id)]
+
+    async def get_session(self, app_name, user_id, session_id, config=None):
+        return self.sessions.get((app_name, user_id, session_id))
+
+    async def delete_session(self, app_name, user_id, session_id):
+        self.sessions.pop((app_name, user_id, session_id), None)
+
+
+@dataclass
+class FakeAgent:
+    name: str = "fake_tag_generator"
+    model: str = "fake-model"
+    instruction: str = "Return comma-separated tags."
+
+
+@dataclass
+class FakeAdkRunner:
+    """Replies with tags drawn from the prompt after a configurable delay.
+
+    With `chatter_rate` set, that share of single-snippet replies wraps the
+    tags in conversational text, as free-form model output sometimes does.
+    """
+
+    first_event_latency_seconds: float = 0.2
+    total_latency_seconds: float = 0.6
+    batch: bool = False
+    chatter_rate: float = 0.0
+    app_name: str = "fake-tagging-app"
+    session_service: FakeSessionService = field(default_factory=FakeSessionService)
+    calls: int = 0
+    _ids = itertools.count()
+
+    @staticmethod
+    def _tags_for(text: str) -> List[str]:
+        words = [w.strip('".,:').lower() for w in text.split() if len(w) > 5]
+        return sorted(set(words))[:4] or ["misc"]
+
+    async def run_async(self, user_id, session_id, new_message):
+        self.calls += 1
+        prompt = new_message.parts[0].text
+        invocation_id = f"inv-{next(self._ids)}"
+        await asyncio.sleep(self.first_event_latency_seconds)
+        yield FakeEvent(
+            id=f"ev-{next(self._ids)}",
+            author="fake",
+            invocation_id=invocation_id,
+            content=_FakeContent(parts=[_FakePart(text="")]),
+            partial=True,
+        )
+        await asyncio.sleep(
+            max(0.0, self.total_latency_seconds - self.first_event_latency_seconds)
+        )
+        if self.batch:
+            sections = prompt.split("Snippet ")[1:]
+            reply = json.dumps(
+                {section.split(":", 1)[0]: self._tags_for(section) for section in sections}
+            )
+        else:
+            reply = ",".join(self._tags_for(prompt))
+            if random.random() < self.chatter_rate:
+                reply = f"Sure! Here are some relevant tags for this snippet:\n\n{reply}\n\nLet me know if you need more."
+        yield FakeEvent(
+            id=f"ev-{next(self._ids)}",
+            author="fake",
+            invocation_id=invocation_id,
+            content=_FakeContent(parts=[_FakePart(text=reply)]),
+            final=True,
+        )
+
+
+class FakeGenAiClient:
+    """Stands in for google.genai.Client in GenAiTagger.
+
+    generate_content answers after `latency_seconds` with the JSON the
+    response schema asks for, like a schema-constrained model would.
+    """
+
+    def __init__(self, latency_seconds: float = 0.6):
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+        self.aio = types.SimpleNamespace(
+            models=types.SimpleNamespace(generate_content=self.generate_content)
+        )
+
+    async def generate_content(self, model, contents, config=None):
+        self.calls += 1
+        await asyncio.sleep(self.latency_seconds)
+        if contents.startswith("Snippet "):
+            sections = contents.split("\n\nSnippet ")
+            sections[0] = sections[0][len("Snippet ") :]
+            reply = [
+                {"index": int(section.split(":", 1)[0]), "tags": FakeAdkRunner._tags_for(section)}
+                for section in sections
+            ]
+        else:
+            reply = FakeAdkRunner._tags_for(contents)
+        return types.SimpleNamespace(text=json.dumps(reply))
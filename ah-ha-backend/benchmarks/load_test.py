@@ -0,0 +1,273 @@
+"""Reproducible load test for the ah-ha backend.
+
+By default the app runs in-process against benchmarks.fakes: an in-memory
+Firestore with simulated RPC latency and a fake ADK runner with simulated
+LLM latency. Pass --firestore emulator to keep the real client (set
+FIRESTORE_EMULATOR_HOST), or --url to drive an already running server.
+
+Each scenario sends --requests requests at --concurrency and reports
+p50/p95/p99 latency, throughput, errors and the process's peak RSS as JSON,
+tagged with the current git commit so runs can be compared across commits.
+
+Run from ah-ha-backend/:
+    python -m benchmarks.load_test --corpus-sizes 1000 10000 100000 --concurrency 32 \\
+        --output bench_results.json
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+SCENARIOS = ("create", "list", "list_search", "detail", "delete", "suggest_tags")
+
+_VOCABULARY = (
+    "retrieval augmented generation embedding vector latency throughput firestore "
+    "snippet capture highlight knowledge enterprise fine tuning prompt engineering "
+    "evaluation benchmark cache index search semantic keyword dashboard metrics "
+    "pipeline streaming gateway quota circuit breaker fallback extension browser"
+).split()
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_VOCABULARY) for _ in range(words))
+
+
+def _snippet_payload(rng: random.Random) -> dict:
+    html = rng.random() < 0.5
+    body = _sentence(rng, rng.randint(40, 400))
+    return {
+        "title": _sentence(rng, rng.randint(3, 8)).title(),
+        "content": f"<div><p>{body}</p></div>" if html else body,
+        "content_type": "html" if html else "text",
+        "notes": _sentence(rng, 10) if rng.random() < 0.3 else None,
+        "permalink_to_origin": "https://example.com/article",
+    }
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+async def _run_scenario(
+    client: httpx.AsyncClient,
+    name: str,
+    make_request: Callable[[int], "asyncio.Future"],
+    requests: int,
+    concurrency: int,
+) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    statuses: Dict[str, int] = {}
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await make_request(i)
+                statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+                statuses["exception"] = statuses.get("exception", 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "statuses": statuses,
+        "elapsed_seconds": elapsed,
+        "throughput_rps": requests / elapsed if elapsed else 0.0,
+        "latency_seconds": {
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0.0,
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        },
+        "peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+
+def _install_fakes(args):
+    """Points the services at local fakes before the app handles any request."""
+    import config
+    from benchmarks.fakes import FakeAdkRunner, FakeAgent, FakeFirestoreClient
+    from services import adk_service
+
+    fake_db = None
+    if args.firestore == "fake" and config.STORAGE_BACKEND == "firestore":
+        from services import firestore_service
+
+        fake_db = FakeFirestoreClient(rpc_latency_seconds=args.firestore_latency_ms / 1000.0)
+        firestore_service.db = fake_db
+    if args.llm == "fake":
+        adk_service.tagging_agent = FakeAgent()
+        adk_service.adk_runner = FakeAdkRunner(
+            first_event_latency_seconds=args.llm_first_event_ms / 1000.0,
+            total_latency_seconds=args.llm_latency_ms / 1000.0,
+        )
+        adk_service.batch_tagging_agent = FakeAgent(name="fake_batch_tag_generator")
+        adk_service.batch_adk_runner = FakeAdkRunner(
+            first_event_latency_seconds=args.llm_first_event_ms / 1000.0,
+            total_latency_seconds=args.llm_latency_ms / 1000.0,
+            batch=True,
+        )
+    return fake_db
+
+
+async def _seed(fake_db, corpus_size: int, rng: random.Random) -> List[str]:
+    from models import AhHaSnippet
+    from services.storage import get_snippet_store
+
+    if fake_db is not None:
+        from services.firestore_service import SNIPPETS_COLLECTION
+
+        # Load straight into the fake so 100k-document corpora seed in seconds.
+        now = datetime.datetime.now(datetime.timezone.utc)
+        documents = {}
+        for i in range(corpus_size):
+            doc_id = f"seed{i:07d}"
+            payload = _snippet_payload(rng)
+            payload.update(
+                id=doc_id,
+                generated_tags=rng.sample(_VOCABULARY, 3),
+                tagging_status="done",
+                timestamp=now - datetime.timedelta(seconds=corpus_size - i),
+            )
+            documents[doc_id] = {k: v for k, v in payload.items() if v is not None}
+        fake_db.seed(SNIPPETS_COLLECTION, documents)
+        return list(documents)
+
+    # SQLite backend or the Firestore emulator: write through the store. The
+    # store is started first so the SQLite schema exists.
+    store = get_snippet_store()
+    await store.start()
+    created = await store.create_snippets_batch(
+        [AhHaSnippet(**_snippet_payload(rng)) for _ in range(corpus_size)]
+    )
+    return [snippet.id for snippet in created if not isinstance(snippet, Exception)]
+
+
+async def _run_corpus(args, corpus_size: int) -> Dict:
+    rng = random.Random(args.seed)
+    results = []
+
+    async def drive(client: httpx.AsyncClient, seeded_ids: List[str]):
+        delete_ids = list(seeded_ids)
+        rng.shuffle(delete_ids)
+        requests_by_scenario = {
+            "create": lambda i: client.post("/api/v1/snippets", json=_snippet_payload(rng)),
+            "list": lambda i: client.get("/ah-has/", params={"limit": args.page_size}),
+            "list_search": lambda i: client.get(
+                "/ah-has/", params={"search": rng.choice(_VOCABULARY)[:5], "limit": args.page_size}
+            ),
+            "detail": lambda i: client.get(f"/ah-has/{rng.choice(seeded_ids)}/"),
+            "delete": lambda i: client.delete(f"/api/v1/snippets/{delete_ids[i % len(delete_ids)]}"),
+            "suggest_tags": lambda i: client.post(
+                "/suggest-tags/", json={"snippet": _sentence(rng, 60)}
+            ),
+        }
+        for scenario in args.scenarios:
+            if scenario in ("detail", "delete") and not seeded_ids:
+                continue
+            results.append(
+                await _run_scenario(
+                    client, scenario, requests_by_scenario[scenario], args.requests, args.concurrency
+                )
+            )
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+            ids = [s["id"] for s in (await client.get("/ah-has/", params={"limit": 500})).json()]
+            await drive(client, ids)
+    else:
+        fake_db = _install_fakes(args)
+        seeded_ids = await _seed(fake_db, corpus_size, rng)
+        import main
+
+        transport = httpx.ASGITransport(app=main.app)
+        # ASGITransport doesn't run the lifespan, so enter it explicitly (index rebuild, queue).
+        async with main.app.router.lifespan_context(main.app):
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://bench", timeout=args.timeout
+            ) as client:
+                await drive(client, seeded_ids)
+
+    return {"corpus_size": corpus_size, "scenarios": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ah-ha backend load test")
+    parser.add_argument("--url", help="Drive a running server instead of the in-process app")
+    parser.add_argument("--firestore", choices=("fake", "emulator"), default="fake")
+    parser.add_argument("--llm", choices=("fake", "real"), default="fake")
+    parser.add_argument("--corpus-sizes", nargs="+", type=int, default=[1000])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--firestore-latency-ms", type=float, default=5.0)
+    parser.add_argument("--llm-first-event-ms", type=float, default=300.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Write JSON results here as well as to stdout")
+    args = parser.parse_args()
+
+    if args.url and len(args.corpus_sizes) > 1:
+        parser.error("--url drives an existing corpus; pass a single --corpus-sizes value")
+
+    report = {
+        "git_commit": _git_commit(),
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "parameters": {k: v for k, v in vars(args).items() if k != "output"},
+        # Each corpus size runs in a fresh process state only for the fakes'
+        # data; peak RSS is cumulative, so run one size per process for RSS comparisons.
+        "runs": [asyncio.run(_run_corpus(args, size)) for size in args.corpus_sizes],
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
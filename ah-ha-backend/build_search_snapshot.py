@@ -0,0 +1,32 @@
+"""One-shot job: build and publish the shared search index snapshot.
+
+Workers publish one themselves at startup and whenever the current one is
+older than SEARCH_SNAPSHOT_MAX_AGE_SECONDS; run this to publish a fresh
+generation right away, e.g. after a bulk import. Running workers pick it
+up within SEARCH_SNAPSHOT_CHECK_SECONDS. Firestore storage only.
+
+Run from ah-ha-backend/ with SEARCH_SNAPSHOT_PATH set:
+    python build_search_snapshot.py
+"""
+
+import asyncio
+import time
+
+import config
+from services.firestore_service import _stream_all_snippets, warm_up
+from services.index_snapshot import SnapshotSearchIndex
+
+
+async def main():
+    if not config.SEARCH_SNAPSHOT_PATH:
+        raise SystemExit("Set SEARCH_SNAPSHOT_PATH to the snapshot file the workers use.")
+    await warm_up()
+    streamed_at = int(time.time() * 1_000_000)
+    snippets = await _stream_all_snippets()
+    index = SnapshotSearchIndex(config.SEARCH_SNAPSHOT_PATH)
+    await asyncio.to_thread(index.publish, snippets, streamed_at, True)
+    print(f"Published {len(snippets)} snippets to {config.SEARCH_SNAPSHOT_PATH}.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
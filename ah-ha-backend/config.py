@@ -5,12 +5,20 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
+# Logging: per-event ADK dumps are only emitted at DEBUG, for a sample of calls.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+ADK_EVENT_LOG_SAMPLE_RATE = float(os.getenv("ADK_EVENT_LOG_SAMPLE_RATE", "0.1"))
+
 # Vertex AI / ADK Configuration
 GOOGLE_CLOUD_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT")
 GOOGLE_CLOUD_LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION")
 GOOGLE_GENAI_MODEL = os.getenv(
     "GOOGLE_GENAI_MODEL", "gemini-2.0-flash"
 )  # Added from generate_tags_tool
+# "adk": LlmAgent through an InMemoryRunner. "genai": direct generate_content
+# calls with a JSON-schema constrained reply (no session or event stream).
+TAGGING_ENGINE = os.getenv("TAGGING_ENGINE", "adk")
+GENAI_TAGGING_TEMPERATURE = float(os.getenv("GENAI_TAGGING_TEMPERATURE", "0.2"))
 
 # Google OAuth Configuration
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
@@ -32,6 +40,164 @@ _CORS_ORIGINS_STR = os.getenv(
 )
 ORIGINS = [origin.strip() for origin in _CORS_ORIGINS_STR.split(",") if origin.strip()]
 
+# Snippet storage backend ("firestore" or "sqlite" for self-hosted single-node deployments)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore")
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", "ah_ha.sqlite3")
+SQLITE_READ_CONNECTIONS = int(os.getenv("SQLITE_READ_CONNECTIONS", "4"))
+
+# Firestore writes: read each created snippet back (an extra RPC) instead of
+# building the response from the write result. Useful only for debugging.
+FIRESTORE_STRICT_CREATE_READBACK = (
+    os.getenv("FIRESTORE_STRICT_CREATE_READBACK", "false").lower() == "true"
+)
+
+# Snippet list pagination
+LIST_MAX_PAGE_SIZE = int(os.getenv("LIST_MAX_PAGE_SIZE", "500"))
+
+# Read-through snippet cache (detail LRU + per-query list results). Other
+# workers' writes drop cached snippets when the search index refresh reads
+# them from the change feed; the detail TTL matches that interval
+# (SEARCH_INDEX_REFRESH_SECONDS) so it is also the bound when refresh is off.
+SNIPPET_CACHE_MAX_ENTRIES = int(os.getenv("SNIPPET_CACHE_MAX_ENTRIES", "5000"))
+SNIPPET_CACHE_TTL_SECONDS = float(os.getenv("SNIPPET_CACHE_TTL_SECONDS", "15"))
+LIST_CACHE_MAX_ENTRIES = int(os.getenv("LIST_CACHE_MAX_ENTRIES", "256"))
+LIST_CACHE_TTL_SECONDS = float(os.getenv("LIST_CACHE_TTL_SECONDS", "30"))
+# Invalidate on writes from other gunicorn workers as they happen, via a
+# Firestore on_snapshot listener, rather than at the next refresh
+SNIPPET_CACHE_SNAPSHOT_LISTENER = (
+    os.getenv("SNIPPET_CACHE_SNAPSHOT_LISTENER", "false").lower() == "true"
+)
+
+# Background tagging queue
+TAGGING_CONCURRENCY = int(os.getenv("TAGGING_CONCURRENCY", "4"))
+TAGGING_MAX_ATTEMPTS = int(os.getenv("TAGGING_MAX_ATTEMPTS", "3"))
+TAGGING_BACKOFF_BASE_SECONDS = float(os.getenv("TAGGING_BACKOFF_BASE_SECONDS", "1.0"))
+TAGGING_MAX_QUEUE_SIZE = int(os.getenv("TAGGING_MAX_QUEUE_SIZE", "1000"))
+TAGGING_DRAIN_TIMEOUT_SECONDS = float(
+    os.getenv("TAGGING_DRAIN_TIMEOUT_SECONDS", "25")
+)
+
+# LLM tag cache: in-memory LRU plus optional persistent tier ("memory", "sqlite" or "firestore")
+TAG_CACHE_BACKEND = os.getenv("TAG_CACHE_BACKEND", "memory")
+TAG_CACHE_MAX_ENTRIES = int(os.getenv("TAG_CACHE_MAX_ENTRIES", "10000"))
+TAG_CACHE_TTL_SECONDS = float(os.getenv("TAG_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+TAG_CACHE_SQLITE_PATH = os.getenv("TAG_CACHE_SQLITE_PATH", "tag_cache.sqlite3")
+
+# Batch ingestion (POST /api/v1/snippets:batch)
+BATCH_MAX_SNIPPETS = int(os.getenv("BATCH_MAX_SNIPPETS", "300"))
+BATCH_TAGGING_GROUP_SIZE = int(os.getenv("BATCH_TAGGING_GROUP_SIZE", "25"))
+BATCH_TAGGING_CONCURRENCY = int(os.getenv("BATCH_TAGGING_CONCURRENCY", "4"))
+BATCH_TAGGING_MAX_CHARS_PER_ITEM = int(
+    os.getenv("BATCH_TAGGING_MAX_CHARS_PER_ITEM", "4000")
+)
+FIRESTORE_MAX_BATCH_WRITES = 500  # Firestore's limit on operations per WriteBatch
+
+# ADK tagging session lifecycle
+ADK_MAX_LIVE_SESSIONS = int(os.getenv("ADK_MAX_LIVE_SESSIONS", "200"))
+ADK_SESSION_MAX_AGE_SECONDS = float(os.getenv("ADK_SESSION_MAX_AGE_SECONDS", "300"))
+ADK_SESSION_SWEEP_INTERVAL_SECONDS = float(
+    os.getenv("ADK_SESSION_SWEEP_INTERVAL_SECONDS", "60")
+)
+
+# HTML-to-text extraction for the LLM prompt ("thread" or "process" pool)
+TEXT_EXTRACTION_EXECUTOR = os.getenv("TEXT_EXTRACTION_EXECUTOR", "thread")
+TEXT_EXTRACTION_WORKERS = int(os.getenv("TEXT_EXTRACTION_WORKERS", "2"))
+TEXT_EXTRACTION_MAX_INPUT_CHARS = int(
+    os.getenv("TEXT_EXTRACTION_MAX_INPUT_CHARS", str(5 * 1024 * 1024))
+)
+# Roughly the token budget of the tagging prompt (~4 characters per token).
+TEXT_EXTRACTION_MAX_OUTPUT_CHARS = int(
+    os.getenv("TEXT_EXTRACTION_MAX_OUTPUT_CHARS", "16000")
+)
+
+# Similarity search: "hashing" embeds locally, "genai" calls EMBEDDING_MODEL.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hashing")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-004")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "256"))
+# Optional file for a memory-mapped vector matrix; empty keeps it in RAM. One
+# process owns the file (a lock beside it); other workers keep theirs in RAM.
+EMBEDDING_INDEX_PATH = os.getenv("EMBEDDING_INDEX_PATH", "")
+# Above this many vectors queries go through an IVF (k-means) index instead of a full scan.
+EMBEDDING_ANN_THRESHOLD = int(os.getenv("EMBEDDING_ANN_THRESHOLD", "20000"))
+EMBEDDING_ANN_PROBES = int(os.getenv("EMBEDDING_ANN_PROBES", "8"))
+EMBEDDING_MIN_SCORE = float(os.getenv("EMBEDDING_MIN_SCORE", "0.05"))
+SIMILARITY_DEFAULT_LIMIT = int(os.getenv("SIMILARITY_DEFAULT_LIMIT", "10"))
+
+# Near-duplicate captures ("off", "flag" stores the copy with duplicate_of set and the
+# original's tags, "merge" returns the original instead of storing the copy). Off
+# by default: both modes change what a capture stores and returns, so opt in.
+DEDUP_MODE = os.getenv("DEDUP_MODE", "off")
+# Estimated Jaccard similarity of word 3-shingles above which two captures are duplicates
+DEDUP_SIMILARITY_THRESHOLD = float(os.getenv("DEDUP_SIMILARITY_THRESHOLD", "0.75"))
+# Shorter content only matches exactly; a handful of shingles is too coarse to compare.
+DEDUP_MIN_WORDS = int(os.getenv("DEDUP_MIN_WORDS", "8"))
+
+# Read endpoints: list preview length (view=summary) and response compression
+SNIPPET_PREVIEW_CHARS = int(os.getenv("SNIPPET_PREVIEW_CHARS", "280"))
+# Bodies smaller than this are sent uncompressed; br is used when the brotli package is installed.
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+# Delta sync (GET /ah-has/changes): deletion tombstones are kept this long, and
+# older cursors must resync from scratch.
+CHANGES_TOMBSTONE_TTL_DAYS = float(os.getenv("CHANGES_TOMBSTONE_TTL_DAYS", "30"))
+CHANGES_DEFAULT_PAGE_SIZE = int(os.getenv("CHANGES_DEFAULT_PAGE_SIZE", "200"))
+
+# Firestore content tier: content over CONTENT_OFFLOAD_BYTES (UTF-8) is
+# compressed and kept out of the snippet document, in chunk documents
+# ("firestore") or files under CONTENT_STORE_PATH ("local", one host only).
+# Listings then carry only the preview; the detail endpoint loads the rest.
+CONTENT_STORE = os.getenv("CONTENT_STORE", "firestore").lower()
+CONTENT_STORE_PATH = os.getenv("CONTENT_STORE_PATH", "snippet_content")
+CONTENT_OFFLOAD_BYTES = int(os.getenv("CONTENT_OFFLOAD_BYTES", str(64 * 1024)))  # 0 keeps all content inline
+CONTENT_CODEC = os.getenv("CONTENT_CODEC", "zstd").lower()  # gzip if zstandard isn't installed
+CONTENT_ZSTD_LEVEL = int(os.getenv("CONTENT_ZSTD_LEVEL", "9"))
+CONTENT_CHUNK_BYTES = int(os.getenv("CONTENT_CHUNK_BYTES", str(512 * 1024)))  # Under the 1 MiB document cap
+CONTENT_LOAD_CONCURRENCY = int(os.getenv("CONTENT_LOAD_CONCURRENCY", "16"))
+
+# Admin bulk endpoints (/admin/export, /admin/import, /admin/delete) are off
+# unless ADMIN_TOKEN is set; requests send it as a bearer token.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "200"))
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", "4"))
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(10 * 1024 * 1024)))
+
+# Firestore search index: each worker applies the writes and deletes other
+# workers made every SEARCH_INDEX_REFRESH_SECONDS, read from the change feed.
+# Until then their snippets are missing from its search results (0: never):
+# with the default, a capture made on one worker can take up to 15 s to be
+# searchable on the others, and a deleted one to drop out of their results.
+SEARCH_INDEX_REFRESH_SECONDS = float(os.getenv("SEARCH_INDEX_REFRESH_SECONDS", "15"))
+
+# Firestore search index shared by all workers on a host: one worker writes a
+# snapshot file here and every worker mmaps it. Empty keeps a per-worker index.
+# The derived indexes are saved next to it (<path>.state.npz), so workers that
+# start while the snapshot is fresh read only the changes since, not every
+# snippet. Newer generations are compacted without reading the collection
+# unless SEARCH_INDEX_REFRESH_SECONDS is 0.
+SEARCH_SNAPSHOT_PATH = os.getenv("SEARCH_SNAPSHOT_PATH", "")
+SEARCH_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("SEARCH_SNAPSHOT_MAX_AGE_SECONDS", "3600"))
+SEARCH_SNAPSHOT_CHECK_SECONDS = float(os.getenv("SEARCH_SNAPSHOT_CHECK_SECONDS", "10"))
+
+# Server-sent events (GET /events), per worker. EVENTS_SOURCE=firestore feeds
+# the stream from the snapshot listener so clients see every worker's writes.
+EVENTS_SOURCE = os.getenv("EVENTS_SOURCE", "local").lower()  # "local" or "firestore"
+EVENTS_CLIENT_BUFFER = int(os.getenv("EVENTS_CLIENT_BUFFER", "512"))  # > BATCH_MAX_SNIPPETS; fuller clients are evicted
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_MAX_CLIENTS = int(os.getenv("EVENTS_MAX_CLIENTS", "1000"))
+EVENTS_RETRY_MILLISECONDS = int(os.getenv("EVENTS_RETRY_MILLISECONDS", "3000"))
+
+# LLM gateway: admission control for Gemini calls (per worker)
+LLM_RATE_LIMIT_PER_SECOND = float(os.getenv("LLM_RATE_LIMIT_PER_SECOND", "5"))  # 0 disables
+LLM_RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", "10"))
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_MAX_WAITING = int(os.getenv("LLM_MAX_WAITING", "100"))
+LLM_CALL_DEADLINE_SECONDS = float(os.getenv("LLM_CALL_DEADLINE_SECONDS", "30"))
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+
 # Stop words list (can be expanded) - Moving here as it's a static configuration
 STOP_WORDS = set(
     [
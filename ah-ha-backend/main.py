@@ -1,31 +1,148 @@
+import asyncio
 import datetime
-import os
+import hashlib
+import hmac
+import logging
+import time
+import zlib
+from contextlib import asynccontextmanager
 from typing import List, Optional
 
 import config
 import uvicorn
-from bs4 import BeautifulSoup  # Import BeautifulSoup
 from fastapi import (
+    Depends,
     FastAPI,
+    Header,
     HTTPException,  # For error responses
+    Query,
+    Request,
+    Response,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from google.genai import types as genai_types
-from models import AhHaSnippet, SnippetText
-from services.adk_service import get_adk_runner, get_tagging_agent
-from services.firestore_service import (
-    create_snippet as db_create_snippet,  # Aliased to avoid name clashes if any
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from models import (
+    AhHaSnippet,
+    BulkDeleteRequest,
+    BulkDeleteResult,
+    SnippetBatchItemResult,
+    SnippetBatchRequest,
+    SnippetBatchResponse,
+    SnippetChanges,
+    SnippetImportResult,
+    SnippetText,
+    SnippetTextBatch,
+    TagCount,
 )
-from services.firestore_service import (
-    delete_snippet_by_id as db_delete_snippet_by_id,  # Added delete
+from pydantic import TypeAdapter, ValidationError
+from pydantic_core import to_json
+from services.adk_session_manager import session_manager
+from services.bulk import BatchWriter, LineTooLong, gzipped, ndjson_lines
+from services.changes import ChangeCursor, to_micros
+from services.compression import CompressionMiddleware, strip_etag_suffix
+from services.content_store import stats as content_store_stats
+from services.dedup_index import dedup_index
+from services.embedding_index import embedding_index
+from services.events import get_event_bus, publish_snapshot_change
+from services.index_snapshot import SnapshotSearchIndex
+from services.keyword_engine import keyword_engine
+from services.llm_gateway import get_llm_gateway
+from services.metrics import (
+    http_errors,
+    http_request_duration,
+    http_requests,
+    register_gauges,
+    render_metrics,
+)
+from services.projection import parse_fields, project
+from services.search_index import get_search_index
+from services.snippet_cache import (
+    get_snippet_cache,
+    start_snapshot_listener,
+    stop_snapshot_listener,
+)
+from services.storage import SnippetStore, get_snippet_store
+from services.tag_cache import get_tag_cache, start_tag_cache
+from services.tagging_queue import (
+    TAGGING_DONE,
+    TAGGING_PENDING,
+    TAGGING_SKIPPED,
+    AsyncioTaggingQueue,
+    TaggingJob,
+)
+from services.tagging_service import (
+    cached_tags,
+    generate_tags_batch,
+    init_tagging_engine,
+    record_tagging_failure,
+    run_tagging_job,
+    tagging_available,
+)
+from services.text_extraction import shutdown_executor
+
+logging.basicConfig(
+    level=config.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+tagging_queue = AsyncioTaggingQueue(
+    handler=run_tagging_job, on_failure=record_tagging_failure
 )
-from services.firestore_service import get_all_snippets as db_get_all_snippets
-from services.firestore_service import get_snippet_by_id as db_get_snippet_by_id
 
-app = FastAPI()
 
-adk_runner = get_adk_runner()
-tagging_agent = get_tagging_agent()  # This is the LlmAgent from adk_service.py
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients are built here rather than at import so `import main` stays cheap
+    # and the worker starts accepting connections sooner.
+    snippet_store = get_snippet_store()
+    # Agent construction imports the ADK (or google.genai); do it off the event
+    # loop, in parallel with opening the storage connection.
+    adk_ready = asyncio.create_task(asyncio.to_thread(init_tagging_engine))
+    start_tag_cache()
+    try:
+        await snippet_store.warm_up()
+    except Exception as e:
+        logger.warning("Could not open %s storage at startup: %s", snippet_store.name, e)
+    # Build the per-worker indexes once (Firestore: the in-process search index
+    # so searches don't scan the collection; SQLite: schema and keyword stats).
+    try:
+        await snippet_store.start()
+    except Exception as e:
+        logger.warning(
+            "Could not warm up %s storage at startup, falling back to scans: %s",
+            snippet_store.name,
+            e,
+        )
+    events_from_snapshots = config.EVENTS_SOURCE == "firestore" and snippet_store.name == "firestore"
+    if events_from_snapshots or (
+        config.SNIPPET_CACHE_SNAPSHOT_LISTENER and snippet_store.name == "firestore"
+    ):
+        from services.firestore_service import SNIPPETS_COLLECTION
+
+        start_snapshot_listener(
+            SNIPPETS_COLLECTION,
+            on_change=publish_snapshot_change if events_from_snapshots else None,
+        )
+        # The listener reports this worker's writes too.
+        get_event_bus().local_publish = not events_from_snapshots
+    try:
+        await adk_ready
+    except Exception as e:
+        logger.warning("Could not initialize the %s tagging engine: %s", config.TAGGING_ENGINE, e)
+    await tagging_queue.start()
+    session_manager.start()
+    yield
+    get_event_bus().close()
+    # Let in-flight tagging jobs finish before the worker exits.
+    await tagging_queue.drain()
+    await session_manager.stop()
+    stop_snapshot_listener()
+    await snippet_store.close()
+    embedding_index.flush()
+    shutdown_executor()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,196 +150,482 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Duplicate-Of", "ETag"],
+)
+app.add_middleware(CompressionMiddleware)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep series cardinality bounded.
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        http_requests.inc(method=request.method, route=path, status=str(status))
+        http_request_duration.observe(
+            time.perf_counter() - started, method=request.method, route=path
+        )
+        if status >= 500:
+            http_errors.inc(method=request.method, route=path)
+
+
+def _stats_gauges(stats_fn):
+    return lambda: [({"stat": key}, value) for key, value in stats_fn().items()]
+
+
+register_gauges(
+    "ah_ha_tagging_queue_depth",
+    "Tagging jobs queued or waiting to retry.",
+    lambda: [({}, tagging_queue.qsize())],
+)
+register_gauges(
+    "ah_ha_tag_cache", "LLM tag cache statistics.", _stats_gauges(get_tag_cache().stats)
+)
+register_gauges(
+    "ah_ha_snippet_cache",
+    "Snippet read-through cache statistics.",
+    _stats_gauges(get_snippet_cache().stats),
+)
+register_gauges(
+    "ah_ha_dedup_index",
+    "Near-duplicate fingerprint index size and hit counts.",
+    _stats_gauges(dedup_index.stats),
+)
+register_gauges(
+    "ah_ha_embedding_index",
+    "Similarity index size and query counts.",
+    _stats_gauges(embedding_index.stats),
+)
+register_gauges(
+    "ah_ha_llm_gateway",
+    "Model call queue depth, outcomes, fallbacks and circuit state (0 closed, 1 half-open, 2 open).",
+    _stats_gauges(get_llm_gateway().stats),
+)
+if isinstance(get_search_index(), SnapshotSearchIndex):
+    register_gauges(
+        "ah_ha_search_snapshot",
+        "Shared search index snapshot and this worker's delta.",
+        _stats_gauges(get_search_index().stats),
+    )
+register_gauges(
+    "ah_ha_content_store",
+    "Snippet content stored out of line: writes, loads, deletes and bytes.",
+    _stats_gauges(content_store_stats),
+)
+register_gauges(
+    "ah_ha_events",
+    "Server-sent event clients and deliveries in this worker.",
+    _stats_gauges(get_event_bus().stats),
 )
+register_gauges(
+    "ah_ha_adk_sessions", "ADK tagging session lifecycle.", _stats_gauges(session_manager.stats)
+)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 # In-memory storage removed, will use Firestore
 # ah_ha_storage = []
 # next_id = 1
 
 
+async def _find_original(
+    snippet_store: SnippetStore, snippet: AhHaSnippet
+) -> Optional[AhHaSnippet]:
+    """Returns the stored snippet this one near-duplicates, if dedup is enabled."""
+    if config.DEDUP_MODE == "off":
+        return None
+    match = dedup_index.find(snippet)
+    if match is None:
+        return None
+    original = await snippet_store.get_snippet_by_id(match[0])
+    if original is not None:
+        logger.info(
+            "Capture is a near-duplicate of snippet %s (similarity %.2f); mode=%s",
+            original.id,
+            match[1],
+            config.DEDUP_MODE,
+        )
+    return original
+
+
 @app.post("/api/v1/snippets", response_model=AhHaSnippet)
-async def create_ah_ha(snippet_create_data: AhHaSnippet):  # Renamed input for clarity
+async def create_ah_ha(
+    snippet_create_data: AhHaSnippet,
+    response: Response,
+    snippet_store: SnippetStore = Depends(get_snippet_store),
+):  # Renamed input for clarity
     # ID and timestamp will be handled by Firestore service or set there
     # snippet_create_data.id is Optional[str] now, Firestore generates it.
-    # snippet_create_data.timestamp can be set here or by Firestore server_timestamp
 
-    # If timestamp is not set by client, set it now before sending to ADK/Firestore
+    # If timestamp is not set by client, set it now before sending to Firestore
     if not snippet_create_data.timestamp:
         snippet_create_data.timestamp = datetime.datetime.now()
 
-    print(
-        f"Attempting to generate tags for: '{snippet_create_data.title}' using LlmAgent"
-    )
+    # The extension often re-sends a highlight, sometimes with a few words changed.
+    original = await _find_original(snippet_store, snippet_create_data)
+    if original is not None and config.DEDUP_MODE == "merge":
+        response.headers["X-Duplicate-Of"] = original.id
+        return original
+
+    # Persist straight away; tags are generated in the background and patched on later.
+    snippet_create_data.generated_tags = []
+    if original is not None:
+        snippet_create_data.duplicate_of = original.id
+    if original is not None and original.generated_tags:
+        # Flagged duplicate: reuse the original's tags rather than calling the LLM again.
+        cached = list(original.generated_tags)
+    else:
+        cached = await cached_tags(snippet_create_data) if tagging_available() else None
+    if cached is not None:
+        # Same content was tagged before with this model and instruction: no LLM call needed.
+        snippet_create_data.generated_tags = cached
+        snippet_create_data.tagging_status = TAGGING_DONE
+    elif tagging_available() and snippet_create_data.content:
+        snippet_create_data.tagging_status = TAGGING_PENDING
+    else:
+        if not tagging_available():
+            logger.info("%s tagging engine not available. Skipping AI tag generation.", config.TAGGING_ENGINE)
+        if not snippet_create_data.content:
+            logger.info("Snippet content is empty. Skipping AI tag generation.")
+        snippet_create_data.tagging_status = TAGGING_SKIPPED
+
+    # Save to the configured snippet store
+    created_snippet = await snippet_store.create_snippet(snippet_create_data)
+    if created_snippet.tagging_status == TAGGING_PENDING:
+        await tagging_queue.enqueue(TaggingJob(snippet=created_snippet))
+        logger.info("Queued background tagging for snippet %s", created_snippet.id)
+    return created_snippet
 
-    if adk_runner and tagging_agent and snippet_create_data.content:
-        print(
-            "ADK LlmAgent and Runner are available. Proceeding with direct tag generation."
+
+async def _tag_batch(snippets: List[AhHaSnippet]):
+    """Tags snippets in place with a few grouped LLM requests."""
+    batch_tags = await generate_tags_batch(snippets)
+    for snippet, tags in zip(snippets, batch_tags):
+        if tags is not None:
+            snippet.generated_tags = tags
+            snippet.tagging_status = TAGGING_DONE if snippet.content else TAGGING_SKIPPED
+        elif tagging_available():
+            # Grouped tagging missed this item; the background queue will retry it alone.
+            snippet.generated_tags = []
+            snippet.tagging_status = TAGGING_PENDING
+        else:
+            snippet.generated_tags = []
+            snippet.tagging_status = TAGGING_SKIPPED
+
+
+@app.post("/api/v1/snippets:batch", response_model=SnippetBatchResponse)
+async def create_ah_has_batch(
+    batch_request: SnippetBatchRequest,
+    snippet_store: SnippetStore = Depends(get_snippet_store),
+):
+    """Creates many snippets at once (history import, offline extension queue).
+
+    Tags come from a few grouped LLM requests and the snippets are written
+    with batched commits. Every item gets its own status, so one bad item
+    does not fail the whole batch.
+    """
+    snippets = batch_request.snippets
+    if len(snippets) > config.BATCH_MAX_SNIPPETS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"A batch may contain at most {config.BATCH_MAX_SNIPPETS} snippets.",
         )
+
+    results: List[Optional[SnippetBatchItemResult]] = [None] * len(snippets)
+    to_create = []  # (request index, snippet)
+    for index, raw_snippet in enumerate(snippets):
         try:
-            content_for_llm = snippet_create_data.content
-            if (
-                snippet_create_data.content_type == "html"
-                and snippet_create_data.content
-            ):
-                soup = BeautifulSoup(snippet_create_data.content, "html.parser")
-                content_for_llm = soup.get_text(separator=" ", strip=True)
-                print(
-                    f"HTML content stripped for LLM. Original length: {len(snippet_create_data.content)}, Stripped length: {len(content_for_llm)}"
-                )
-
-            user_prompt = (
-                f'Title: "{snippet_create_data.title}"\nContent: "{content_for_llm}"'
-            )
-            input_message = genai_types.Content(
-                role="user", parts=[genai_types.Part(text=user_prompt)]
+            snippet = AhHaSnippet.model_validate(raw_snippet)
+        except ValidationError as e:
+            results[index] = SnippetBatchItemResult(
+                index=index, status="error", error=str(e)
             )
-
-            # Use a temporary ID for ADK session if snippet ID is not yet available (it won't be from client)
-            # Firestore will generate the final ID.
-            temp_adk_id_part = (
-                snippet_create_data.id
-                if snippet_create_data.id
-                else os.urandom(4).hex()
+            continue
+        if not snippet.title.strip():
+            results[index] = SnippetBatchItemResult(
+                index=index, status="error", error="Snippet title must not be empty."
             )
-            user_id = f"user_snippet_{temp_adk_id_part}"
-            session_id_for_adk = (
-                f"session_tagging_{temp_adk_id_part}_{os.urandom(4).hex()}"
+            continue
+        if not snippet.timestamp:
+            snippet.timestamp = datetime.datetime.now()
+        to_create.append((index, snippet))
+
+    await _tag_batch([snippet for _, snippet in to_create])
+    created = await snippet_store.create_snippets_batch([snippet for _, snippet in to_create])
+    for (index, _), outcome in zip(to_create, created):
+        if isinstance(outcome, Exception):
+            results[index] = SnippetBatchItemResult(
+                index=index, status="error", error=str(outcome)
             )
+            continue
+        results[index] = SnippetBatchItemResult(
+            index=index, status="created", snippet=outcome
+        )
+        if outcome.tagging_status == TAGGING_PENDING:
+            await tagging_queue.enqueue(TaggingJob(snippet=outcome))
+
+    return SnippetBatchResponse(results=results)
+
+
+def _wants_ndjson(request: Request, format: Optional[str]) -> bool:
+    if format:
+        return format == "ndjson"
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def _ndjson_lines(first, rest):
+    if first is not None:
+        yield to_json(first) + b"\n"
+    async for snippet in rest:
+        yield to_json(snippet) + b"\n"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match uses weak comparison; clients echo the tag of the encoding they got.
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if strip_etag_suffix(tag) == etag:
+            return True
+    return False
+
+
+def _etag_response(request: Request, content, headers: Optional[dict] = None) -> Response:
+    """Serializes `content` with a strong ETag, or answers 304 if the client has it."""
+    body = to_json(content)
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {**(headers or {}), "ETag": etag}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _snippet_id(item) -> str:
+    return item["id"] if isinstance(item, dict) else item.id
+
+
+async def _iterate(snippets: List[AhHaSnippet]):
+    for snippet in snippets:
+        yield snippet
 
-            current_session = await adk_runner.session_service.get_session(
-                app_name=adk_runner.app_name,
-                user_id=user_id,
-                session_id=session_id_for_adk,
+
+@app.get("/ah-has/", response_model=List[AhHaSnippet])
+async def get_ah_has(
+    request: Request,
+    search: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=config.LIST_MAX_PAGE_SIZE),
+    start_after: Optional[str] = None,
+    format: Optional[str] = Query(None, pattern="^(json|ndjson)$"),
+    mode: Optional[str] = Query(None, pattern="^(keyword|semantic)$"),
+    fields: Optional[str] = None,
+    view: Optional[str] = Query(None, pattern="^(full|summary)$"),
+    tag: Optional[str] = None,
+    snippet_store: SnippetStore = Depends(get_snippet_store),
+):
+    # The snippet store handles search, ordering and the start_after cursor.
+    # `search` matches snippets where every query word starts a word of the title,
+    # content, notes or tags (so "asyn" finds "asyncio"; there is no infix match).
+    # Pass the ID of the last snippet received as start_after to get the next page.
+    # fields=title,generated_tags or view=summary (title, tags, a short preview and
+    # metadata, no content) keep large captures out of list responses. Whenever
+    # `content` is returned it is the whole content, even if stored out of line.
+    try:
+        selected = parse_fields(fields, view)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {}
+    if mode == "semantic":
+        # Ranked by embedding similarity to the search text instead of keyword matches.
+        if not search:
+            raise HTTPException(
+                status_code=400, detail="mode=semantic requires a search query."
             )
-            if not current_session:
-                await adk_runner.session_service.create_session(
-                    app_name=adk_runner.app_name,
-                    user_id=user_id,
-                    session_id=session_id_for_adk,
-                )
-
-            print(f"ADK Prompt for {session_id_for_adk} (to LlmAgent): {user_prompt}")
-
-            final_tags_text = None
-            parsed_tags_list = []
-
-            print(f"\n--- ADK Event Stream for {session_id_for_adk} (LlmAgent) ---")
-            event_count = 0
-            async for event in adk_runner.run_async(
-                user_id=user_id,
-                session_id=session_id_for_adk,
-                new_message=input_message,
+        page_size = limit or config.SIMILARITY_DEFAULT_LIMIT
+        page_ids = []
+        try:
+            # With a tag, matches without it are made up from the following ones
+            # (read a few pages' worth at a time), so only the last page is short.
+            async for matches in embedding_index.search_pages(
+                search, page_size * 4 if tag else page_size, start_after=start_after
             ):
-                event_count += 1
-                print(
-                    f"\n[EVENT {event_count}] ID: {event.id}, Author: {event.author}, Invocation ID: {event.invocation_id}"
-                )
-                if event.content and event.content.parts:
-                    for i, part in enumerate(event.content.parts):
-                        print(f"  Part {i}:")
-                        if part.text:
-                            print(
-                                f"    Text: '{part.text[:200]}...' (Partial: {event.partial})"
-                            )
-                            # If it's the final text from the LlmAgent, capture it
-                            if event.is_final_response() and not event.partial:
-                                final_tags_text = part.text.strip()
-
-                if event.actions:  # Should be minimal for direct LlmAgent
-                    print(
-                        f"  Actions: state_delta={event.actions.state_delta}, artifact_delta={event.actions.artifact_delta}, transfer={event.actions.transfer_to_agent}, escalate={event.actions.escalate}"
+                match_ids = [snippet_id for snippet_id, _ in matches]
+                if tag:
+                    tagged = await snippet_store.get_snippets_by_ids(
+                        match_ids, fields=["id", "generated_tags"]
                     )
+                    match_ids = [item["id"] for item in tagged if tag in (item["generated_tags"] or [])]
+                page_ids.extend(match_ids)
+                if len(page_ids) >= page_size:
+                    break
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        snippets = await snippet_store.get_snippets_by_ids(page_ids[:page_size], fields=selected)
+        if len(page_ids) >= page_size and snippets:
+            # Matches are keyset ordered, so the next page resumes right after this one.
+            headers["X-Next-Cursor"] = _snippet_id(snippets[-1])
+        if _wants_ndjson(request, format):
+            return StreamingResponse(
+                _ndjson_lines(None, _iterate(snippets)),
+                media_type=NDJSON_MEDIA_TYPE,
+                headers=headers,
+            )
+        return _etag_response(request, snippets, headers)
+
+    if _wants_ndjson(request, format):
+        snippets = snippet_store.iter_snippets(
+            search_term=search, limit=limit, start_after=start_after, fields=selected, tag=tag
+        )
+        # Pull the first snippet before committing to a 200 so a bad cursor is still a 400.
+        try:
+            first = await snippets.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return StreamingResponse(
+            _ndjson_lines(first, snippets), media_type=NDJSON_MEDIA_TYPE
+        )
 
-                if event.is_final_response():
-                    print(f"[EVENT {event_count}] This is a final response event.")
-                    if (
-                        final_tags_text is not None
-                    ):  # Check if final_tags_text is not None
-                        print(f"  Final text from LlmAgent: '{final_tags_text}'")
-                        raw_tags = final_tags_text.split(",")
-                        parsed_tags_list = [
-                            tag.strip().lower() for tag in raw_tags if tag.strip()
-                        ]
-                        if parsed_tags_list:
-                            print(
-                                f"  Tags parsed from LlmAgent direct output: {parsed_tags_list}"
-                            )
-                        else:
-                            print(
-                                f"  Could not parse tags from LlmAgent direct output: '{final_tags_text}'"
-                            )
-                    elif (
-                        event.content
-                        and event.content.parts
-                        and any(  # Ensure event.content.parts is also checked
-                            p.text for p in event.content.parts if p.text
-                        )
-                    ):  # Check if final event has text not captured
-                        temp_final_text = "".join(
-                            [p.text for p in event.content.parts if p.text]
-                        ).strip()
-                        print(
-                            f"  Final event had text, but not captured in final_tags_text. Text: '{temp_final_text}'"
-                        )
-                    else:
-                        print(
-                            "  No final text content from LlmAgent in this event to parse for tags."
-                        )
-
-            print(
-                f"--- End ADK Event Stream for {session_id_for_adk} (Total Events: {event_count}) ---\n"
+    try:
+        snippets = await snippet_store.get_all_snippets(
+            search_term=search, limit=limit, start_after=start_after, fields=selected, tag=tag
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if limit and len(snippets) == limit:
+        headers["X-Next-Cursor"] = _snippet_id(snippets[-1])
+    return _etag_response(request, snippets, headers)
+
+
+@app.get("/ah-has/changes", response_model=SnippetChanges)
+async def get_ah_ha_changes(
+    since: Optional[str] = None,
+    limit: int = Query(config.CHANGES_DEFAULT_PAGE_SIZE, ge=1, le=config.LIST_MAX_PAGE_SIZE),
+    snippet_store: SnippetStore = Depends(get_snippet_store),
+):
+    """Snippets created, updated or deleted since a cursor, for local caches.
+
+    Omit `since` for a full sync. Store the returned cursor and pass it back
+    as `since` next time; while has_more is true there are more changes to
+    fetch straight away. A 410 means the cursor is older than the deletion
+    tombstones kept, and the client must drop its cache and sync from scratch.
+    """
+    cursor = None
+    if since:
+        try:
+            cursor = ChangeCursor.decode(since)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if cursor.expired():
+            raise HTTPException(
+                status_code=410, detail="Change cursor expired; sync again without `since`."
             )
+    try:
+        batch = await snippet_store.get_changes(cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return SnippetChanges(
+        changed=batch.changed,
+        deleted=batch.deleted,
+        cursor=batch.cursor.encode(),
+        has_more=batch.has_more,
+    )
 
-            if parsed_tags_list:
-                snippet_create_data.generated_tags = parsed_tags_list
-                print(
-                    f"Final Parsed Tags from LlmAgent: {snippet_create_data.generated_tags}"
-                )
-            else:
-                print("ADK LlmAgent response did not yield parseable tags.")
-                snippet_create_data.generated_tags = []
-        except Exception as e:
-            print(f"ERROR generating tags with ADK LlmAgent: {e}")
-            snippet_create_data.generated_tags = []
-    else:
-        if not adk_runner or not tagging_agent:
-            print("ADK LlmAgent or Runner not available. Skipping AI tag generation.")
-        if not snippet_create_data.content:
-            print("Snippet content is empty. Skipping AI tag generation.")
-        snippet_create_data.generated_tags = []
-
-    # Save to Firestore
-    created_snippet = await db_create_snippet(snippet_create_data)
-    print(
-        f"DEBUG: Returning snippet from create_ah_ha: ID='{created_snippet.id}', Type={type(created_snippet.id)}"
-    )  # Debug print
-    return created_snippet
 
+@app.get("/events")
+async def stream_events():
+    """Server-sent events: snippet.created, snippet.updated (tags) and snippet.deleted.
 
-@app.get("/ah-has/", response_model=List[AhHaSnippet])
-async def get_ah_has(search: Optional[str] = None):
-    # Firestore service's get_all_snippets handles search and sorting by timestamp
-    return await db_get_all_snippets(search_term=search)
+    Created events carry the summary fields; the others the ID (plus tags
+    and tagging status for updates). A `resync` event means the client fell
+    behind and was dropped: reconnect and catch up with /ah-has/changes.
+    Comment lines are sent as heartbeats so proxies keep the connection open.
+    """
+    event_bus = get_event_bus()
+    if event_bus.full():
+        raise HTTPException(
+            status_code=503, detail="Too many event stream clients.", headers={"Retry-After": "30"}
+        )
+    return StreamingResponse(
+        event_bus.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/ah-has/{ah_ha_id}/", response_model=AhHaSnippet)
-async def get_ah_ha_by_id(ah_ha_id: str):  # ID is now a string from Firestore
-    snippet = await db_get_snippet_by_id(ah_ha_id)
+async def get_ah_ha_by_id(
+    ah_ha_id: str,
+    request: Request,
+    fields: Optional[str] = None,
+    snippet_store: SnippetStore = Depends(get_snippet_store),
+):  # ID is now a string from Firestore
+    try:
+        selected = parse_fields(fields, None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    snippet = await snippet_store.get_snippet_by_id(ah_ha_id)
     if snippet:
-        return snippet
+        return _etag_response(request, project(snippet, selected) if selected else snippet)
     # return {"error": "Ah-ha not found"} # Or raise HTTPException(status_code=404)
     raise HTTPException(status_code=404, detail="Ah-ha not found")
 
 
+@app.get("/ah-has/{ah_ha_id}/related", response_model=List[AhHaSnippet])
+async def get_related_ah_has(
+    ah_ha_id: str,
+    limit: int = Query(config.SIMILARITY_DEFAULT_LIMIT, ge=1, le=config.LIST_MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    view: Optional[str] = Query(None, pattern="^(full|summary)$"),
+    snippet_store: SnippetStore = Depends(get_snippet_store),
+):
+    """Snippets most similar to this one, best match first.
+
+    fields/view project the results as for GET /ah-has/; only a response
+    with `content` reads content stored out of line.
+    """
+    try:
+        selected = parse_fields(fields, view)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    snippet = await snippet_store.get_snippet_by_id(ah_ha_id)
+    if not snippet:
+        raise HTTPException(status_code=404, detail="Ah-ha not found")
+    matches = await embedding_index.related(snippet, limit)
+    return await snippet_store.get_snippets_by_ids(
+        [snippet_id for snippet_id, _ in matches], fields=selected
+    )
+
+
 @app.delete(
     "/api/v1/snippets/{ah_ha_id}", status_code=204
 )  # 204 No Content for successful delete
-async def delete_ah_ha(ah_ha_id: str):
-    success = await db_delete_snippet_by_id(ah_ha_id)
+async def delete_ah_ha(
+    ah_ha_id: str, snippet_store: SnippetStore = Depends(get_snippet_store)
+):
+    success = await snippet_store.delete_snippet_by_id(ah_ha_id)
     if not success:
         # This could be because the document didn't exist or an actual delete error occurred.
         # For simplicity, we'll treat "not success" as "not found" or "could not delete".
-        # The firestore_service logs the specific error.
+        # The storage backend logs the specific error.
         raise HTTPException(
             status_code=404,
             detail=f"Ah-ha snippet with ID {ah_ha_id} not found or could not be deleted.",
@@ -230,6 +633,187 @@ async def delete_ah_ha(ah_ha_id: str):
     return  # No content to return for 204
 
 
+def require_admin(authorization: Optional[str] = Header(None)):
+    """Admin endpoints need `Authorization: Bearer <ADMIN_TOKEN>`; they are off without a token."""
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled.")
+    expected = f"Bearer {config.ADMIN_TOKEN}".encode("utf-8")
+    if not hmac.compare_digest((authorization or "").encode("utf-8"), expected):
+        raise HTTPException(
+            status_code=401, detail="Invalid admin token.", headers={"WWW-Authenticate": "Bearer"}
+        )
+
+
+@app.get("/admin/export", dependencies=[Depends(require_admin)])
+async def export_ah_has(
+    format: str = Query("ndjson", pattern="^(ndjson|gzip)$"),
+    after: Optional[str] = None,
+    snippet_store: SnippetStore = Depends(get_snippet_store),
+):
+    """Streams every snippet as NDJSON (optionally gzipped), in ID order.
+
+    The store is read a page at a time, so memory stays flat however big
+    the collection is. `after` resumes an interrupted export from the last
+    ID received; the output can be fed back to POST /admin/import as is.
+    """
+
+    async def lines():
+        async for snippet in snippet_store.export_snippets(after):
+            yield to_json(snippet) + b"\n"
+
+    if format == "gzip":
+        return StreamingResponse(
+            gzipped(lines()),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="ah-has.ndjson.gz"'},
+        )
+    return StreamingResponse(
+        lines(),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={"Content-Disposition": 'attachment; filename="ah-has.ndjson"'},
+    )
+
+
+@app.post(
+    "/admin/import", response_model=SnippetImportResult, dependencies=[Depends(require_admin)]
+)
+async def import_ah_has(
+    request: Request,
+    resume_from: int = Query(0, ge=0),
+    retag: bool = False,
+    snippet_store: SnippetStore = Depends(get_snippet_store),
+):
+    """Imports an NDJSON (or gzipped NDJSON) body of snippets, e.g. an export.
+
+    The body is parsed as it arrives and written in batches with a few
+    commits in flight, replacing snippets with the same ID, so importing a
+    file twice is harmless. Invalid lines are skipped and counted. After a
+    failure, send the same file again with `resume_from` set to the
+    returned checkpoint to skip what is already stored. `retag` replaces
+    the file's tags with freshly generated ones.
+    """
+
+    async def write(snippets: List[AhHaSnippet]) -> int:
+        if retag:
+            await _tag_batch(snippets)
+        written = await snippet_store.import_snippets(snippets)
+        if retag:
+            for snippet in written:
+                if snippet.tagging_status == TAGGING_PENDING:
+                    await tagging_queue.enqueue(TaggingJob(snippet=snippet))
+        return len(written)
+
+    writer = BatchWriter(write, config.IMPORT_BATCH_SIZE, config.IMPORT_CONCURRENCY)
+    writer.checkpoint = resume_from
+    lines = invalid = 0
+    finished = False
+    errors: List[str] = []
+    try:
+        async for line in ndjson_lines(request.stream()):
+            lines += 1
+            if lines <= resume_from:
+                continue
+            try:
+                snippet = AhHaSnippet.model_validate_json(line)
+            except ValidationError as e:
+                invalid += 1
+                if len(errors) < 10:
+                    errors.append(f"Line {lines}: {e.errors()[0]['msg']}")
+                continue
+            await writer.add(snippet, lines)
+        finished = True
+    except LineTooLong as e:
+        await writer.flush()
+        raise HTTPException(
+            status_code=413,
+            detail=f"{e} Lines up to {writer.checkpoint} are stored; resume from there.",
+        )
+    except zlib.error as e:
+        await writer.flush()
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"The gzip body is corrupt ({e}). "
+                f"Lines up to {writer.checkpoint} are stored; resume from there."
+            ),
+        )
+    finally:
+        # Also on a dropped connection: let in-flight batches land and log how far we got.
+        await writer.flush()
+        # Past the last batch only invalid lines are left, and they needn't be read again.
+        checkpoint = lines if finished and not writer.failed else writer.checkpoint
+        logger.info(
+            "Import read %d lines: %d written, %d failed, %d invalid, checkpoint %d",
+            lines, writer.written, writer.failed, invalid, checkpoint,
+        )
+
+    return SnippetImportResult(
+        lines=lines,
+        written=writer.written,
+        failed=writer.failed,
+        invalid=invalid,
+        checkpoint=checkpoint,
+        errors=writer.errors + errors,
+    )
+
+
+# Parses both the datetimes Firestore returns and the ISO strings SQLite projections hold.
+_timestamp_adapter = TypeAdapter(Optional[datetime.datetime])
+
+
+@app.post(
+    "/admin/delete", response_model=BulkDeleteResult, dependencies=[Depends(require_admin)]
+)
+async def delete_ah_has(
+    query: BulkDeleteRequest,
+    snippet_store: SnippetStore = Depends(get_snippet_store),
+):
+    """Deletes every snippet matching a search, a tag and/or a capture cutoff.
+
+    Criteria combine with AND; deleting everything needs `all` set
+    explicitly. Matches are streamed and deleted in batches, the same way
+    imports are written. `dry_run` only counts them.
+    """
+    if not (query.search or query.tag or query.before or query.all):
+        raise HTTPException(
+            status_code=400,
+            detail="Give search, tag or before, or set all to delete every snippet.",
+        )
+    cutoff = to_micros(query.before) if query.before else None
+    writer = BatchWriter(
+        snippet_store.delete_snippets, config.IMPORT_BATCH_SIZE, config.IMPORT_CONCURRENCY
+    )
+    matched = 0
+    async for item in snippet_store.iter_snippets(
+        search_term=query.search, tag=query.tag, fields=["id", "timestamp"]
+    ):
+        if cutoff is not None:
+            timestamp = _timestamp_adapter.validate_python(item.get("timestamp"))
+            if timestamp is None or to_micros(timestamp) >= cutoff:
+                continue
+        matched += 1
+        if not query.dry_run:
+            await writer.add(item["id"], matched)
+    await writer.flush()
+    return BulkDeleteResult(
+        matched=matched, deleted=writer.written, failed=writer.failed, errors=writer.errors
+    )
+
+
+@app.get("/tags", response_model=List[TagCount])
+async def get_tags(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1),
+    snippet_store: SnippetStore = Depends(get_snippet_store),
+):
+    """Tag facet counts for the tag cloud, most used first.
+
+    Served from counters kept up to date on every write, so no snippet is
+    read. Filter the list with GET /ah-has/?tag=<tag>.
+    """
+    return _etag_response(request, await snippet_store.get_tag_counts(limit))
+
+
 mock_chat_log = [
     {
         "id": 1,
@@ -289,33 +873,16 @@ async def suggest_tags(request: SnippetText):
     snippet_text = request.snippet
     if not snippet_text or len(snippet_text.split()) < 3:
         return {"suggested_tags": []}
+    # TF-IDF against the stored corpus, so words common to every snippet rank low.
+    return {"suggested_tags": keyword_engine.suggest(snippet_text)}
 
-    text = snippet_text.lower()
-    import re
 
-    text = re.sub(r"[^\w\s]", "", text)
-    words = text.split()
-    min_word_length = 3
-    keywords = [
-        word
-        for word in words
-        if word not in config.STOP_WORDS and len(word) >= min_word_length
+@app.post("/suggest-tags/batch")
+async def suggest_tags_batch(request: SnippetTextBatch):
+    texts = [
+        text if text and len(text.split()) >= 3 else "" for text in request.snippets
     ]
-
-    from collections import Counter
-
-    if not keywords:
-        return {"suggested_tags": []}
-
-    word_counts = Counter(keywords)
-    top_n = 7
-    suggested_tags = []
-    for word, _ in word_counts.most_common():
-        if len(suggested_tags) < top_n:
-            suggested_tags.append(word)
-        else:
-            break
-    return {"suggested_tags": suggested_tags}
+    return {"suggested_tags": keyword_engine.suggest_batch(texts)}
 
 
 if __name__ == "__main__":
@@ -1,13 +1,28 @@
 import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class SnippetText(BaseModel):
     snippet: str
 
 
+class SnippetTextBatch(BaseModel):
+    snippets: List[str]
+
+
+class ContentBlob(BaseModel):
+    # Where content too large for the snippet document is kept, compressed.
+    store: str  # Content store name: 'firestore' or 'local'
+    key: str
+    sha256: str  # Hex digest of the UTF-8 content, checked when it is loaded
+    size: int  # Content bytes before compression
+    stored_size: int  # Bytes after compression
+    codec: str  # 'zstd' or 'gzip'
+    parts: int = 1  # Chunk documents, for the firestore store
+
+
 class AhHaSnippet(BaseModel):
     id: Optional[str] = None  # Firestore IDs are strings
     title: str
@@ -16,4 +31,64 @@ class AhHaSnippet(BaseModel):
     notes: Optional[str] = None
     content_type: Optional[str] = None # To store 'html' or 'text'
     generated_tags: Optional[List[str]] = None
+    tagging_status: Optional[str] = None  # 'pending', 'done', 'fallback', 'failed' or 'skipped'
+    duplicate_of: Optional[str] = None  # ID of the snippet this one near-duplicates
+    preview: Optional[str] = None  # Plain-text start of the content, set on write
     timestamp: Optional[datetime.datetime] = None
+    updated_at: Optional[datetime.datetime] = None  # Last write, set by the store
+    # Set when the content is stored out of line; `content` is then empty
+    # until loaded, which the store does for every response that returns
+    # `content`. Never serialized.
+    content_blob: Optional[ContentBlob] = Field(None, exclude=True)
+
+
+class TagCount(BaseModel):
+    tag: str
+    count: int  # Number of snippets carrying the tag
+
+
+class SnippetChanges(BaseModel):
+    changed: List[AhHaSnippet]  # Created or updated since the cursor, oldest change first
+    deleted: List[str]  # IDs of snippets deleted since the cursor
+    cursor: str  # Opaque; pass it back as `since` on the next call
+    has_more: bool  # More changes are waiting: call again straight away
+
+
+class SnippetBatchRequest(BaseModel):
+    # Items are validated one by one so a malformed item only fails itself.
+    snippets: List[Dict[str, Any]]
+
+
+class SnippetBatchItemResult(BaseModel):
+    index: int  # Position of the item in the request
+    status: str  # 'created' or 'error'
+    snippet: Optional[AhHaSnippet] = None
+    error: Optional[str] = None
+
+
+class SnippetBatchResponse(BaseModel):
+    results: List[SnippetBatchItemResult]
+
+
+class SnippetImportResult(BaseModel):
+    lines: int  # Non-empty lines read, counting from the start of the file
+    written: int  # Snippets created or replaced
+    failed: int  # Snippets in batches that could not be written
+    invalid: int  # Lines that were not valid snippets (skipped)
+    checkpoint: int  # Every line up to this one is stored; pass it back as `resume_from`
+    errors: List[str]  # First few write and validation errors
+
+
+class BulkDeleteRequest(BaseModel):
+    search: Optional[str] = None  # Same matching as GET /ah-has/?search=
+    tag: Optional[str] = None
+    before: Optional[datetime.datetime] = None  # Only snippets captured before this time
+    all: bool = False  # Must be set to delete without any other criterion
+    dry_run: bool = False  # Count the matches without deleting them
+
+
+class BulkDeleteResult(BaseModel):
+    matched: int
+    deleted: int
+    failed: int
+    errors: List[str]
@@ -0,0 +1,30 @@
+"""One-shot job: move large content of existing snippets out of their documents.
+
+Snippets written before the content tier keep their content inline and are
+read as they are, so nothing breaks without this; it shrinks the documents
+(and every listing that reads them) right away instead of on their next
+rewrite. Safe to re-run. Firestore storage only.
+
+Run from ah-ha-backend/:
+    python offload_content.py
+"""
+
+import asyncio
+
+import config
+from services.firestore_service import offload_large_content, warm_up
+
+
+async def main():
+    if config.CONTENT_OFFLOAD_BYTES <= 0:
+        raise SystemExit("CONTENT_OFFLOAD_BYTES is 0, so all content stays inline.")
+    await warm_up()
+    moved = await offload_large_content()
+    print(
+        f"Moved {moved} snippets' content over {config.CONTENT_OFFLOAD_BYTES} bytes "
+        f"to the {config.CONTENT_STORE} content store."
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
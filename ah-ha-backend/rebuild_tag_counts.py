@@ -0,0 +1,27 @@
+"""One-shot job: recount every snippet's tags into the counters behind GET /tags.
+
+Run it once after deploying tag counts on an existing Firestore collection,
+or whenever the counts look off. SQLite databases are recounted
+automatically on first start, but the job works for either backend.
+
+Run from ah-ha-backend/:
+    python rebuild_tag_counts.py
+"""
+
+import asyncio
+
+from services.storage import get_snippet_store
+
+
+async def main():
+    store = get_snippet_store()
+    try:
+        await store.warm_up()
+        tags = await store.rebuild_tag_counts()
+    finally:
+        await store.close()
+    print(f"Recounted {tags} tags in {store.name} storage.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,52 +1,117 @@
+import logging
+import threading
+
 import config
-from google.adk.agents import LlmAgent  # Changed back to LlmAgent
-from google.adk.runners import InMemoryRunner
+
+logger = logging.getLogger(__name__)
 
 # Removed unused imports: genai_sdk, CallbackContext, LlmRequest, LlmResponse, FunctionTool
 
 # Callbacks and generate_tags_tool are removed as LlmAgent will directly generate.
 
 # --- ADK Agent and Runner Initialization ---
+# Built on first use (or by the lifespan warm-up) rather than at import, so
+# workers start serving without paying for google.adk.
 tagging_agent = None
 adk_runner = None
+batch_tagging_agent = None
+batch_adk_runner = None
+_initialized = False
+_init_lock = threading.Lock()
 
-if config.GOOGLE_CLOUD_PROJECT and config.GOOGLE_CLOUD_LOCATION:
-    try:
-        tagging_agent = LlmAgent(  # Changed to LlmAgent
-            name="direct_llm_tag_generator",  # New, simpler name
-            model=config.GOOGLE_GENAI_MODEL,  # This should be "gemini-2.0-flash-live-preview-04-09" or similar
-            description="A direct LLM agent that generates tags for text snippets based on title and content.",
-            instruction=(
-                "You are an expert text analyzer. "
-                "Given a 'Title' and 'Content' of a text snippet, "
-                "your task is to generate 3-5 relevant, concise, comma-separated tags. "
-                "Your entire output MUST be *only* the comma-separated list of tags. "
-                "Do not include any conversational phrases, affirmations, explanations, or any text other than the tags themselves. "
-                "Example input:\nTitle: ADK Events\nContent: Events are fundamental...\nExample output:\nadk,events,framework"
-            ),
-            tools=[],  # LlmAgent for direct generation typically has no tools.
-            # Callbacks removed as they were for tool diagnostics.
-        )
-        print(
-            f"ADK Direct Tagging LlmAgent initialized with model: {tagging_agent.model}."
+
+def init_adk():
+    """Builds the tagging agents and runners once; later calls are no-ops."""
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        try:
+            # Runners installed directly (e.g. the load test's fakes) are kept.
+            if adk_runner is None:
+                _build_agents()
+        finally:
+            # A failed build is not retried on every request; tagging stays off.
+            _initialized = True
+
+
+def _build_agents():
+    global tagging_agent, adk_runner, batch_tagging_agent, batch_adk_runner
+    if config.GOOGLE_CLOUD_PROJECT and config.GOOGLE_CLOUD_LOCATION:
+        # Imported here: google.adk is heavy and not needed to serve reads.
+        from google.adk.agents import LlmAgent  # Changed back to LlmAgent
+        from google.adk.runners import InMemoryRunner
+
+        try:
+            tagging_agent = LlmAgent(  # Changed to LlmAgent
+                name="direct_llm_tag_generator",  # New, simpler name
+                model=config.GOOGLE_GENAI_MODEL,  # This should be "gemini-2.0-flash-live-preview-04-09" or similar
+                description="A direct LLM agent that generates tags for text snippets based on title and content.",
+                instruction=(
+                    "You are an expert text analyzer. "
+                    "Given a 'Title' and 'Content' of a text snippet, "
+                    "your task is to generate 3-5 relevant, concise, comma-separated tags. "
+                    "Your entire output MUST be *only* the comma-separated list of tags. "
+                    "Do not include any conversational phrases, affirmations, explanations, or any text other than the tags themselves. "
+                    "Example input:\nTitle: ADK Events\nContent: Events are fundamental...\nExample output:\nadk,events,framework"
+                ),
+                tools=[],  # LlmAgent for direct generation typically has no tools.
+                # Callbacks removed as they were for tool diagnostics.
+            )
+            logger.info(
+                "ADK Direct Tagging LlmAgent initialized with model: %s.", tagging_agent.model
+            )
+            adk_runner = InMemoryRunner(agent=tagging_agent, app_name="ah-ha-tagging-app")
+            logger.info("ADK InMemoryRunner initialized for LlmAgent.")
+        except Exception as e:
+            logger.exception("Failed to initialize ADK LlmAgent or Runner: %s", e)
+            tagging_agent = None
+            adk_runner = None
+
+        try:
+            # Tags many snippets per request for the batch ingestion endpoint.
+            batch_tagging_agent = LlmAgent(
+                name="batch_llm_tag_generator",
+                model=config.GOOGLE_GENAI_MODEL,
+                description="A direct LLM agent that generates tags for several numbered text snippets at once.",
+                instruction=(
+                    "You are an expert text analyzer. "
+                    "You will be given several numbered snippets, each with a 'Title' and 'Content'. "
+                    "For every snippet, generate 3-5 relevant, concise, lowercase tags. "
+                    "Your entire output MUST be *only* a JSON object mapping each snippet number (as a string) "
+                    "to a JSON array of its tags. "
+                    "Do not include any conversational phrases, explanations, or markdown. "
+                    'Example output:\n{"0": ["adk", "events", "framework"], "1": ["rag", "llm"]}'
+                ),
+                tools=[],
+            )
+            batch_adk_runner = InMemoryRunner(
+                agent=batch_tagging_agent, app_name="ah-ha-batch-tagging-app"
+            )
+            logger.info("ADK InMemoryRunner initialized for batch tagging LlmAgent.")
+        except Exception as e:
+            logger.exception("Failed to initialize ADK batch tagging LlmAgent or Runner: %s", e)
+            batch_tagging_agent = None
+            batch_adk_runner = None
+    else:
+        logger.warning(
+            "config.GOOGLE_CLOUD_PROJECT and/or config.GOOGLE_CLOUD_LOCATION not set. "
+            "ADK AI tag generation will be disabled."
         )
-        adk_runner = InMemoryRunner(agent=tagging_agent, app_name="ah-ha-tagging-app")
-        print("ADK InMemoryRunner initialized for LlmAgent.")
-    except Exception as e:
-        print(f"ERROR: Failed to initialize ADK LlmAgent or Runner: {e}")
-        tagging_agent = None
-        adk_runner = None
-else:
-    print(
-        "WARNING: config.GOOGLE_CLOUD_PROJECT and/or config.GOOGLE_CLOUD_LOCATION not set. "
-        "ADK AI tag generation will be disabled."
-    )
 
 
 def get_adk_runner():
+    init_adk()
     return adk_runner
 
 
 def get_tagging_agent():
+    init_adk()
     return tagging_agent
-    return tagging_agent
+
+
+def get_batch_adk_runner():
+    init_adk()
+    return batch_adk_runner
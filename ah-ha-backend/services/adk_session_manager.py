@@ -0,0 +1,142 @@
+import asyncio
+import inspect
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import config
+from services.metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TrackedSession:
+    runner: object
+    user_id: str
+    session_id: str
+    created_at: float
+
+
+async def _maybe_await(result):
+    # Older ADK releases expose sync session-service methods, newer ones async.
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+class AdkSessionManager:
+    """Owns the lifecycle of the one-shot ADK tagging sessions.
+
+    Every tagging call gets a fresh session that is deleted as soon as the
+    final response has been read, so the InMemoryRunner's session store does
+    not grow for the life of the worker. A periodic sweeper also removes
+    anything left behind (e.g. by a cancelled request) and enforces a hard
+    cap on live sessions.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = config.ADK_MAX_LIVE_SESSIONS,
+        max_age_seconds: float = config.ADK_SESSION_MAX_AGE_SECONDS,
+        sweep_interval_seconds: float = config.ADK_SESSION_SWEEP_INTERVAL_SECONDS,
+    ):
+        self._max_sessions = max_sessions
+        self._max_age_seconds = max_age_seconds
+        self._sweep_interval_seconds = sweep_interval_seconds
+        self._sessions: Dict[Tuple[str, str], TrackedSession] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self.created = 0
+        self.deleted = 0
+        self.swept = 0
+
+    @property
+    def live_sessions(self) -> int:
+        return len(self._sessions)
+
+    async def _delete(self, tracked: TrackedSession):
+        self._sessions.pop((tracked.user_id, tracked.session_id), None)
+        try:
+            await _maybe_await(
+                tracked.runner.session_service.delete_session(
+                    app_name=tracked.runner.app_name,
+                    user_id=tracked.user_id,
+                    session_id=tracked.session_id,
+                )
+            )
+            self.deleted += 1
+        except Exception as e:
+            logger.warning("Failed to delete ADK session %s: %s", tracked.session_id, e)
+
+    @asynccontextmanager
+    async def session(self, runner, temp_adk_id_part: str):
+        """Creates a throwaway session for one agent call and always deletes it."""
+        user_id = f"user_snippet_{temp_adk_id_part}"
+        session_id = f"session_tagging_{temp_adk_id_part}_{os.urandom(4).hex()}"
+        with time_stage("adk_session_create"):
+            await _maybe_await(
+                runner.session_service.create_session(
+                    app_name=runner.app_name, user_id=user_id, session_id=session_id
+                )
+            )
+        tracked = TrackedSession(runner, user_id, session_id, time.monotonic())
+        self._sessions[(user_id, session_id)] = tracked
+        self.created += 1
+        try:
+            yield user_id, session_id
+        finally:
+            await self._delete(tracked)
+
+    async def sweep(self):
+        """Deletes sessions past their max age, then the oldest ones above the cap."""
+        now = time.monotonic()
+        by_age = sorted(self._sessions.values(), key=lambda t: t.created_at)
+        stale = [t for t in by_age if now - t.created_at > self._max_age_seconds]
+        overflow = len(by_age) - len(stale) - self._max_sessions
+        if overflow > 0:
+            stale.extend([t for t in by_age if t not in stale][:overflow])
+        for tracked in stale:
+            await self._delete(tracked)
+            self.swept += 1
+        if stale:
+            logger.info(
+                "ADK session sweeper removed %d sessions; %d live.", len(stale), self.live_sessions
+            )
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self._sweep_interval_seconds)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.exception("Error in ADK session sweeper: %s", e)
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        for tracked in list(self._sessions.values()):
+            await self._delete(tracked)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "live_sessions": self.live_sessions,
+            "created": self.created,
+            "deleted": self.deleted,
+            "swept": self.swept,
+        }
+
+
+session_manager = AdkSessionManager()
+
+
+def get_session_manager() -> AdkSessionManager:
+    return session_manager
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import zlib
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Generic, List, TypeVar
+
+import config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_GZIP_MAGIC = b"\x1f\x8b"
+# Decompressed bytes produced per step, so a small upload can't inflate unbounded.
+_INFLATE_STEP = 1 << 20
+
+
+class LineTooLong(ValueError):
+    pass
+
+
+class BatchWriter(Generic[T]):
+    """Groups items into batches and writes them with bounded concurrency.
+
+    add() waits while `concurrency` batches are in flight, so a producer
+    reading a stream holds at most (concurrency + 1) * batch_size items
+    however large the stream is. A failed batch is counted and reported
+    rather than stopping the others. `checkpoint` is the position of the
+    last item of the longest run of written batches from the start: every
+    item up to it is stored, whatever order the batches finished in.
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[List[T]], Awaitable[int]],
+        batch_size: int,
+        concurrency: int,
+    ):
+        self._write_batch = write_batch
+        self._batch_size = max(1, batch_size)
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._items: List[T] = []
+        self._last_position = 0
+        self._tasks: set = set()
+        # [last position, finished, succeeded] per batch, in submission order.
+        self._batches: Deque[list] = deque()
+        self.checkpoint = 0
+        self.written = 0
+        self.failed = 0
+        self.errors: List[str] = []
+
+    async def add(self, item: T, position: int):
+        self._items.append(item)
+        self._last_position = position
+        if len(self._items) >= self._batch_size:
+            await self._submit()
+
+    async def _submit(self):
+        if not self._items:
+            return
+        items, self._items = self._items, []
+        entry = [self._last_position, False, False]
+        self._batches.append(entry)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._run(items, entry))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, items: List[T], entry: list):
+        try:
+            written = await self._write_batch(items)
+            self.written += written
+            entry[2] = True
+        except Exception as e:
+            self.failed += len(items)
+            if len(self.errors) < 10:
+                self.errors.append(str(e))
+            logger.error("Bulk write of %d items failed: %s", len(items), e)
+        finally:
+            entry[1] = True
+            while self._batches and self._batches[0][1] and self._batches[0][2]:
+                self.checkpoint = self._batches.popleft()[0]
+            self._slots.release()
+
+    async def flush(self):
+        """Writes what is left and waits for every batch."""
+        await self._submit()
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+
+
+async def ndjson_lines(
+    chunks: AsyncIterator[bytes], max_line_bytes: int = config.IMPORT_MAX_LINE_BYTES
+) -> AsyncIterator[bytes]:
+    """Non-empty lines of an NDJSON body as it arrives, gunzipped if it starts
+    with the gzip magic. Raises LineTooLong instead of buffering a runaway line.
+
+    A gzip body may hold several members back to back (what `cat a.gz b.gz`
+    or a parallel gzip writes); they are read one after the other.
+    """
+    inflater = None
+    started = False
+    head = b""
+    pending = b""
+
+    def split(data: bytes):
+        nonlocal pending
+        pending += data
+        *lines, pending = pending.split(b"\n")
+        if len(pending) > max_line_bytes or any(len(line) > max_line_bytes for line in lines):
+            raise LineTooLong(f"An NDJSON line is longer than {max_line_bytes} bytes.")
+        return [line for line in lines if line.strip()]
+
+    def inflate(data: bytes):
+        nonlocal inflater
+        while data:
+            if inflater.eof:
+                # The next member starts in what the last one left unused.
+                inflater = zlib.decompressobj(wbits=31)
+            yield inflater.decompress(data, _INFLATE_STEP)
+            data = inflater.unconsumed_tail or (inflater.unused_data if inflater.eof else b"")
+
+    async for chunk in chunks:
+        if not started:
+            # Wait for enough of the body to tell whether it is gzipped.
+            head += chunk
+            if len(head) < len(_GZIP_MAGIC):
+                continue
+            chunk, head, started = head, b"", True
+            if chunk.startswith(_GZIP_MAGIC):
+                inflater = zlib.decompressobj(wbits=31)
+        if not chunk:
+            continue
+        if inflater is None:
+            for line in split(chunk):
+                yield line
+            continue
+        for data in inflate(chunk):
+            for line in split(data):
+                yield line
+    if head:
+        split(head)
+    if inflater is not None:
+        for line in split(inflater.flush()):
+            yield line
+    if pending.strip():
+        yield pending
+
+
+async def gzipped(
+    chunks: AsyncIterator[bytes], level: int = config.COMPRESSION_GZIP_LEVEL
+) -> AsyncIterator[bytes]:
+    """Gzips a byte stream as it is produced."""
+    deflater = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = deflater.compress(chunk)
+        if compressed:
+            yield compressed
+    yield deflater.flush()
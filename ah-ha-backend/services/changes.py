@@ -0,0 +1,74 @@
+import base64
+import datetime
+import json
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Union
+
+import config
+from models import AhHaSnippet
+
+
+def to_micros(timestamp: Optional[datetime.datetime]) -> int:
+    """Microseconds since the epoch; naive datetimes are taken as UTC."""
+    if timestamp is None:
+        return 0
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    delta = timestamp - datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def from_micros(micros: int) -> datetime.datetime:
+    return datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(
+        microseconds=micros
+    )
+
+
+@dataclass(frozen=True)
+class ChangeCursor:
+    """Position in a store's change feed.
+
+    `changed_at` (microseconds since the epoch) is when the last change the
+    client has seen was written; `key` breaks ties between changes written
+    at the same time (SQLite: the change sequence number, Firestore: the
+    document ID). Clients only ever see it encoded.
+    """
+
+    changed_at: int
+    key: Union[int, str]
+
+    def encode(self) -> str:
+        raw = json.dumps([self.changed_at, self.key], separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    @classmethod
+    def decode(cls, cursor: str) -> "ChangeCursor":
+        """Raises ValueError for anything encode() couldn't have produced."""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            changed_at, key = json.loads(raw)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid change cursor: {cursor}") from e
+        if not isinstance(changed_at, int) or not isinstance(key, (int, str)):
+            raise ValueError(f"Invalid change cursor: {cursor}")
+        return cls(changed_at, key)
+
+    def expired(self) -> bool:
+        """True if tombstones this client hasn't seen may already have been purged.
+
+        The origin cursor (changed_at 0) never expires: a client starting
+        from nothing has nothing to delete.
+        """
+        retention = config.CHANGES_TOMBSTONE_TTL_DAYS * 86400 * 1_000_000
+        return 0 < self.changed_at < time.time() * 1_000_000 - retention
+
+
+@dataclass
+class ChangeBatch:
+    """One page of a change feed, in the order the changes were written."""
+
+    cursor: ChangeCursor  # After the last change returned (the input cursor if none)
+    changed: List[AhHaSnippet] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    has_more: bool = False
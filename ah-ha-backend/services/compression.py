@@ -0,0 +1,174 @@
+import asyncio
+import zlib
+from typing import Dict, Optional
+
+import config
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # Optional dependency: without it only gzip is offered.
+    brotli = None
+
+# Already compressed, or streamed to the client event by event.
+_SKIP_MEDIA_TYPES = ("text/event-stream", "application/gzip", "application/zip")
+_SKIP_MEDIA_PREFIXES = ("image/", "audio/", "video/", "font/")
+# Bodies this large are compressed off the event loop.
+_THREAD_MIN_SIZE = 128 * 1024
+
+
+def _accepted(accept_encoding: str) -> Dict[str, float]:
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        if name:
+            weights[name.strip().lower()] = weight
+    return weights
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Best supported content coding for an Accept-Encoding header, br first."""
+    weights = _accepted(accept_encoding)
+    for encoding in ("br", "gzip") if brotli is not None else ("gzip",):
+        if weights.get(encoding, weights.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def strip_etag_suffix(etag: str) -> str:
+    """Undoes the per-encoding suffix the middleware adds to strong ETags."""
+    for encoding in ("br", "gzip"):
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[: -len(suffix)] + '"'
+    return etag
+
+
+def _client_has_suffixed(if_none_match: str, suffixed: str) -> bool:
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return suffixed in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=config.COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(
+                config.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if final else self._brotli.flush())
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+    async def compress_async(self, data: bytes, final: bool) -> bytes:
+        if len(data) >= _THREAD_MIN_SIZE:
+            return await asyncio.to_thread(self.compress, data, final)
+        return self.compress(data, final)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with br (if available) or gzip.
+
+    Bodies under `minimum_size` are sent as-is, as are responses that are
+    already encoded or streamed as server-sent events. Streaming responses
+    (NDJSON) are flushed chunk by chunk. A strong ETag gets an encoding
+    suffix, since the compressed bytes are a different representation;
+    a 304 keeps the suffix the client's cached copy was served with.
+    """
+
+    def __init__(self, app, minimum_size: int = config.COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = Headers(raw=message["headers"])
+                media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+                passthrough = (
+                    "content-encoding" in headers
+                    or message["status"] in (204, 206, 304)
+                    or media_type in _SKIP_MEDIA_TYPES
+                    or media_type.startswith(_SKIP_MEDIA_PREFIXES)
+                )
+                if message["status"] == 304:
+                    self._not_modified(
+                        message, encoding, request_headers.get("if-none-match", "")
+                    )
+                if passthrough:
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                if more_body:
+                    del headers["Content-Length"]
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+                body = await compressor.compress_async(body, final=not more_body)
+                if not more_body:
+                    headers["Content-Length"] = str(len(body))
+                await send(start_message)
+                start_message = None
+            else:
+                body = await compressor.compress_async(body, final=not more_body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _not_modified(message, encoding: str, if_none_match: str):
+        """Gives a 304 the Vary and ETag headers the 200 it stands for had.
+
+        Whether that 200 was compressed depended on its size, unknown here,
+        so the ETag is suffixed only if the client holds the suffixed tag.
+        """
+        headers = MutableHeaders(raw=message["headers"])
+        headers.add_vary_header("Accept-Encoding")
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            suffixed = f'{etag[:-1]}-{encoding}"'
+            if _client_has_suffixed(if_none_match, suffixed):
+                headers["ETag"] = suffixed
@@ -0,0 +1,266 @@
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+import config
+from models import AhHaSnippet, ContentBlob
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency: without it new content is gzipped.
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_CHUNKS_COLLECTION = "ah_ha_snippet_content"
+# A Firestore commit carries at most 10 MiB, so large blobs take several.
+_MAX_COMMIT_BYTES = 8 * 1024 * 1024
+
+
+def compress(data: bytes) -> Tuple[str, bytes]:
+    """(codec, compressed bytes), zstd when configured and installed."""
+    if config.CONTENT_CODEC == "zstd" and zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=config.CONTENT_ZSTD_LEVEL).compress(data)
+    return "gzip", gzip.compress(data, compresslevel=config.COMPRESSION_GZIP_LEVEL)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("The zstandard package is needed to read zstd-compressed content.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown content codec: {codec}")
+
+
+class LocalContentStore:
+    """Blobs as files in a local directory: one host, or a shared mount."""
+
+    name = "local"
+
+    def __init__(self, root: str):
+        self._root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._root, key)
+
+    def _put(self, key: str, data: bytes):
+        os.makedirs(self._root, exist_ok=True)
+        path = self._path(key)
+        # Written aside and renamed into place, so a reader never sees half a blob.
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _get(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def _delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    async def put(self, key: str, data: bytes) -> int:
+        await asyncio.to_thread(self._put, key, data)
+        return 1
+
+    async def get(self, key: str, parts: int) -> bytes:
+        return await asyncio.to_thread(self._get, key)
+
+    async def delete(self, key: str, parts: int):
+        await asyncio.to_thread(self._delete, key)
+
+
+class FirestoreContentStore:
+    """Blobs split across documents of a collection, under the 1 MiB document cap."""
+
+    name = "firestore"
+
+    def __init__(
+        self,
+        db,
+        collection: str = CONTENT_CHUNKS_COLLECTION,
+        chunk_bytes: int = config.CONTENT_CHUNK_BYTES,
+    ):
+        self._db = db
+        self._collection = db.collection(collection)
+        self._chunk_bytes = max(1, chunk_bytes)
+
+    def _refs(self, key: str, parts: int):
+        return [self._collection.document(f"{key}.{part}") for part in range(parts)]
+
+    async def put(self, key: str, data: bytes) -> int:
+        chunks = [
+            data[start : start + self._chunk_bytes]
+            for start in range(0, len(data), self._chunk_bytes)
+        ] or [b""]
+        refs = self._refs(key, len(chunks))
+        per_commit = max(1, _MAX_COMMIT_BYTES // self._chunk_bytes)
+        for start in range(0, len(chunks), per_commit):
+            batch = self._db.batch()
+            for ref, chunk in zip(refs[start : start + per_commit], chunks[start : start + per_commit]):
+                batch.set(ref, {"data": chunk})
+            await batch.commit()
+        return len(chunks)
+
+    async def get(self, key: str, parts: int) -> bytes:
+        refs = self._refs(key, parts)
+        chunks = {}
+        async for doc in self._db.get_all(refs):
+            if not doc.exists:
+                raise LookupError(f"Content chunk {doc.id} is missing.")
+            chunks[doc.id] = doc.get("data")
+        return b"".join(chunks[ref.id] for ref in refs)
+
+    async def delete(self, key: str, parts: int):
+        batch = self._db.batch()
+        for ref in self._refs(key, parts):
+            batch.delete(ref)
+        await batch.commit()
+
+
+_stores: Dict[str, object] = {}
+_stats = {
+    "stored": 0,
+    "stored_bytes": 0,
+    "compressed_bytes": 0,
+    "loaded": 0,
+    "loaded_bytes": 0,
+    "deleted": 0,
+    "errors": 0,
+}
+
+
+def get_content_store(name: Optional[str] = None):
+    """The content store called `name`, by default the one new content goes to.
+
+    Blobs record the store they were written to, so changing CONTENT_STORE
+    leaves existing content readable.
+    """
+    name = name or config.CONTENT_STORE
+    store = _stores.get(name)
+    if store is None:
+        if name == "local":
+            store = LocalContentStore(config.CONTENT_STORE_PATH)
+        elif name == "firestore":
+            from services.firestore_service import get_db
+
+            db = get_db()
+            if not db:
+                raise ConnectionError("Firestore client not initialized.")
+            store = FirestoreContentStore(db)
+        else:
+            raise ValueError(f"Unknown content store: {name}")
+        _stores[name] = store
+    return store
+
+
+def content_key(snippet_id: str, sha256: str) -> str:
+    # Blobs are immutable: a snippet's new content gets a new key, so a reader
+    # holding the old document still finds the content it refers to.
+    return f"{quote(snippet_id, safe='')}.{sha256}"
+
+
+def offloaded(snippet: AhHaSnippet) -> bool:
+    """Whether the snippet's content is stored out of line and not loaded."""
+    return snippet.content_blob is not None and not snippet.content
+
+
+def without_content(snippet: AhHaSnippet) -> AhHaSnippet:
+    """The snippet as its document holds it, with out-of-line content unloaded."""
+    if snippet.content_blob is None or not snippet.content:
+        return snippet
+    return snippet.model_copy(update={"content": ""})
+
+
+async def store_content(snippet_id: str, content: Optional[str]) -> Optional[ContentBlob]:
+    """Compresses and stores content over CONTENT_OFFLOAD_BYTES; returns where
+    it went, or None when it is small enough to stay in the document."""
+    threshold = config.CONTENT_OFFLOAD_BYTES
+    # UTF-8 takes at most 4 bytes a character, so short content needn't be encoded.
+    if threshold <= 0 or not content or len(content) * 4 <= threshold:
+        return None
+    raw = content.encode("utf-8")
+    if len(raw) <= threshold:
+        return None
+    sha256 = hashlib.sha256(raw).hexdigest()
+    codec, data = await asyncio.to_thread(compress, raw)
+    store = get_content_store()
+    key = content_key(snippet_id, sha256)
+    parts = await store.put(key, data)
+    _stats["stored"] += 1
+    _stats["stored_bytes"] += len(raw)
+    _stats["compressed_bytes"] += len(data)
+    return ContentBlob(
+        store=store.name,
+        key=key,
+        sha256=sha256,
+        size=len(raw),
+        stored_size=len(data),
+        codec=codec,
+        parts=parts,
+    )
+
+
+async def load_content(snippet: AhHaSnippet) -> AhHaSnippet:
+    """A copy of the snippet with its out-of-line content read back; the
+    snippet itself when its content is inline or already loaded."""
+    if not offloaded(snippet):
+        return snippet
+    blob = snippet.content_blob
+    try:
+        data = await get_content_store(blob.store).get(blob.key, blob.parts)
+        raw = await asyncio.to_thread(decompress, blob.codec, data)
+    except Exception:
+        _stats["errors"] += 1
+        raise
+    if hashlib.sha256(raw).hexdigest() != blob.sha256:
+        _stats["errors"] += 1
+        raise ValueError(f"Stored content of snippet {snippet.id} does not match its hash.")
+    _stats["loaded"] += 1
+    _stats["loaded_bytes"] += len(raw)
+    return snippet.model_copy(update={"content": raw.decode("utf-8")})
+
+
+async def load_contents(snippets: List[AhHaSnippet]) -> List[AhHaSnippet]:
+    """load_content over many snippets, CONTENT_LOAD_CONCURRENCY reads at a time."""
+    results = list(snippets)
+    positions = [index for index, snippet in enumerate(snippets) if offloaded(snippet)]
+    if not positions:
+        return results
+    slots = asyncio.Semaphore(max(1, config.CONTENT_LOAD_CONCURRENCY))
+
+    async def load(snippet: AhHaSnippet) -> AhHaSnippet:
+        async with slots:
+            return await load_content(snippet)
+
+    loaded = await asyncio.gather(*(load(snippets[index]) for index in positions))
+    for index, snippet in zip(positions, loaded):
+        results[index] = snippet
+    return results
+
+
+async def delete_content(blobs: Iterable[Optional[ContentBlob]]):
+    """Deletes blobs no document refers to any more. Failures are logged: at
+    worst they leave an orphaned blob behind."""
+    for blob in blobs:
+        if blob is None:
+            continue
+        try:
+            await get_content_store(blob.store).delete(blob.key, blob.parts)
+            _stats["deleted"] += 1
+        except Exception as e:
+            _stats["errors"] += 1
+            logger.warning("Could not delete stored content %s: %s", blob.key, e)
+
+
+def stats() -> Dict[str, float]:
+    return dict(_stats)
@@ -0,0 +1,183 @@
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import config
+import numpy as np
+from models import AhHaSnippet
+from services.keyword_engine import HTML_TAG_RE, WORD_RE
+
+SHINGLE_WORDS = 3
+NUM_PERMUTATIONS = 64
+# 16 bands of 4 rows: pairs above ~0.5 Jaccard almost always share a band.
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+_INITIAL_CAPACITY = 1024
+
+_rng = np.random.default_rng(20240601)
+# Multiply-shift hash family; uint64 arithmetic wraps, which is what we want.
+_PERM_A = _rng.integers(1, 2**63, NUM_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 2**63, NUM_PERMUTATIONS, dtype=np.uint64)
+_BAND_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def dedup_words(snippet: AhHaSnippet) -> List[str]:
+    """Lowercase words of the visible content; title and notes are ignored."""
+    content = snippet.content or ""
+    if snippet.content_type == "html":
+        content = HTML_TAG_RE.sub(" ", content)
+    return WORD_RE.findall(content.lower())
+
+
+def minhash(words: List[str]) -> np.ndarray:
+    """MinHash signature of the word 3-shingles; matching positions estimate Jaccard."""
+    if len(words) < SHINGLE_WORDS:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [
+            " ".join(words[i : i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)
+        ]
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles)
+    )
+    values = (hashes[:, None] * _PERM_A + _PERM_B) >> np.uint64(32)
+    return values.min(axis=0).astype(np.uint32)
+
+
+def band_keys(signature: np.ndarray) -> np.ndarray:
+    keys = np.zeros(BANDS, dtype=np.uint64)
+    for row in signature.reshape(BANDS, ROWS_PER_BAND).T.astype(np.uint64):
+        keys = keys * _BAND_MIX + row
+    return keys
+
+
+class MinHashIndex:
+    """Incremental MinHash-LSH index for near-duplicate captures.
+
+    Signatures and per-band keys live in NumPy matrices; a lookup selects
+    rows sharing at least one band key with a single vectorized comparison,
+    then keeps the candidate with the highest estimated Jaccard similarity
+    of word shingles. Deleted rows are tombstoned until the next rebuild.
+    """
+
+    def __init__(
+        self,
+        threshold: float = config.DEDUP_SIMILARITY_THRESHOLD,
+        min_words: int = config.DEDUP_MIN_WORDS,
+    ):
+        self._threshold = threshold
+        self._min_words = min_words
+        self._reset()
+        self.lookups = 0
+        self.duplicates = 0
+
+    def _reset(self):
+        self._ids: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._signatures = np.zeros((_INITIAL_CAPACITY, NUM_PERMUTATIONS), dtype=np.uint32)
+        self._band_keys = np.zeros((_INITIAL_CAPACITY, BANDS), dtype=np.uint64)
+        self._alive = np.zeros(_INITIAL_CAPACITY, dtype=bool)
+        self._short = np.zeros(_INITIAL_CAPACITY, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _grow(self):
+        capacity = len(self._alive) * 2
+        for name in ("_signatures", "_band_keys", "_alive", "_short"):
+            current = getattr(self, name)
+            grown = np.zeros((capacity,) + current.shape[1:], dtype=current.dtype)
+            grown[: len(current)] = current
+            setattr(self, name, grown)
+
+    def _signature(self, snippet: AhHaSnippet) -> Optional[Tuple[np.ndarray, bool]]:
+        words = dedup_words(snippet)
+        if not words:
+            return None
+        return minhash(words), len(words) < self._min_words
+
+    def add(self, snippet: AhHaSnippet):
+        if not snippet.id:
+            return
+        signature = self._signature(snippet)
+        if signature is None:
+            return
+        self.remove(snippet.id)
+        row = len(self._ids)
+        if row >= len(self._alive):
+            self._grow()
+        self._signatures[row] = signature[0]
+        self._band_keys[row] = band_keys(signature[0])
+        self._short[row] = signature[1]
+        self._alive[row] = True
+        self._ids.append(snippet.id)
+        self._rows[snippet.id] = row
+
+    def remove(self, snippet_id: str):
+        row = self._rows.pop(snippet_id, None)
+        if row is not None:
+            self._alive[row] = False
+            self._ids[row] = None
+
+    def rebuild(self, snippets: List[AhHaSnippet]):
+        self._reset()
+        for snippet in snippets:
+            self.add(snippet)
+
+    def state(self) -> Dict[str, object]:
+        """Everything rebuild() would derive, for load_state() in another process."""
+        rows = np.flatnonzero(self._alive[: len(self._ids)])
+        return {
+            "ids": [self._ids[row] for row in rows],
+            "signatures": self._signatures[rows],
+            "short": self._short[rows],
+        }
+
+    def load_state(self, state: Dict[str, object]):
+        self._reset()
+        ids = list(state["ids"])
+        while len(self._alive) < len(ids):
+            self._grow()
+        count = len(ids)
+        self._signatures[:count] = state["signatures"]
+        self._band_keys[:count] = [band_keys(signature) for signature in state["signatures"]]
+        self._short[:count] = state["short"]
+        self._alive[:count] = True
+        self._ids = ids
+        self._rows = {snippet_id: row for row, snippet_id in enumerate(ids)}
+
+    def find(self, snippet: AhHaSnippet) -> Optional[Tuple[str, float]]:
+        """Returns (ID, estimated similarity) of the closest stored near-duplicate, if any."""
+        signature = self._signature(snippet)
+        if signature is None or not self._rows:
+            return None
+        self.lookups += 1
+        query, short = signature
+        count = len(self._ids)
+        candidates = np.flatnonzero(
+            self._alive[:count] & (self._band_keys[:count] == band_keys(query)).any(axis=1)
+        )
+        if not len(candidates):
+            return None
+        similarity = (self._signatures[candidates] == query).mean(axis=1)
+        # Short texts only match exactly, on either side of the comparison.
+        required = np.where(short | self._short[candidates], 1.0, self._threshold)
+        matches = np.flatnonzero(similarity >= required)
+        if not len(matches):
+            return None
+        best = matches[np.argmax(similarity[matches])]
+        self.duplicates += 1
+        return self._ids[candidates[best]], float(similarity[best])
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "signatures": len(self),
+            "lookups": self.lookups,
+            "duplicates": self.duplicates,
+        }
+
+
+dedup_index = MinHashIndex()
+
+
+def get_dedup_index() -> MinHashIndex:
+    return dedup_index
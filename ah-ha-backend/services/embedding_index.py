@@ -0,0 +1,463 @@
+import asyncio
+import fcntl
+import json
+import logging
+import math
+import os
+import zlib
+from collections import Counter
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+import config
+import numpy as np
+from models import AhHaSnippet
+from services.keyword_engine import keyword_terms, snippet_text
+from services.metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+_INITIAL_CAPACITY = 1024
+# Vertex AI accepts up to 250 inputs per embedding request.
+_GENAI_BATCH_SIZE = 100
+# k-means settings for the IVF index.
+_ANN_TRAIN_ITERATIONS = 8
+_ANN_TRAIN_SAMPLE = 50000
+_ANN_ASSIGN_CHUNK = 8192
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    """Signed feature hashing of the keyword engine's unigrams and bigrams.
+
+    Runs locally with no model or vocabulary, and the same text always maps
+    to the same vector in every process (crc32, not Python's salted hash).
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for term, count in Counter(keyword_terms(text)).items():
+            digest = zlib.crc32(term.encode("utf-8"))
+            # Low bits pick the slot and the top bit the sign, so collisions tend to cancel.
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            vector[digest % self.dim] += sign * (1.0 + math.log(count))
+        return vector
+
+    def _embed_sync(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return _normalize(np.stack([self._embed_one(text) for text in texts]))
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        return await asyncio.to_thread(self._embed_sync, list(texts))
+
+
+class GenAiEmbedder:
+    """Embeddings from a hosted text-embedding model, truncated to `dim` dimensions."""
+
+    name = "genai"
+
+    def __init__(self, dim: int, model: str):
+        from google import genai
+        from google.genai import types as genai_types
+
+        self.dim = dim
+        self._model = model
+        self._client = genai.Client(
+            vertexai=True,
+            project=config.GOOGLE_CLOUD_PROJECT,
+            location=config.GOOGLE_CLOUD_LOCATION,
+        )
+        self._config = genai_types.EmbedContentConfig(output_dimensionality=dim)
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        values = []
+        for start in range(0, len(texts), _GENAI_BATCH_SIZE):
+            chunk = [
+                text[: config.TEXT_EXTRACTION_MAX_OUTPUT_CHARS]
+                for text in texts[start : start + _GENAI_BATCH_SIZE]
+            ]
+            response = await self._client.aio.models.embed_content(
+                model=self._model, contents=chunk, config=self._config
+            )
+            values.extend(embedding.values for embedding in response.embeddings)
+        return _normalize(np.asarray(values, dtype=np.float32).reshape(-1, self.dim))
+
+
+class LazyEmbedder:
+    """Builds the embedder on first use rather than at import, so importing
+    the app creates no API client; `dim` is known up front."""
+
+    def __init__(self, build: Callable[[], object], dim: int):
+        self._build = build
+        self._embedder = None
+        self.dim = dim
+
+    def _get(self):
+        if self._embedder is None:
+            self._embedder = self._build()
+        return self._embedder
+
+    @property
+    def name(self) -> str:
+        return self._get().name
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        return await self._get().embed(texts)
+
+
+class EmbeddingIndex:
+    """Top-k cosine similarity over one vector per snippet.
+
+    Vectors live in a contiguous float32 matrix (memory-mapped when a path
+    is configured, so restarts don't re-embed the corpus) and queries are a
+    single matrix-vector product. Once the corpus passes `ann_threshold`, a
+    k-means IVF index narrows each query to the rows of the `ann_probes`
+    nearest clusters. Deleted rows are tombstoned and compacted away by the
+    next rebuild.
+    """
+
+    def __init__(
+        self,
+        embedder,
+        path: Optional[str] = None,
+        ann_threshold: int = config.EMBEDDING_ANN_THRESHOLD,
+        ann_probes: int = config.EMBEDDING_ANN_PROBES,
+        min_score: float = config.EMBEDDING_MIN_SCORE,
+    ):
+        self._embedder = embedder
+        self.dim = embedder.dim
+        self._path = path or None
+        self._lock_fd: Optional[int] = None
+        self._ann_threshold = ann_threshold
+        self._ann_probes = ann_probes
+        self._min_score = min_score
+        self._ids: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        # In memory until rebuild() has read any persisted vectors; it then maps the file.
+        self._matrix: np.ndarray = np.zeros((_INITIAL_CAPACITY, self.dim), dtype=np.float32)
+        self._alive = np.zeros(_INITIAL_CAPACITY, dtype=bool)
+        self._centroids: Optional[np.ndarray] = None
+        self._members: List[List[int]] = []
+        self.queries = 0
+        self.ann_queries = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, snippet_id: str) -> bool:
+        return snippet_id in self._rows
+
+    # --- storage ---------------------------------------------------------------
+
+    def _allocate(self, capacity: int, fresh: bool = False) -> np.ndarray:
+        if not self._path:
+            return np.zeros((capacity, self.dim), dtype=np.float32)
+        size = capacity * self.dim * np.dtype(np.float32).itemsize
+        with open(self._path, "w+b" if fresh else "r+b") as f:
+            # Grows (or creates) the file; existing rows are kept on growth.
+            f.truncate(size)
+        return np.memmap(self._path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def _grow(self, needed: int):
+        capacity = len(self._alive)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        if isinstance(self._matrix, np.memmap):
+            self._matrix.flush()
+            self._matrix = self._allocate(capacity)
+        else:
+            matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+            matrix[: len(self._ids)] = self._matrix[: len(self._ids)]
+            self._matrix = matrix
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: len(self._ids)] = self._alive[: len(self._ids)]
+        self._alive = alive
+
+    def _claim_path(self) -> bool:
+        """Locks the file for this process; False if another process has it.
+
+        Every write goes through this process's mapping, and a rebuild
+        truncates the file, so two processes must never share it.
+        """
+        if self._lock_fd is not None:
+            return True
+        fd = os.open(f"{self._path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        # Held until the process exits.
+        self._lock_fd = fd
+        return True
+
+    def _metadata_path(self) -> str:
+        return f"{self._path}.json"
+
+    def _load_persisted(self) -> Dict[str, np.ndarray]:
+        """Returns the vectors saved by the previous process, keyed by snippet ID."""
+        if not self._path or not os.path.exists(self._metadata_path()):
+            return {}
+        try:
+            with open(self._metadata_path()) as f:
+                metadata = json.load(f)
+            if metadata.get("dim") != self.dim or metadata.get("embedder") != self._embedder.name:
+                return {}
+            ids = metadata["ids"]
+            if not ids:
+                return {}
+            matrix = np.memmap(self._path, dtype=np.float32, mode="r", shape=(len(ids), self.dim))
+            return {snippet_id: np.array(matrix[row]) for row, snippet_id in enumerate(ids) if snippet_id}
+        except Exception as e:
+            logger.warning("Ignoring unreadable embedding index at %s: %s", self._path, e)
+            return {}
+
+    def flush(self):
+        if not isinstance(self._matrix, np.memmap):
+            return
+        self._matrix.flush()
+        with open(self._metadata_path(), "w") as f:
+            json.dump({"dim": self.dim, "embedder": self._embedder.name, "ids": self._ids}, f)
+
+    # --- maintenance -----------------------------------------------------------
+
+    def _append(self, ids: Sequence[str], vectors: np.ndarray):
+        for snippet_id in ids:
+            self.remove(snippet_id)
+        start = len(self._ids)
+        self._grow(start + len(ids))
+        self._matrix[start : start + len(ids)] = vectors
+        self._alive[start : start + len(ids)] = True
+        for offset, snippet_id in enumerate(ids):
+            self._ids.append(snippet_id)
+            self._rows[snippet_id] = start + offset
+        if self._centroids is not None:
+            clusters = np.argmax(vectors @ self._centroids.T, axis=1)
+            for offset, cluster in enumerate(clusters):
+                self._members[cluster].append(start + offset)
+        elif len(self) >= self._ann_threshold:
+            self._train_ann()
+
+    async def add_snippets(self, snippets: Sequence[AhHaSnippet]):
+        snippets = [snippet for snippet in snippets if snippet.id]
+        if not snippets:
+            return
+        try:
+            with time_stage("embedding"):
+                vectors = await self._embedder.embed([snippet_text(s) for s in snippets])
+        except Exception as e:
+            # Similarity is best effort; a snippet without a vector just isn't "related".
+            logger.warning("Could not embed %d snippets: %s", len(snippets), e)
+            return
+        self._append([snippet.id for snippet in snippets], vectors)
+
+    def remove(self, snippet_id: str):
+        row = self._rows.pop(snippet_id, None)
+        if row is not None:
+            self._alive[row] = False
+            self._ids[row] = None
+
+    def _claim_or_keep_in_memory(self):
+        if self._path and not self._claim_path():
+            logger.warning(
+                "Embedding index %s is in use by another process; keeping vectors in memory.",
+                self._path,
+            )
+            self._path = None
+
+    def _replace(self, embedded: Dict[str, np.ndarray]):
+        self._ids, self._rows = [], {}
+        self._matrix = self._allocate(_INITIAL_CAPACITY, fresh=True)
+        self._alive = np.zeros(_INITIAL_CAPACITY, dtype=bool)
+        self._centroids, self._members = None, []
+        if embedded:
+            ids = list(embedded)
+            self._append(ids, np.stack([embedded[snippet_id] for snippet_id in ids]))
+        self.flush()
+
+    async def rebuild(self, snippets: Sequence[AhHaSnippet]):
+        """Replaces the index with `snippets`, reusing persisted vectors where possible."""
+        self._claim_or_keep_in_memory()
+        persisted = self._load_persisted()
+        snippets = [snippet for snippet in snippets if snippet.id]
+        missing = [snippet for snippet in snippets if snippet.id not in persisted]
+        vectors = np.zeros((0, self.dim), dtype=np.float32)
+        if missing:
+            try:
+                with time_stage("embedding"):
+                    vectors = await self._embedder.embed([snippet_text(s) for s in missing])
+            except Exception as e:
+                logger.warning("Could not embed %d snippets at startup: %s", len(missing), e)
+                missing = []
+        embedded = dict(zip((snippet.id for snippet in missing), vectors))
+        embedded.update(
+            (snippet.id, persisted[snippet.id]) for snippet in snippets if snippet.id in persisted
+        )
+
+        self._replace(embedded)
+        logger.info(
+            "Embedding index rebuilt with %d vectors (%d reused, %d embedded).",
+            len(self),
+            len(embedded) - len(missing),
+            len(missing),
+        )
+
+    def state(self) -> Dict[str, object]:
+        """The live vectors, for load_state() in another process."""
+        rows = np.flatnonzero(self._alive[: len(self._ids)])
+        return {
+            "ids": [self._ids[row] for row in rows],
+            "vectors": np.asarray(self._matrix[rows], dtype=np.float32),
+            "embedder": [self._embedder.name],
+        }
+
+    def load_state(self, state: Dict[str, object]) -> bool:
+        """Replaces the index with saved vectors; False (and unchanged) if they
+        came from another embedder or dimension."""
+        vectors = state["vectors"]
+        if list(state["embedder"]) != [self._embedder.name] or vectors.shape[1:] != (self.dim,):
+            return False
+        self._claim_or_keep_in_memory()
+        self._replace(dict(zip(state["ids"], vectors)))
+        logger.info("Embedding index loaded with %d saved vectors.", len(self))
+        return True
+
+    def _train_ann(self):
+        """Spherical k-means over a sample of the live rows, then assigns every row."""
+        rows = np.flatnonzero(self._alive[: len(self._ids)])
+        rng = np.random.default_rng(0)
+        sample = self._matrix[rng.permutation(rows)[:_ANN_TRAIN_SAMPLE]]
+        clusters = int(min(4096, len(sample), max(16, math.sqrt(len(rows)))))
+        centroids = sample[rng.choice(len(sample), clusters, replace=False)].copy()
+        with time_stage("embedding_ann_train"):
+            for _ in range(_ANN_TRAIN_ITERATIONS):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                # Per-cluster sums via one sorted reduceat (np.add.at is far slower).
+                order = np.argsort(assignment, kind="stable")
+                sorted_assignment = assignment[order]
+                starts = np.flatnonzero(
+                    np.r_[True, sorted_assignment[1:] != sorted_assignment[:-1]]
+                )
+                sums = np.zeros_like(centroids)
+                sums[sorted_assignment[starts]] = np.add.reduceat(sample[order], starts, axis=0)
+                empty = ~np.bincount(assignment, minlength=clusters).astype(bool)
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+                centroids = _normalize(sums)
+            members: List[List[int]] = [[] for _ in range(clusters)]
+            for start in range(0, len(rows), _ANN_ASSIGN_CHUNK):
+                chunk = rows[start : start + _ANN_ASSIGN_CHUNK]
+                for row, cluster in zip(chunk, np.argmax(self._matrix[chunk] @ centroids.T, axis=1)):
+                    members[cluster].append(int(row))
+        self._centroids, self._members = centroids, members
+        logger.info("Embedding IVF index trained: %d clusters over %d vectors.", clusters, len(rows))
+
+    # --- queries ---------------------------------------------------------------
+
+    def _candidates(self, query: np.ndarray) -> np.ndarray:
+        count = len(self._ids)
+        if self._centroids is None:
+            return np.flatnonzero(self._alive[:count])
+        self.ann_queries += 1
+        probes = np.argsort(-(self._centroids @ query))[: self._ann_probes]
+        rows = np.concatenate([np.asarray(self._members[c], dtype=np.int64) for c in probes])
+        return rows[self._alive[rows]]
+
+    def _top_k(
+        self,
+        query: np.ndarray,
+        k: int,
+        start_after: Optional[str] = None,
+        exclude: Optional[str] = None,
+    ) -> List[Tuple[str, float]]:
+        """Best matches ordered by (score desc, row asc); `start_after` is a keyset cursor."""
+        self.queries += 1
+        rows = self._candidates(query)
+        if exclude is not None and exclude in self._rows:
+            rows = rows[rows != self._rows[exclude]]
+        scores = self._matrix[rows] @ query
+        keep = scores >= self._min_score
+        if start_after:
+            cursor_row = self._rows.get(start_after)
+            if cursor_row is None:
+                raise ValueError(f"Unknown start_after cursor: {start_after}")
+            cursor_score = float(self._matrix[cursor_row] @ query)
+            keep &= (scores < cursor_score) | ((scores == cursor_score) & (rows > cursor_row))
+        rows, scores = rows[keep], scores[keep]
+        if len(rows) > k:
+            top = np.argpartition(-scores, k)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.lexsort((rows, -scores))
+        return [(self._ids[rows[i]], float(scores[i])) for i in order]
+
+    async def related(self, snippet: AhHaSnippet, k: int) -> List[Tuple[str, float]]:
+        """Snippets most similar to `snippet`, excluding itself."""
+        row = self._rows.get(snippet.id)
+        if row is not None:
+            query = np.array(self._matrix[row])
+        else:
+            query = (await self._embedder.embed([snippet_text(snippet)]))[0]
+        with time_stage("embedding_query"):
+            return self._top_k(query, k, exclude=snippet.id)
+
+    async def search(
+        self, text: str, k: int, start_after: Optional[str] = None
+    ) -> List[Tuple[str, float]]:
+        query = (await self._embedder.embed([text]))[0]
+        with time_stage("embedding_query"):
+            return self._top_k(query, k, start_after=start_after)
+
+    async def search_pages(
+        self, text: str, k: int, start_after: Optional[str] = None
+    ) -> AsyncIterator[List[Tuple[str, float]]]:
+        """search() one page of up to `k` matches after another, until they run
+        out; the text is embedded once. For callers that filter matches and
+        need to read on until a page of theirs is full."""
+        query = (await self._embedder.embed([text]))[0]
+        while True:
+            with time_stage("embedding_query"):
+                matches = self._top_k(query, k, start_after=start_after)
+            if matches:
+                yield matches
+            if len(matches) < k:
+                return
+            start_after = matches[-1][0]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "vectors": len(self),
+            "rows": len(self._ids),
+            "dim": self.dim,
+            "ann_clusters": 0 if self._centroids is None else len(self._centroids),
+            "queries": self.queries,
+            "ann_queries": self.ann_queries,
+        }
+
+
+def _build_embedder():
+    if config.EMBEDDING_BACKEND == "genai":
+        try:
+            return GenAiEmbedder(config.EMBEDDING_DIM, config.EMBEDDING_MODEL)
+        except Exception as e:
+            logger.error("Failed to initialize GenAI embedder, using local hashing: %s", e)
+    return HashingEmbedder(config.EMBEDDING_DIM)
+
+
+embedding_index = EmbeddingIndex(
+    LazyEmbedder(_build_embedder, config.EMBEDDING_DIM), path=config.EMBEDDING_INDEX_PATH
+)
+
+
+def get_embedding_index() -> EmbeddingIndex:
+    return embedding_index
@@ -0,0 +1,145 @@
+import asyncio
+from typing import AsyncIterator, Dict, Optional, Set
+
+import config
+from pydantic_core import to_json
+
+EVENT_CREATED = "snippet.created"
+EVENT_UPDATED = "snippet.updated"
+EVENT_DELETED = "snippet.deleted"
+# Sent to an evicted client: reconnect and catch up with /ah-has/changes.
+EVENT_RESYNC = "resync"
+
+_HEARTBEAT = b": ping\n\n"
+
+
+def format_event(event: str, data) -> bytes:
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + to_json(data) + b"\n\n"
+
+
+class _Subscriber:
+    def __init__(self, buffer_size: int):
+        self.queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(maxsize=buffer_size)
+
+    def close(self, last_message: Optional[bytes] = None):
+        """Replaces whatever is still buffered with an optional final message and the end marker."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        if last_message is not None:
+            self.queue.put_nowait(last_message)
+        self.queue.put_nowait(None)
+
+
+class EventBus:
+    """Fans snippet events out to server-sent event streams in this worker.
+
+    Each event is serialized once and offered to every subscriber's bounded
+    queue without waiting. A client whose queue is full has fallen too far
+    behind: it is evicted with a final `resync` event rather than slowing
+    everyone else down or buffering without limit.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = config.EVENTS_CLIENT_BUFFER,
+        heartbeat_seconds: float = config.EVENTS_HEARTBEAT_SECONDS,
+        max_clients: int = config.EVENTS_MAX_CLIENTS,
+    ):
+        self._buffer_size = max(2, buffer_size)
+        self._heartbeat_seconds = heartbeat_seconds
+        self._max_clients = max_clients
+        self._subscribers: Set[_Subscriber] = set()
+        # False once a Firestore snapshot listener feeds the bus (it sees every
+        # worker's writes, this one's included).
+        self.local_publish = True
+        self.published = 0
+        self.delivered = 0
+        self.evicted = 0
+        self.heartbeats = 0
+
+    def publish(self, event: str, data):
+        if not self._subscribers:
+            return
+        message = format_event(event, data)
+        self.published += 1
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(message)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                self._subscribers.discard(subscriber)
+                subscriber.close(format_event(EVENT_RESYNC, {"reason": "slow_consumer"}))
+                self.evicted += 1
+
+    def publish_local(self, event: str, data):
+        """Publishes a write made by this worker, unless a listener already reports it."""
+        if self.local_publish:
+            self.publish(event, data)
+
+    def full(self) -> bool:
+        return len(self._subscribers) >= self._max_clients
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        """One client's event stream, with a comment line every heartbeat interval."""
+        subscriber = _Subscriber(self._buffer_size)
+        self._subscribers.add(subscriber)
+        try:
+            # Tells EventSource how long to wait before reconnecting.
+            yield f"retry: {int(config.EVENTS_RETRY_MILLISECONDS)}\n\n".encode("ascii")
+            while True:
+                try:
+                    message = await asyncio.wait_for(
+                        subscriber.queue.get(), timeout=self._heartbeat_seconds
+                    )
+                except asyncio.TimeoutError:
+                    self.heartbeats += 1
+                    yield _HEARTBEAT
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def close(self):
+        """Ends every open stream, e.g. on shutdown so workers don't wait on them."""
+        for subscriber in list(self._subscribers):
+            subscriber.close()
+        self._subscribers.clear()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "clients": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "evicted": self.evicted,
+            "heartbeats": self.heartbeats,
+        }
+
+
+event_bus = EventBus()
+
+
+def get_event_bus() -> EventBus:
+    return event_bus
+
+
+def publish_snapshot_change(change_type: str, snippet_id: str, data: Optional[dict]):
+    """Turns a Firestore snapshot change (ADDED, MODIFIED, REMOVED) into an event."""
+    from services.projection import SUMMARY_FIELDS
+
+    if change_type == "REMOVED":
+        event_bus.publish(EVENT_DELETED, {"id": snippet_id})
+        return
+    data = {**(data or {}), "id": snippet_id}
+    if change_type == "ADDED":
+        event_bus.publish(EVENT_CREATED, {field: data.get(field) for field in SUMMARY_FIELDS})
+    else:
+        event_bus.publish(
+            EVENT_UPDATED,
+            {
+                "id": snippet_id,
+                "generated_tags": data.get("generated_tags"),
+                "tagging_status": data.get("tagging_status"),
+            },
+        )
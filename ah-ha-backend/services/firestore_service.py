@@ -1,46 +1,142 @@
+import asyncio
+import datetime
+import logging
+import os
+import time
+from collections import Counter
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from urllib.parse import quote
+
+import config
+from google.api_core.exceptions import FailedPrecondition, NotFound
 from google.cloud import firestore_v1 as firestore  # Use firestore_v1 for AsyncClient
+from google.cloud.firestore_v1.field_path import FieldPath
+from models import AhHaSnippet, ContentBlob, TagCount  # Assuming AhHaSnippet is in models.py
+from services.changes import ChangeBatch, ChangeCursor, from_micros, to_micros
+from services.content_store import (
+    delete_content,
+    load_content,
+    load_contents,
+    offloaded,
+    store_content,
+    without_content,
+)
+from services.index_snapshot import SnapshotSearchIndex
+from services.index_state import load_index_state, save_index_state
+from services.metrics import observe_stage, time_stage
+from services.projection import make_preview, make_previews, project
+from services.search_index import get_search_index, snippet_tokens, tokenize
+from services.snippet_cache import snippet_cache
+from services.storage import (
+    SnippetFields,
+    SnippetStore,
+    index_created,
+    index_deleted,
+    index_loaded,
+    index_refreshed,
+    index_tags_updated,
+)
 
-db = None
-try:
-    # Always attempt to initialize the client.
-    # If GOOGLE_APPLICATION_CREDENTIALS is set, it will use that.
-    # If not set, it will attempt to use Application Default Credentials (ADC).
-    db = firestore.AsyncClient()  # Changed to AsyncClient
-    print(
-        "Firestore client initialized successfully (attempted with ADC or GOOGLE_APPLICATION_CREDENTIALS if set)."
-    )
-except Exception as e:
-    print(f"ERROR: Failed to initialize Firestore client: {e}")
-    print(
-        "Ensure your Google Cloud project is correctly configured and that you have authenticated via 'gcloud auth application-default login' if not using a service account JSON."
-    )
-    db = None  # Ensure db is None if initialization fails
+search_index = get_search_index()
 
+SNIPPETS_COLLECTION = "ah_ha_snippets"
+# One document per tag holding the number of snippets that carry it.
+TAG_COUNTS_COLLECTION = "ah_ha_tag_counts"
+# One document per deleted snippet (same ID) for the change feed. Enable a
+# Firestore TTL policy on its expire_at field to purge old tombstones.
+TOMBSTONES_COLLECTION = "ah_ha_snippet_tombstones"
+# Attempts for read-then-write updates whose precondition lost a race.
+_PRECONDITION_ATTEMPTS = 3
+# Change feed position the search index is current up to, once built.
+_index_cursor: Optional[ChangeCursor] = None
+_INDEX_REFRESH_OVERLAP_MICROS = 60 * 1_000_000
+_INDEX_REFRESH_PAGE_SIZE = 500
 
-import datetime
-from typing import List, Optional
+T = TypeVar("T")
 
-from models import AhHaSnippet  # Assuming AhHaSnippet is in models.py
+logger = logging.getLogger(__name__)
 
-SNIPPETS_COLLECTION = "ah_ha_snippets"
+# Created by init_db() from the app lifespan (or on first use), not at import.
+db = None
+_db_initialized = False
 
 
-def get_db():
+def init_db():
+    """Creates the Firestore AsyncClient once; later calls return the same client."""
+    global db, _db_initialized
+    if _db_initialized or db is not None:
+        _db_initialized = True
+        return db
+    _db_initialized = True
+    try:
+        # Always attempt to initialize the client.
+        # If GOOGLE_APPLICATION_CREDENTIALS is set, it will use that.
+        # If not set, it will attempt to use Application Default Credentials (ADC).
+        db = firestore.AsyncClient()  # Changed to AsyncClient
+        logger.info(
+            "Firestore client initialized successfully (attempted with ADC or GOOGLE_APPLICATION_CREDENTIALS if set)."
+        )
+    except Exception as e:
+        logger.error(
+            "Failed to initialize Firestore client: %s. Ensure your Google Cloud project is correctly configured and that you have authenticated via 'gcloud auth application-default login' if not using a service account JSON.",
+            e,
+        )
+        db = None  # Ensure db is None if initialization fails
     return db
 
 
-async def create_snippet(snippet_data: AhHaSnippet) -> AhHaSnippet:
-    """Creates a new snippet in Firestore."""
+def get_db():
+    return init_db()
+
+
+async def warm_up():
+    """Opens the gRPC channel and fetches credentials before the first request needs them."""
+    db = get_db()
     if not db:
-        raise ConnectionError("Firestore client not initialized.")
+        return
+    with time_stage("firestore_warm_up"):
+        async for _ in db.collection(SNIPPETS_COLLECTION).limit(1).stream():
+            pass
 
-    # Firestore will auto-generate an ID for the new document
-    doc_ref = db.collection(SNIPPETS_COLLECTION).document()
 
+def _tag_count_ref(db, tag: str):
+    # Tags may contain "/", which Firestore document IDs can't.
+    return db.collection(TAG_COUNTS_COLLECTION).document(quote(tag, safe=""))
+
+
+def _snippet_tags(snippet_tags: Optional[List[str]]) -> Counter:
+    return Counter(set(snippet_tags or []))
+
+
+def _add_tag_count_writes(db, batch, deltas: Counter):
+    """Adds counter increments to a write batch so they commit with the snippet writes."""
+    for tag, delta in deltas.items():
+        if delta:
+            batch.set(
+                _tag_count_ref(db, tag),
+                {"tag": tag, "count": firestore.Increment(delta)},
+                merge=True,
+            )
+
+
+def _prepare_snippet_dict(snippet_data: AhHaSnippet, doc_id: str) -> dict:
     # Prepare data for Firestore (Pydantic model to dict)
     # Ensure timestamp is a Firestore-compatible timestamp
     snippet_dict = snippet_data.model_dump(exclude_none=True)
-    snippet_dict["id"] = doc_ref.id  # Use Firestore's generated ID
+    snippet_dict["id"] = doc_id  # Use Firestore's generated ID
     if isinstance(snippet_dict.get("timestamp"), datetime.datetime):
         snippet_dict["timestamp"] = (
             firestore.SERVER_TIMESTAMP
@@ -50,109 +146,1269 @@ async def create_snippet(snippet_data: AhHaSnippet) -> AhHaSnippet:
         # ensure it's handled or converted appropriately, or set to server time.
         # For simplicity, we'll use server timestamp if not already a proper datetime.
         snippet_dict["timestamp"] = firestore.SERVER_TIMESTAMP
+    snippet_dict["updated_at"] = firestore.SERVER_TIMESTAMP
+    return snippet_dict
 
-    await doc_ref.set(snippet_dict)
 
-    # Fetch the document to get server-generated timestamp and ensure all fields are present
-    created_doc = await doc_ref.get()
-    if created_doc.exists:
-        data = created_doc.to_dict()
-        if data and "title" in data and "content" in data:  # Ensure required fields
-            # Pydantic will handle optional fields if not present in data
-            return AhHaSnippet(**data)
-        else:
-            print(
-                f"Firestore document {doc_ref.id} created but missing required fields upon retrieval. Data: {data}"
-            )
-            # Fallback or raise error, for now returning based on input + ID
-            # This indicates a potential issue with data consistency or Firestore behavior
-            return snippet_data.model_copy(update={"id": doc_ref.id})
+async def _store_large_content(snippet_dict: dict) -> Optional[ContentBlob]:
+    """Moves content over CONTENT_OFFLOAD_BYTES out of a document about to be
+    written; the document keeps the preview and the blob's hash and location."""
+    blob = await store_content(snippet_dict["id"], snippet_dict.get("content"))
+    if blob is not None:
+        snippet_dict["content"] = ""
+        snippet_dict["content_blob"] = blob.model_dump()
+    return blob
+
+
+async def _store_large_contents(snippet_dicts: List[dict]) -> List[Optional[ContentBlob]]:
+    """_store_large_content over several documents; if any store fails, the
+    blobs the others wrote are deleted before the error is raised."""
+    results = await asyncio.gather(
+        *(_store_large_content(snippet_dict) for snippet_dict in snippet_dicts),
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        await delete_content(result for result in results if isinstance(result, ContentBlob))
+        raise errors[0]
+    return results
+
+
+def _stored_blob(data: Optional[dict]) -> Optional[ContentBlob]:
+    blob = (data or {}).get("content_blob")
+    return ContentBlob(**blob) if blob else None
+
+
+async def create_snippet(snippet_data: AhHaSnippet) -> AhHaSnippet:
+    """Creates a new snippet in Firestore.
+
+    The response is built from the input, the generated ID and the write
+    result's update_time (the commit time SERVER_TIMESTAMP resolves to), so a
+    create costs a single RPC. Set FIRESTORE_STRICT_CREATE_READBACK to read the
+    document back instead, e.g. when debugging what Firestore actually stored.
+    """
+    db = get_db()
+    if not db:
+        raise ConnectionError("Firestore client not initialized.")
+
+    # Firestore will auto-generate an ID for the new document
+    snippet_data.preview = await make_preview(snippet_data)
+    doc_ref = db.collection(SNIPPETS_COLLECTION).document()
+    snippet_dict = _prepare_snippet_dict(snippet_data, doc_ref.id)
+    content_blob = await _store_large_content(snippet_dict)
+
+    tag_counts = _snippet_tags(snippet_data.generated_tags)
+    try:
+        with time_stage("firestore_set"):
+            if tag_counts:
+                # The tag counters are updated in the same atomic commit as the snippet.
+                batch = db.batch()
+                batch.set(doc_ref, snippet_dict)
+                _add_tag_count_writes(db, batch, tag_counts)
+                write_result = (await batch.commit())[0]
+            else:
+                write_result = await doc_ref.set(snippet_dict)
+    except Exception:
+        await delete_content([content_blob])
+        raise
+
+    if config.FIRESTORE_STRICT_CREATE_READBACK:
+        created_snippet = await load_content(
+            await _read_back_created_snippet(doc_ref, snippet_data)
+        )
     else:
+        created_snippet = snippet_data.model_copy(
+            update={
+                "id": doc_ref.id,
+                "timestamp": write_result.update_time,
+                "updated_at": write_result.update_time,
+                "content_blob": content_blob,
+            }
+        )
+    search_index.add(created_snippet)
+    await index_created([created_snippet])
+    snippet_cache.invalidate()
+    snippet_cache.put_snippet(without_content(created_snippet))
+    return created_snippet
+
+
+async def _read_back_created_snippet(doc_ref, snippet_data: AhHaSnippet) -> AhHaSnippet:
+    # Fetch the document to get server-generated timestamp and ensure all fields are present
+    with time_stage("firestore_get"):
+        created_doc = await doc_ref.get()
+    if not created_doc.exists:
         # This case should ideally not happen if .set() was successful
         raise ConnectionError(
             f"Failed to retrieve snippet {doc_ref.id} after creation."
         )
+    data = created_doc.to_dict()
+    if data and "title" in data and "content" in data:  # Ensure required fields
+        # Pydantic will handle optional fields if not present in data
+        return AhHaSnippet(**data)
+    logger.warning(
+        "Firestore document %s created but missing required fields upon retrieval. Data: %s",
+        doc_ref.id,
+        data,
+    )
+    # Fallback based on input + ID; this indicates a data consistency issue
+    return snippet_data.model_copy(update={"id": doc_ref.id})
+
+
+def _commit_chunks(
+    items: List[T],
+    tags_of: Callable[[T], Iterable[str]] = lambda snippet: snippet.generated_tags or [],
+    writes_per_item: int = 1,
+) -> Iterator[List[T]]:
+    """Groups items so each commit, counting one counter write per distinct
+    tag, stays within FIRESTORE_MAX_BATCH_WRITES operations."""
+    chunk: List[T] = []
+    tags: set = set()
+    for item in items:
+        item_tags = set(tags_of(item))
+        if (
+            chunk
+            and (len(chunk) + 1) * writes_per_item + len(tags | item_tags)
+            > config.FIRESTORE_MAX_BATCH_WRITES
+        ):
+            yield chunk
+            chunk, tags = [], set()
+        chunk.append(item)
+        tags |= item_tags
+    if chunk:
+        yield chunk
+
+
+async def create_snippets_batch(
+    snippets: List[AhHaSnippet],
+) -> List[Union[AhHaSnippet, Exception]]:
+    """Creates many snippets using Firestore WriteBatch commits.
+
+    Writes are grouped into commits of at most FIRESTORE_MAX_BATCH_WRITES
+    operations, tag counter increments included. Each commit is atomic, so if one fails every item in that
+    chunk gets the exception back while the other chunks are unaffected.
+    The server timestamp is taken from each write's update_time, so no
+    read-back is needed.
+    """
+    db = get_db()
+    if not db:
+        raise ConnectionError("Firestore client not initialized.")
+
+    collection_ref = db.collection(SNIPPETS_COLLECTION)
+    results: List[Union[AhHaSnippet, Exception]] = []
+    for chunk in _commit_chunks(snippets):
+        batch = db.batch()
+        doc_refs = []
+        snippet_dicts = []
+        tag_counts: Counter = Counter()
+        for snippet_data, preview in zip(chunk, await make_previews(chunk)):
+            snippet_data.preview = preview
+            doc_ref = collection_ref.document()
+            snippet_dicts.append(_prepare_snippet_dict(snippet_data, doc_ref.id))
+            doc_refs.append(doc_ref)
+            tag_counts.update(_snippet_tags(snippet_data.generated_tags))
+        content_blobs: List[Optional[ContentBlob]] = []
+        try:
+            content_blobs = await _store_large_contents(snippet_dicts)
+            for doc_ref, snippet_dict in zip(doc_refs, snippet_dicts):
+                batch.set(doc_ref, snippet_dict)
+            # Counter writes go last, so the first len(chunk) write results are the snippets'.
+            _add_tag_count_writes(db, batch, tag_counts)
+            with time_stage("firestore_batch_commit"):
+                write_results = await batch.commit()
+        except Exception as e:
+            logger.error("Error committing batch of %d snippets to Firestore: %s", len(chunk), e)
+            await delete_content(content_blobs)
+            results.extend([e] * len(chunk))
+            continue
+        created_chunk = []
+        for snippet_data, doc_ref, write_result, content_blob in zip(
+            chunk, doc_refs, write_results, content_blobs
+        ):
+            created_snippet = snippet_data.model_copy(
+                update={
+                    "id": doc_ref.id,
+                    "timestamp": write_result.update_time,
+                    "updated_at": write_result.update_time,
+                    "content_blob": content_blob,
+                }
+            )
+            search_index.add(created_snippet)
+            created_chunk.append(created_snippet)
+        await index_created(created_chunk)
+        results.extend(created_chunk)
+        snippet_cache.invalidate()
+    return results
 
 
 async def get_snippet_by_id(snippet_id: str) -> Optional[AhHaSnippet]:
-    """Retrieves a snippet by its Firestore document ID."""
+    """Retrieves a snippet by its Firestore document ID, via the snippet cache.
+
+    Content stored out of line is loaded here, on every call: the cache keeps
+    only the document, so large captures don't pile up in memory.
+    """
+    db = get_db()
     if not db:
         raise ConnectionError("Firestore client not initialized.")
 
+    cached = snippet_cache.get_snippet(snippet_id)
+    if cached is not None:
+        return await load_content(cached)
+
     doc_ref = db.collection(SNIPPETS_COLLECTION).document(snippet_id)
-    doc = await doc_ref.get()
+    with time_stage("firestore_get"):
+        doc = await doc_ref.get()
     if doc.exists:
         data = doc.to_dict()
         # Ensure required fields are present, Pydantic will validate types
         if data and "title" in data and "content" in data:
-            return AhHaSnippet(**data)
+            snippet = AhHaSnippet(**data)
+            snippet_cache.put_snippet(snippet)
+            return await load_content(snippet)
         else:
             # Log an error or handle missing critical fields
-            print(
-                f"Firestore document {snippet_id} is missing required fields (title, content). Data: {data}"
+            logger.warning(
+                "Firestore document %s is missing required fields (title, content). Data: %s",
+                snippet_id,
+                data,
             )
             return None
     return None
 
 
-async def get_all_snippets(search_term: Optional[str] = None) -> List[AhHaSnippet]:
-    """Retrieves all snippets, optionally filtered by a search term."""
+def _snippet_from_doc(doc, caller: str) -> Optional[AhHaSnippet]:
+    data = doc.to_dict()
+    if data and "title" in data and "content" in data:  # Ensure required fields
+        snippet = AhHaSnippet(**data)  # Pydantic handles optional fields
+        if not snippet.id:
+            snippet.id = doc.id
+        return snippet
+    # Log an error or handle missing critical fields for a document in the list
+    logger.warning(
+        "Firestore document %s in %s is missing required fields (title, content). Data: %s",
+        doc.id,
+        caller,
+        data,
+    )
+    return None
+
+
+def _sort_newest_first(snippets: List[AhHaSnippet]) -> List[AhHaSnippet]:
+    min_ts = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+
+    def sort_key(snippet: AhHaSnippet):
+        ts = snippet.timestamp
+        if ts is None:
+            return min_ts
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=datetime.timezone.utc)
+        return ts
+
+    return sorted(snippets, key=sort_key, reverse=True)
+
+
+async def _stream_all_snippets() -> List[AhHaSnippet]:
+    """Reads the whole collection, backfilling fields older documents lack."""
+    db = get_db()
     if not db:
         raise ConnectionError("Firestore client not initialized.")
 
-    query_ref = db.collection(
-        SNIPPETS_COLLECTION
-    ).order_by(  # Changed variable name from query to query_ref for clarity
-        "timestamp", direction=firestore.Query.DESCENDING
+    snippets = []
+    without_preview = []
+    backfill: Dict[str, dict] = {}
+    with time_stage("firestore_stream"):
+        async for doc in db.collection(SNIPPETS_COLLECTION).stream():
+            snippet = _snippet_from_doc(doc, "rebuild_search_index")
+            if snippet:
+                if snippet.preview is None:
+                    without_preview.append(snippet)
+                if snippet.updated_at is None:
+                    # Documents without it would never show up in the change feed.
+                    snippet.updated_at = snippet.timestamp
+                    backfill.setdefault(snippet.id, {})["updated_at"] = (
+                        snippet.timestamp or firestore.SERVER_TIMESTAMP
+                    )
+                snippets.append(snippet)
+    for snippet, preview in zip(without_preview, await make_previews(without_preview)):
+        snippet.preview = preview
+        backfill.setdefault(snippet.id, {})["preview"] = preview
+    if backfill:
+        await _backfill_fields(backfill)
+    # The indexes cover the whole content, wherever it is stored.
+    return await load_contents(snippets)
+
+
+def _index_state_path() -> str:
+    return f"{config.SEARCH_SNAPSHOT_PATH}.state.npz"
+
+
+async def _save_index_state(generation: int):
+    try:
+        await save_index_state(_index_state_path(), generation)
+    except Exception as e:
+        # Workers then stream the collection at startup, as without a snapshot.
+        logger.warning("Could not save derived index state: %s", e)
+
+
+async def _attach_published_indexes() -> bool:
+    """Startup from what another worker published: maps a fresh search
+    snapshot, loads the derived indexes saved with it, and replays the
+    change feed from their generation, reading only what changed since."""
+    global _index_cursor
+    if not isinstance(search_index, SnapshotSearchIndex):
+        return False
+    generation = search_index.attach()
+    if generation is None:
+        return False
+    state_generation = await load_index_state(_index_state_path())
+    if state_generation is None:
+        return False
+    since = min(generation, state_generation) - _INDEX_REFRESH_OVERLAP_MICROS
+    _index_cursor = ChangeCursor(since, "")
+    applied = await refresh_search_index()
+    logger.info(
+        "Search index attached to the published snapshot; %d changes replayed.", applied
     )
+    return True
+
+
+async def _index_complete_until() -> Optional[int]:
+    """Catches up with the change feed and returns the time (µs) before which
+    every write is in this worker's indexes; None if it doesn't follow the
+    feed. Lets a new snapshot generation be built from them."""
+    if _index_cursor is None or config.SEARCH_INDEX_REFRESH_SECONDS <= 0:
+        return None
+    started = int(time.time() * 1_000_000)
+    await refresh_search_index()
+    # updated_at is the server's clock, as for the refresh cursor.
+    return started - _INDEX_REFRESH_OVERLAP_MICROS
+
+
+async def rebuild_search_index() -> int:
+    """Builds the in-process indexes: the search index plus the derived
+    indexes every storage backend maintains (keyword statistics, embeddings
+    and duplicate fingerprints).
+
+    With a shared snapshot (SEARCH_SNAPSHOT_PATH), a fresh published
+    snapshot and the derived index state saved with it are loaded, and only
+    the changes since are read. Otherwise the whole collection is streamed
+    once; the worker that then publishes a snapshot saves the state with it.
+    """
+    global _index_cursor
+    if await _attach_published_indexes():
+        return len(search_index)
+    streamed_at = int(time.time() * 1_000_000)
+    snippets = await _stream_all_snippets()
+    builds = 0
+    if isinstance(search_index, SnapshotSearchIndex):
+        builds = search_index.builds
+        await search_index.load(snippets, streamed_at)
+    else:
+        search_index.rebuild(snippets)
+    # updated_at is the server's clock, so the refresh starts a little earlier;
+    # re-applying a change the stream already saw is harmless.
+    _index_cursor = ChangeCursor(streamed_at - _INDEX_REFRESH_OVERLAP_MICROS, "")
+    await index_loaded(snippets)
+    if isinstance(search_index, SnapshotSearchIndex) and (
+        search_index.builds > builds or not os.path.exists(_index_state_path())
+    ):
+        # Also when the published snapshot came without state, so the next
+        # workers to start needn't stream too.
+        await _save_index_state(streamed_at)
+    logger.info("Search index rebuilt with %d snippets.", len(search_index))
+    return len(search_index)
+
+
+async def refresh_search_index() -> int:
+    """Applies what any worker wrote or deleted since the last rebuild or
+    refresh to this worker's search index, derived indexes and snippet
+    cache, read from the change feed; returns the number of changes applied."""
+    global _index_cursor
+    if _index_cursor is None:
+        return 0
+    applied = 0
+    while True:
+        batch = await get_changes(_index_cursor, _INDEX_REFRESH_PAGE_SIZE)
+        if batch.changed or batch.deleted:
+            # The same changes make this worker's cached copies stale.
+            snippet_cache.invalidate_many(
+                [snippet.id for snippet in batch.changed] + batch.deleted, remote=True
+            )
+        changed = await load_contents(batch.changed)
+        for snippet in changed:
+            search_index.add(snippet)
+        for snippet_id in batch.deleted:
+            search_index.remove(snippet_id)
+        await index_refreshed(changed, batch.deleted)
+        applied += len(batch.changed) + len(batch.deleted)
+        _index_cursor = batch.cursor
+        if not batch.has_more:
+            return applied
+
+
+async def _refresh_search_index_periodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            applied = await refresh_search_index()
+            if applied:
+                logger.debug("Search index refreshed with %d changes.", applied)
+        except Exception as e:
+            logger.warning("Search index refresh failed: %s", e)
+
+
+async def _backfill_fields(updates: Dict[str, dict]):
+    """Stores fields added after some snippets were written: previews, so the
+    summary view can serve them without reading their content, and
+    updated_at, which the change feed orders by."""
+    db = get_db()
+    collection_ref = db.collection(SNIPPETS_COLLECTION)
+    chunk_size = config.FIRESTORE_MAX_BATCH_WRITES
+    items = list(updates.items())
+    try:
+        for start in range(0, len(items), chunk_size):
+            batch = db.batch()
+            for snippet_id, fields in items[start : start + chunk_size]:
+                batch.update(collection_ref.document(snippet_id), fields)
+            with time_stage("firestore_batch_commit"):
+                await batch.commit()
+    except Exception as e:
+        logger.warning("Could not backfill snippet fields: %s", e)
+        return
+    logger.info("Backfilled preview/updated_at for %d snippets.", len(items))
+
+
+async def _search_snippets(search_term: str, tag: Optional[str] = None) -> List[AhHaSnippet]:
+    """Fetches only the documents the search index says match the term (and tag)."""
+    matching_ids = search_index.search(search_term, tag)
+    if not matching_ids:
+        return []
 
     snippets = []
-    async for doc in query_ref.stream():
-        data = doc.to_dict()
-        if data and "title" in data and "content" in data:  # Ensure required fields
-            snippet = AhHaSnippet(**data)  # Pydantic handles optional fields
-            if search_term:
-                search_lower = search_term.lower()
-                # Ensure all searchable fields are checked safely
-                title_match = search_lower in snippet.title.lower()
-                content_match = search_lower in snippet.content.lower()
-                tags_match = False
-                if snippet.generated_tags:  # Check if tags exist
-                    tags_match = any(
-                        search_lower in tag.lower() for tag in snippet.generated_tags
-                    )
-                notes_match = False
-                if snippet.notes:  # Check if notes exist
-                    notes_match = search_lower in snippet.notes.lower()
+    missing_ids = []
+    for snippet_id in matching_ids:
+        cached = snippet_cache.get_snippet(snippet_id)
+        if cached is not None:
+            snippets.append(cached)
+        else:
+            missing_ids.append(snippet_id)
+    if not missing_ids:
+        return _sort_newest_first(snippets)
 
-                if title_match or content_match or tags_match or notes_match:
-                    snippets.append(snippet)
-            else:
+    db = get_db()
+    collection_ref = db.collection(SNIPPETS_COLLECTION)
+    doc_refs = [collection_ref.document(snippet_id) for snippet_id in missing_ids]
+    with time_stage("firestore_get_all"):
+        async for doc in db.get_all(doc_refs):
+            if not doc.exists:
+                # Deleted by another worker since this worker last indexed it.
+                search_index.remove(doc.id)
+                continue
+            snippet = _snippet_from_doc(doc, "get_all_snippets")
+            if snippet:
+                snippet_cache.put_snippet(snippet)
                 snippets.append(snippet)
+    return _sort_newest_first(snippets)
+
+
+def _matches_search(snippet: AhHaSnippet, search_term: str) -> bool:
+    # The scan used until the index is ready matches the way the index does.
+    words = snippet_tokens(snippet)
+    if offloaded(snippet):
+        # Content stored out of line isn't loaded for listings; its preview stands in.
+        words.update(tokenize(snippet.preview))
+    query_tokens = set(tokenize(search_term))
+    return bool(query_tokens) and all(
+        any(word.startswith(token) for word in words) for token in query_tokens
+    )
+
+
+def _page_after(
+    snippets: List[AhHaSnippet], limit: Optional[int], start_after: Optional[str]
+) -> List[AhHaSnippet]:
+    """Applies a start_after/limit cursor to an already ordered result list."""
+    if start_after:
+        ids = [snippet.id for snippet in snippets]
+        if start_after not in ids:
+            raise ValueError(f"Unknown start_after cursor: {start_after}")
+        snippets = snippets[ids.index(start_after) + 1 :]
+    if limit:
+        snippets = snippets[:limit]
+    return snippets
+
+
+def _wants_content(fields: Optional[List[str]]) -> bool:
+    return not fields or "content" in fields
+
+
+async def _present(
+    documents: List[Union[AhHaSnippet, SnippetFields]], fields: Optional[List[str]]
+) -> List[Union[AhHaSnippet, SnippetFields]]:
+    """Documents as the API returns them: out-of-line content read back if
+    `content` is wanted, then projected to `fields`. Dicts from a select()
+    projection are already final."""
+    snippets = [document for document in documents if isinstance(document, AhHaSnippet)]
+    if snippets and _wants_content(fields):
+        loaded = iter(await load_contents(snippets))
+        documents = [
+            next(loaded) if isinstance(document, AhHaSnippet) else document
+            for document in documents
+        ]
+    if not fields:
+        return documents
+    return [
+        project(document, fields) if isinstance(document, AhHaSnippet) else document
+        for document in documents
+    ]
+
+
+async def get_snippets_by_ids(
+    snippet_ids: List[str], fields: Optional[List[str]] = None
+) -> List[Union[AhHaSnippet, SnippetFields]]:
+    """Snippets in the given order, from the snippet cache or one get_all().
+
+    Content stored out of line is only read when `content` is wanted.
+    """
+    db = get_db()
+    if not db:
+        raise ConnectionError("Firestore client not initialized.")
+
+    found: Dict[str, AhHaSnippet] = {}
+    missing_ids = []
+    for snippet_id in dict.fromkeys(snippet_ids):
+        cached = snippet_cache.get_snippet(snippet_id)
+        if cached is not None:
+            found[snippet_id] = cached
         else:
-            # Log an error or handle missing critical fields for a document in the list
-            print(
-                f"Firestore document {doc.id} in get_all_snippets is missing required fields (title, content). Data: {data}"
+            missing_ids.append(snippet_id)
+    if missing_ids:
+        collection_ref = db.collection(SNIPPETS_COLLECTION)
+        doc_refs = [collection_ref.document(snippet_id) for snippet_id in missing_ids]
+        with time_stage("firestore_get_all"):
+            async for doc in db.get_all(doc_refs):
+                if not doc.exists:
+                    continue
+                snippet = _snippet_from_doc(doc, "get_snippets_by_ids")
+                if snippet:
+                    snippet_cache.put_snippet(snippet)
+                    found[doc.id] = snippet
+    return await _present(
+        [found[snippet_id] for snippet_id in snippet_ids if snippet_id in found], fields
+    )
+
+
+async def iter_snippets(
+    search_term: Optional[str] = None,
+    limit: Optional[int] = None,
+    start_after: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    tag: Optional[str] = None,
+) -> AsyncIterator[Union[AhHaSnippet, SnippetFields]]:
+    """Yields snippets newest first as Firestore streams them.
+
+    `start_after` is the ID of the last snippet of the previous page and
+    `limit` caps how many snippets are yielded. Raises ValueError if the
+    cursor does not refer to an existing snippet. With `fields`, listings
+    use a select() projection, so other fields (content above all) are never
+    read, and dicts of just those fields are yielded. `tag` keeps snippets
+    carrying that exact tag, as an array_contains query filter (this needs a
+    composite index on generated_tags + timestamp desc).
+
+    Content stored out of line is read back, one snippet at a time as they
+    are yielded, when `content` is among the fields returned.
+    """
+    async for document in _iter_documents(search_term, limit, start_after, fields, tag):
+        for item in await _present([document], fields):
+            yield item
+
+
+async def _iter_documents(
+    search_term: Optional[str],
+    limit: Optional[int],
+    start_after: Optional[str],
+    fields: Optional[List[str]],
+    tag: Optional[str],
+) -> AsyncIterator[Union[AhHaSnippet, SnippetFields]]:
+    """iter_snippets before _present(): snippets as their documents hold
+    them, or final dicts where a select() projection could be used."""
+    db = get_db()
+    if not db:
+        raise ConnectionError("Firestore client not initialized.")
+
+    if search_term and search_index.ready:
+        matches = await _search_snippets(search_term, tag)
+        if tag:
+            matches = [snippet for snippet in matches if tag in (snippet.generated_tags or [])]
+        for snippet in _page_after(matches, limit, start_after):
+            yield snippet
+        return
+
+    collection_ref = db.collection(SNIPPETS_COLLECTION)
+    query_ref = collection_ref.order_by(
+        "timestamp", direction=firestore.Query.DESCENDING
+    )
+    if tag:
+        query_ref = query_ref.where(
+            filter=firestore.FieldFilter("generated_tags", "array_contains", tag)
+        )
+    if start_after:
+        with time_stage("firestore_get"):
+            # The cursor only needs the ordering field.
+            cursor_doc = await collection_ref.document(start_after).get(
+                field_paths=["timestamp"]
             )
+        if not cursor_doc.exists:
+            raise ValueError(f"Unknown start_after cursor: {start_after}")
+        query_ref = query_ref.start_after(cursor_doc)
+    if limit and not search_term:
+        # With a fallback search scan we filter in Python, so the limit is applied below.
+        query_ref = query_ref.limit(limit)
+    # Offloaded content needs the content_blob field to be read back, so a
+    # projection asking for content reads whole documents.
+    projected = bool(fields) and not search_term and not _wants_content(fields)
+    if projected:
+        query_ref = query_ref.select(fields)
 
-    return snippets
+    yielded = 0
+    started = time.perf_counter()
+    try:
+        async for doc in query_ref.stream():
+            if projected:
+                data = doc.to_dict() or {}
+                yield {field: doc.id if field == "id" else data.get(field) for field in fields}
+                yielded += 1
+                if limit and yielded >= limit:
+                    break
+                continue
+            snippet = _snippet_from_doc(doc, "iter_snippets")
+            if not snippet:
+                continue
+            if search_term and not _matches_search(snippet, search_term):
+                continue
+            yield snippet
+            yielded += 1
+            if limit and yielded >= limit:
+                break
+    finally:
+        observe_stage("firestore_stream", time.perf_counter() - started)
+
+
+async def get_all_snippets(
+    search_term: Optional[str] = None,
+    limit: Optional[int] = None,
+    start_after: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    tag: Optional[str] = None,
+) -> List[Union[AhHaSnippet, SnippetFields]]:
+    """Retrieves snippets newest first, optionally filtered by a search term or tag.
+
+    Searches are answered from the in-process inverted index when it has been
+    built, so only the matching documents are read from Firestore. Results
+    are cached per query until the next write or the list cache TTL.
+    """
+    cache_key = (search_term, limit, start_after, tuple(fields) if fields else None, tag)
+    documents = snippet_cache.get_results(cache_key)
+    if documents is None:
+        documents = [
+            document
+            async for document in _iter_documents(search_term, limit, start_after, fields, tag)
+        ]
+        # Cached as the documents hold them, like single snippets: large
+        # content is read back per response rather than kept in memory.
+        snippet_cache.put_results(cache_key, documents)
+    return await _present(documents, fields)
+
+
+async def _tags_snapshot(doc_ref):
+    with time_stage("firestore_get"):
+        return await doc_ref.get(field_paths=["generated_tags", "content_blob"])
+
+
+async def update_snippet_tags(
+    snippet_id: str, generated_tags: List[str], tagging_status: str
+) -> None:
+    """Patches AI-generated tags and the tagging status onto an existing snippet."""
+    db = get_db()
+    if not db:
+        raise ConnectionError("Firestore client not initialized.")
+
+    doc_ref = db.collection(SNIPPETS_COLLECTION).document(snippet_id)
+    new_tags = _snippet_tags(generated_tags)
+    for attempt in range(_PRECONDITION_ATTEMPTS):
+        snapshot = await _tags_snapshot(doc_ref)
+        if not snapshot.exists:
+            raise NotFound(f"No document to update: {snippet_id}")
+        deltas = new_tags.copy()
+        deltas.subtract(_snippet_tags((snapshot.to_dict() or {}).get("generated_tags")))
+        batch = db.batch()
+        # Rejected if the snippet changed since its tags were read, so the
+        # counter deltas always match what is replaced.
+        batch.update(
+            doc_ref,
+            {
+                "generated_tags": generated_tags,
+                "tagging_status": tagging_status,
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            },
+            option=db.write_option(last_update_time=snapshot.update_time),
+        )
+        _add_tag_count_writes(db, batch, deltas)
+        try:
+            with time_stage("firestore_update"):
+                await batch.commit()
+            break
+        except FailedPrecondition:
+            if attempt == _PRECONDITION_ATTEMPTS - 1:
+                raise
+    search_index.add_tags(snippet_id, generated_tags)
+    snippet_cache.invalidate(snippet_id)
+    index_tags_updated(snippet_id, generated_tags, tagging_status)
+
+
+def _add_tombstone_write(db, batch, snippet_id: str):
+    batch.set(
+        db.collection(TOMBSTONES_COLLECTION).document(snippet_id),
+        {
+            "id": snippet_id,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+            "expire_at": datetime.datetime.now(datetime.timezone.utc)
+            + datetime.timedelta(days=config.CHANGES_TOMBSTONE_TTL_DAYS),
+        },
+    )
 
 
 async def delete_snippet_by_id(snippet_id: str) -> bool:
     """Deletes a snippet by its Firestore document ID."""
+    db = get_db()
     if not db:
         raise ConnectionError("Firestore client not initialized.")
 
     doc_ref = db.collection(SNIPPETS_COLLECTION).document(snippet_id)
     try:
-        await doc_ref.delete()
-        # Check if document still exists to confirm deletion, though .delete() doesn't typically fail silently
-        # For true confirmation, you might try a get() after delete and expect it not to exist.
-        # However, for simplicity, we'll assume delete is successful if no exception is raised.
-        # The .delete() method itself does not return a value indicating success/failure directly,
-        # but raises an exception on error.
-        print(f"Snippet {snippet_id} successfully marked for deletion in Firestore.")
+        for attempt in range(_PRECONDITION_ATTEMPTS):
+            snapshot = await _tags_snapshot(doc_ref)
+            if not snapshot.exists:
+                break
+            deltas = Counter(
+                {tag: -1 for tag in _snippet_tags((snapshot.to_dict() or {}).get("generated_tags"))}
+            )
+            batch = db.batch()
+            batch.delete(doc_ref, option=db.write_option(last_update_time=snapshot.update_time))
+            _add_tag_count_writes(db, batch, deltas)
+            # The tombstone commits with the delete, so the change feed can't miss it.
+            _add_tombstone_write(db, batch, snippet_id)
+            try:
+                with time_stage("firestore_delete"):
+                    await batch.commit()
+                break
+            except FailedPrecondition:
+                if attempt == _PRECONDITION_ATTEMPTS - 1:
+                    raise
+        search_index.remove(snippet_id)
+        index_deleted(snippet_id)
+        snippet_cache.invalidate(snippet_id)
+        if not snapshot.exists:
+            logger.info("Snippet %s not found in Firestore; nothing to delete.", snippet_id)
+            return False
+        await delete_content([_stored_blob(snapshot.to_dict())])
+        logger.info("Snippet %s successfully marked for deletion in Firestore.", snippet_id)
         return True
     except Exception as e:
-        print(f"Error deleting snippet {snippet_id} from Firestore: {e}")
+        logger.error("Error deleting snippet %s from Firestore: %s", snippet_id, e)
         return False
+
+
+async def export_snippets(
+    after: Optional[str] = None, page_size: int = config.EXPORT_PAGE_SIZE
+) -> AsyncIterator[AhHaSnippet]:
+    """Yields every snippet in document ID order, one short query per page, so
+    memory stays at a page however large the collection and no single
+    stream has to stay open for the whole export. Content stored out of
+    line is loaded a few snippets at a time, as they are yielded."""
+    db = get_db()
+    if not db:
+        raise ConnectionError("Firestore client not initialized.")
+
+    collection_ref = db.collection(SNIPPETS_COLLECTION)
+    query_ref = collection_ref.order_by(FieldPath.document_id())
+    if after:
+        query_ref = query_ref.start_after(
+            {FieldPath.document_id(): collection_ref.document(after)}
+        )
+    while True:
+        with time_stage("firestore_stream"):
+            docs = [doc async for doc in query_ref.limit(page_size).stream()]
+        snippets = [_snippet_from_doc(doc, "export_snippets") for doc in docs]
+        snippets = [snippet for snippet in snippets if snippet]
+        step = max(1, config.CONTENT_LOAD_CONCURRENCY)
+        for start in range(0, len(snippets), step):
+            for snippet in await load_contents(snippets[start : start + step]):
+                yield snippet
+        if len(docs) < page_size:
+            return
+        query_ref = query_ref.start_after(docs[-1])
+
+
+async def _existing_tags(
+    collection_ref, snippet_ids: List[str]
+) -> Dict[str, Tuple[Set[str], Any, Optional[ContentBlob]]]:
+    """(tags, update_time, content blob) of each of the snippets that exists, in one read."""
+    db = get_db()
+    existing = {}
+    with time_stage("firestore_get_all"):
+        async for doc in db.get_all(
+            [collection_ref.document(snippet_id) for snippet_id in snippet_ids],
+            field_paths=["generated_tags", "content_blob"],
+        ):
+            if doc.exists:
+                data = doc.to_dict() or {}
+                existing[doc.id] = (
+                    set(data.get("generated_tags") or []),
+                    doc.update_time,
+                    _stored_blob(data),
+                )
+    return existing
+
+
+async def _refresh_existing(collection_ref, existing: dict, snippet_ids: List[str]):
+    """Re-reads snippets whose write precondition failed."""
+    for snippet_id in snippet_ids:
+        existing.pop(snippet_id, None)
+    existing.update(await _existing_tags(collection_ref, snippet_ids))
+
+
+async def _commit_import_chunk(
+    db, collection_ref, chunk: List[AhHaSnippet], documents: List[dict], existing: dict
+):
+    """Commits one chunk of an import with its tag counter deltas, re-reading
+    and retrying when a replaced document changed since it was read."""
+    for attempt in range(_PRECONDITION_ATTEMPTS):
+        if attempt:
+            await _refresh_existing(collection_ref, existing, [snippet.id for snippet in chunk])
+        batch = db.batch()
+        deltas = Counter()
+        for snippet, data in zip(chunk, documents):
+            doc_ref = collection_ref.document(snippet.id)
+            deltas.update(_snippet_tags(snippet.generated_tags))
+            if snippet.id in existing:
+                previous_tags, update_time, _ = existing[snippet.id]
+                deltas.subtract(Counter(previous_tags))
+                batch.update(
+                    doc_ref, data, option=db.write_option(last_update_time=update_time)
+                )
+            else:
+                batch.set(doc_ref, data)
+            # A snippet deleted before is live again: its tombstone goes in the same commit.
+            batch.delete(db.collection(TOMBSTONES_COLLECTION).document(snippet.id))
+        _add_tag_count_writes(db, batch, deltas)
+        try:
+            with time_stage("firestore_batch_commit"):
+                await batch.commit()
+            break
+        except FailedPrecondition:
+            if attempt == _PRECONDITION_ATTEMPTS - 1:
+                raise
+
+
+async def import_snippets(snippets: List[AhHaSnippet]) -> List[AhHaSnippet]:
+    """Writes snippets under their own IDs, replacing existing documents.
+
+    Replacements are full-document updates conditioned on the update time
+    read just before, so the tag counter deltas committed with them are
+    exact; a chunk whose documents changed meanwhile is re-read and retried.
+    Each commit also removes the change-feed tombstones of the IDs it writes.
+    """
+    db = get_db()
+    if not db:
+        raise ConnectionError("Firestore client not initialized.")
+
+    collection_ref = db.collection(SNIPPETS_COLLECTION)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    # Made only for snippets that arrive without one, in the same order.
+    previews = iter(await make_previews([snippet for snippet in snippets if not snippet.preview]))
+    by_id: Dict[str, AhHaSnippet] = {}
+    for snippet in snippets:
+        snippet_id = snippet.id or collection_ref.document().id
+        # The last copy of an ID repeated within the batch wins, as it would in order.
+        by_id[snippet_id] = snippet.model_copy(
+            update={
+                "id": snippet_id,
+                "timestamp": snippet.timestamp or now,
+                "preview": snippet.preview or next(previews),
+            }
+        )
+    imported = list(by_id.values())
+    existing = await _existing_tags(collection_ref, list(by_id))
+
+    for chunk in _commit_chunks(
+        imported,
+        lambda snippet: set(snippet.generated_tags or []) | existing.get(snippet.id, (set(),))[0],
+        writes_per_item=2,
+    ):
+        documents = []
+        for snippet in chunk:
+            data = snippet.model_dump()
+            data["updated_at"] = firestore.SERVER_TIMESTAMP
+            # Also drops the blob reference of stored content this replaces.
+            data["content_blob"] = None
+            documents.append(data)
+        content_blobs = await _store_large_contents(documents)
+        try:
+            await _commit_import_chunk(db, collection_ref, chunk, documents, existing)
+        except Exception:
+            # The documents still refer to their previous content, which has the
+            # same key when it is unchanged; only blobs nothing refers to go.
+            previous_keys = {
+                existing[snippet.id][2].key
+                for snippet in chunk
+                if snippet.id in existing and existing[snippet.id][2]
+            }
+            await delete_content(
+                blob for blob in content_blobs if blob and blob.key not in previous_keys
+            )
+            raise
+        replaced_blobs = []
+        for snippet, content_blob in zip(chunk, content_blobs):
+            snippet.content_blob = content_blob
+            if snippet.id in existing:
+                previous_blob = existing[snippet.id][2]
+                if previous_blob and (content_blob is None or previous_blob.key != content_blob.key):
+                    replaced_blobs.append(previous_blob)
+                index_deleted(snippet.id)
+                snippet_cache.invalidate(snippet.id)
+            search_index.add(snippet)
+        await delete_content(replaced_blobs)
+        await index_created(chunk)
+    snippet_cache.invalidate()
+    return imported
+
+
+async def delete_snippets(snippet_ids: List[str]) -> int:
+    """Deletes snippets with batched commits: each delete is conditioned on the
+    update time its tags were read at, and commits with its tag counter
+    decrements and its change-feed tombstone."""
+    db = get_db()
+    if not db:
+        raise ConnectionError("Firestore client not initialized.")
+
+    collection_ref = db.collection(SNIPPETS_COLLECTION)
+    snippet_ids = list(dict.fromkeys(snippet_ids))
+    existing = await _existing_tags(collection_ref, snippet_ids)
+    deleted = 0
+    for chunk in _commit_chunks(
+        [snippet_id for snippet_id in snippet_ids if snippet_id in existing],
+        lambda snippet_id: existing[snippet_id][0],
+        writes_per_item=2,
+    ):
+        for attempt in range(_PRECONDITION_ATTEMPTS):
+            if attempt:
+                await _refresh_existing(collection_ref, existing, chunk)
+                chunk = [snippet_id for snippet_id in chunk if snippet_id in existing]
+            batch = db.batch()
+            deltas = Counter()
+            for snippet_id in chunk:
+                previous_tags, update_time, _ = existing[snippet_id]
+                deltas.subtract(Counter(previous_tags))
+                batch.delete(
+                    collection_ref.document(snippet_id),
+                    option=db.write_option(last_update_time=update_time),
+                )
+                _add_tombstone_write(db, batch, snippet_id)
+            _add_tag_count_writes(db, batch, deltas)
+            try:
+                with time_stage("firestore_batch_commit"):
+                    await batch.commit()
+                break
+            except FailedPrecondition:
+                if attempt == _PRECONDITION_ATTEMPTS - 1:
+                    raise
+        for snippet_id in chunk:
+            search_index.remove(snippet_id)
+            index_deleted(snippet_id)
+            snippet_cache.invalidate(snippet_id)
+        await delete_content(existing[snippet_id][2] for snippet_id in chunk)
+        deleted += len(chunk)
+    return deleted
+
+
+async def _changed_docs(collection_ref, since: Optional[ChangeCursor], limit: int) -> list:
+    """Up to `limit` documents of a collection written after the cursor, as
+    ((updated_at micros, id), snapshot) in updated_at then ID order.
+
+    The query is `updated_at >= cursor time`; documents written in the same
+    commit share a timestamp, so ones at or before the cursor's ID are
+    skipped here, paging with start_after until enough are found.
+    """
+    query_ref = collection_ref.order_by("updated_at")
+    if since is not None:
+        query_ref = query_ref.where(
+            filter=firestore.FieldFilter("updated_at", ">=", from_micros(since.changed_at))
+        )
+    position = (since.changed_at, since.key) if since is not None else None
+    found = []
+    last_doc = None
+    while True:
+        page_ref = query_ref.start_after(last_doc) if last_doc is not None else query_ref
+        docs = [doc async for doc in page_ref.limit(limit).stream()]
+        for doc in docs:
+            key = (to_micros(doc.get("updated_at")), doc.id)
+            if position is None or key > position:
+                found.append((key, doc))
+        if len(docs) < limit or len(found) >= limit:
+            return found[:limit]
+        last_doc = docs[-1]
+
+
+async def get_changes(since: Optional[ChangeCursor], limit: int) -> ChangeBatch:
+    """Snippets written and deleted after `since`, merged in write order.
+
+    Live snippets are read by updated_at and deletions from the tombstone
+    collection; each source is fetched one past the page so has_more is exact.
+    """
+    db = get_db()
+    if not db:
+        raise ConnectionError("Firestore client not initialized.")
+    if since is not None and not isinstance(since.key, str):
+        raise ValueError("Change cursor is not from this store.")
+
+    with time_stage("firestore_stream"):
+        changed = await _changed_docs(db.collection(SNIPPETS_COLLECTION), since, limit + 1)
+        deleted = await _changed_docs(db.collection(TOMBSTONES_COLLECTION), since, limit + 1)
+    merged = sorted(
+        [(key, doc, False) for key, doc in changed] + [(key, doc, True) for key, doc in deleted],
+        key=lambda change: change[0],
+    )
+    batch = ChangeBatch(cursor=since or ChangeCursor(0, ""), has_more=len(merged) > limit)
+    page = merged[:limit]
+    # An ID both live and tombstoned (a tombstone left over from before it was
+    # imported again) is reported once, as whichever was written last.
+    latest = {doc_id: index for index, ((_, doc_id), _, _) in enumerate(page)}
+    for index, ((changed_at, doc_id), doc, is_tombstone) in enumerate(page):
+        batch.cursor = ChangeCursor(changed_at, doc_id)
+        if latest[doc_id] != index:
+            continue
+        if is_tombstone:
+            batch.deleted.append(doc_id)
+        else:
+            snippet = _snippet_from_doc(doc, "get_changes")
+            if snippet:
+                batch.changed.append(snippet)
+    return batch
+
+
+async def get_tag_counts(limit: Optional[int] = None) -> List[TagCount]:
+    """Tags by number of snippets, most used first, read from the counter documents."""
+    db = get_db()
+    if not db:
+        raise ConnectionError("Firestore client not initialized.")
+
+    cache_key = ("tag_counts", limit)
+    cached = snippet_cache.get_results(cache_key)
+    if cached is not None:
+        return cached
+
+    query_ref = (
+        db.collection(TAG_COUNTS_COLLECTION)
+        .where(filter=firestore.FieldFilter("count", ">", 0))
+        .order_by("count", direction=firestore.Query.DESCENDING)
+    )
+    if limit:
+        query_ref = query_ref.limit(limit)
+    counts = []
+    with time_stage("firestore_stream"):
+        async for doc in query_ref.stream():
+            data = doc.to_dict() or {}
+            counts.append(TagCount(tag=data.get("tag", doc.id), count=data.get("count", 0)))
+    counts.sort(key=lambda tag_count: (-tag_count.count, tag_count.tag))
+    snippet_cache.put_results(cache_key, counts)
+    return counts
+
+
+async def rebuild_tag_counts() -> int:
+    """Recounts every tag from the snippets and rewrites the counter documents.
+
+    A one-off job for existing data or after manual edits. Captures tagged
+    while it runs may be counted from a stale read, so run it when writes are
+    quiet. Returns the number of distinct tags.
+    """
+    db = get_db()
+    if not db:
+        raise ConnectionError("Firestore client not initialized.")
+
+    counts: Counter = Counter()
+    with time_stage("firestore_stream"):
+        async for doc in db.collection(SNIPPETS_COLLECTION).select(["generated_tags"]).stream():
+            counts.update(_snippet_tags((doc.to_dict() or {}).get("generated_tags")))
+        stale = [
+            doc.reference
+            async for doc in db.collection(TAG_COUNTS_COLLECTION).stream()
+            if (doc.to_dict() or {}).get("tag") not in counts
+        ]
+
+    writes = [(ref, None) for ref in stale] + [
+        (_tag_count_ref(db, tag), {"tag": tag, "count": count}) for tag, count in counts.items()
+    ]
+    chunk_size = config.FIRESTORE_MAX_BATCH_WRITES
+    for start in range(0, len(writes), chunk_size):
+        batch = db.batch()
+        for ref, data in writes[start : start + chunk_size]:
+            if data is None:
+                batch.delete(ref)
+            else:
+                batch.set(ref, data)
+        with time_stage("firestore_batch_commit"):
+            await batch.commit()
+    snippet_cache.invalidate()
+    logger.info("Tag counts rebuilt: %d tags, %d stale removed.", len(counts), len(stale))
+    return len(counts)
+
+
+async def offload_large_content() -> int:
+    """Moves the content of existing snippets over CONTENT_OFFLOAD_BYTES out of
+    their documents, a page at a time; returns how many were moved.
+
+    Documents read before this tier existed work as they are, so this is
+    only needed to shrink them. updated_at is left alone: the content is
+    unchanged. A document written meanwhile is skipped; its next rewrite
+    stores its content the same way.
+    """
+    db = get_db()
+    if not db:
+        raise ConnectionError("Firestore client not initialized.")
+
+    collection_ref = db.collection(SNIPPETS_COLLECTION)
+    query_ref = collection_ref.order_by(FieldPath.document_id())
+    page_size = config.EXPORT_PAGE_SIZE
+    moved = 0
+    while True:
+        with time_stage("firestore_stream"):
+            docs = [doc async for doc in query_ref.limit(page_size).stream()]
+        for doc in docs:
+            data = doc.to_dict() or {}
+            if data.get("content_blob"):
+                continue
+            blob = await store_content(doc.id, data.get("content"))
+            if blob is None:
+                continue
+            try:
+                await collection_ref.document(doc.id).update(
+                    {"content": "", "content_blob": blob.model_dump()},
+                    option=db.write_option(last_update_time=doc.update_time),
+                )
+            except (FailedPrecondition, NotFound):
+                await delete_content([blob])
+                continue
+            moved += 1
+        if len(docs) < page_size:
+            break
+        query_ref = query_ref.start_after(docs[-1])
+    snippet_cache.invalidate()
+    logger.info("Moved the content of %d snippets out of their documents.", moved)
+    return moved
+
+
+class FirestoreSnippetStore(SnippetStore):
+    """SnippetStore over the module-level Firestore functions above."""
+
+    name = "firestore"
+
+    async def warm_up(self):
+        await warm_up()
+
+    _refresh_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await rebuild_search_index()
+        if isinstance(search_index, SnapshotSearchIndex):
+            search_index.start(_stream_all_snippets, _index_complete_until, _save_index_state)
+        if config.SEARCH_INDEX_REFRESH_SECONDS > 0 and self._refresh_task is None:
+            # Other workers' writes reach this worker's index only this way.
+            self._refresh_task = asyncio.create_task(
+                _refresh_search_index_periodically(config.SEARCH_INDEX_REFRESH_SECONDS)
+            )
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        if isinstance(search_index, SnapshotSearchIndex):
+            await search_index.stop()
+
+    async def create_snippet(self, snippet: AhHaSnippet) -> AhHaSnippet:
+        return await create_snippet(snippet)
+
+    async def create_snippets_batch(
+        self, snippets: List[AhHaSnippet]
+    ) -> List[Union[AhHaSnippet, Exception]]:
+        return await create_snippets_batch(snippets)
+
+    async def get_snippet_by_id(self, snippet_id: str) -> Optional[AhHaSnippet]:
+        return await get_snippet_by_id(snippet_id)
+
+    async def get_snippets_by_ids(
+        self, snippet_ids: List[str], fields: Optional[List[str]] = None
+    ) -> List[Union[AhHaSnippet, SnippetFields]]:
+        return await get_snippets_by_ids(snippet_ids, fields)
+
+    def iter_snippets(
+        self,
+        search_term: Optional[str] = None,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        tag: Optional[str] = None,
+    ) -> AsyncIterator[Union[AhHaSnippet, SnippetFields]]:
+        return iter_snippets(
+            search_term=search_term,
+            limit=limit,
+            start_after=start_after,
+            fields=fields,
+            tag=tag,
+        )
+
+    async def get_all_snippets(
+        self,
+        search_term: Optional[str] = None,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        tag: Optional[str] = None,
+    ) -> List[Union[AhHaSnippet, SnippetFields]]:
+        return await get_all_snippets(
+            search_term=search_term,
+            limit=limit,
+            start_after=start_after,
+            fields=fields,
+            tag=tag,
+        )
+
+    async def update_snippet_tags(
+        self, snippet_id: str, generated_tags: List[str], tagging_status: str
+    ) -> None:
+        await update_snippet_tags(snippet_id, generated_tags, tagging_status)
+
+    async def delete_snippet_by_id(self, snippet_id: str) -> bool:
+        return await delete_snippet_by_id(snippet_id)
+
+    async def get_changes(self, since: Optional[ChangeCursor], limit: int) -> ChangeBatch:
+        return await get_changes(since, limit)
+
+    def export_snippets(
+        self, after: Optional[str] = None, page_size: int = config.EXPORT_PAGE_SIZE
+    ) -> AsyncIterator[AhHaSnippet]:
+        return export_snippets(after, page_size)
+
+    async def import_snippets(self, snippets: List[AhHaSnippet]) -> List[AhHaSnippet]:
+        return await import_snippets(snippets)
+
+    async def delete_snippets(self, snippet_ids: List[str]) -> int:
+        return await delete_snippets(snippet_ids)
+
+    async def get_tag_counts(self, limit: Optional[int] = None) -> List[TagCount]:
+        return await get_tag_counts(limit)
+
+    async def rebuild_tag_counts(self) -> int:
+        return await rebuild_tag_counts()
@@ -0,0 +1,159 @@
+import json
+import logging
+import threading
+from typing import List, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+TAGGING_INSTRUCTION = (
+    "You are an expert text analyzer. "
+    "Given a 'Title' and 'Content' of a text snippet, "
+    "generate 3-5 relevant, concise, lowercase tags."
+)
+BATCH_TAGGING_INSTRUCTION = (
+    "You are an expert text analyzer. "
+    "You will be given several numbered snippets, each with a 'Title' and 'Content'. "
+    "For every snippet, generate 3-5 relevant, concise, lowercase tags and return "
+    "them together with the snippet's number."
+)
+
+# Gemini's response_schema dialect (OpenAPI subset, upper-case type names).
+_TAGS_SCHEMA = {"type": "ARRAY", "items": {"type": "STRING"}}
+_BATCH_TAGS_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"index": {"type": "INTEGER"}, "tags": _TAGS_SCHEMA},
+        "required": ["index", "tags"],
+    },
+}
+
+
+def _clean_tags(raw_tags) -> Optional[List[str]]:
+    if not isinstance(raw_tags, list):
+        return None
+    tags = [str(tag).strip().lower() for tag in raw_tags if str(tag).strip()]
+    return tags or None
+
+
+def parse_tag_list(text: Optional[str]) -> Optional[List[str]]:
+    """Parses a schema-constrained reply (a JSON array of strings); None if it isn't one."""
+    try:
+        return _clean_tags(json.loads(text or ""))
+    except ValueError:
+        return None
+
+
+def parse_indexed_tag_lists(text: Optional[str], count: int) -> List[Optional[List[str]]]:
+    """Parses a batch reply ([{"index": 0, "tags": [...]}, ...]) into one entry per snippet."""
+    results: List[Optional[List[str]]] = [None] * count
+    try:
+        items = json.loads(text or "")
+    except ValueError:
+        return results
+    if not isinstance(items, list):
+        return results
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index = item.get("index")
+        if isinstance(index, int) and 0 <= index < count:
+            results[index] = _clean_tags(item.get("tags"))
+    return results
+
+
+class GenAiTagger:
+    """Tags snippets with single generate_content calls constrained to a JSON schema.
+
+    Unlike the ADK runner there is no session or event stream: one request,
+    one non-streamed reply that is a JSON array of tags. The client is
+    built once and reused so its HTTP connection pool is shared by all calls.
+    """
+
+    name = "genai"
+
+    def __init__(self, model: str = config.GOOGLE_GENAI_MODEL, client=None):
+        from google.genai import types as genai_types
+
+        if client is None:
+            from google import genai
+
+            client = genai.Client(
+                vertexai=True,
+                project=config.GOOGLE_CLOUD_PROJECT,
+                location=config.GOOGLE_CLOUD_LOCATION,
+            )
+        self.model = model
+        self.instruction = TAGGING_INSTRUCTION
+        self._client = client
+        self._config = genai_types.GenerateContentConfig(
+            system_instruction=TAGGING_INSTRUCTION,
+            response_mime_type="application/json",
+            response_schema=_TAGS_SCHEMA,
+            temperature=config.GENAI_TAGGING_TEMPERATURE,
+        )
+        self._batch_config = genai_types.GenerateContentConfig(
+            system_instruction=BATCH_TAGGING_INSTRUCTION,
+            response_mime_type="application/json",
+            response_schema=_BATCH_TAGS_SCHEMA,
+            temperature=config.GENAI_TAGGING_TEMPERATURE,
+        )
+
+    async def _generate(self, prompt: str, generate_config) -> Optional[str]:
+        response = await self._client.aio.models.generate_content(
+            model=self.model, contents=prompt, config=generate_config
+        )
+        return response.text
+
+    async def generate(self, prompt: str) -> Optional[List[str]]:
+        """Tags for one 'Title: ... Content: ...' prompt; None if the reply didn't parse."""
+        text = await self._generate(prompt, self._config)
+        tags = parse_tag_list(text)
+        if tags is None:
+            logger.warning("GenAI tagging reply was not a JSON list of tags: '%s'", (text or "")[:200])
+        return tags
+
+    async def generate_batch(self, prompt: str, count: int) -> List[Optional[List[str]]]:
+        """Tags for `count` numbered snippets in one prompt, one entry (or None) per snippet."""
+        return parse_indexed_tag_lists(await self._generate(prompt, self._batch_config), count)
+
+
+# Built on first use (or by the lifespan warm-up), like the ADK agents.
+genai_tagger: Optional[GenAiTagger] = None
+_initialized = False
+_init_lock = threading.Lock()
+
+
+def init_genai_tagger():
+    global genai_tagger, _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        try:
+            # A tagger installed directly (e.g. the benchmark's fake client) is kept.
+            if genai_tagger is None:
+                if config.GOOGLE_CLOUD_PROJECT and config.GOOGLE_CLOUD_LOCATION:
+                    genai_tagger = GenAiTagger()
+                    logger.info(
+                        "GenAI structured-output tagger initialized with model: %s.",
+                        genai_tagger.model,
+                    )
+                else:
+                    logger.warning(
+                        "config.GOOGLE_CLOUD_PROJECT and/or config.GOOGLE_CLOUD_LOCATION not set. "
+                        "GenAI tag generation will be disabled."
+                    )
+        except Exception as e:
+            logger.exception("Failed to initialize the GenAI tagger: %s", e)
+            genai_tagger = None
+        finally:
+            _initialized = True
+
+
+def get_genai_tagger() -> Optional[GenAiTagger]:
+    init_genai_tagger()
+    return genai_tagger
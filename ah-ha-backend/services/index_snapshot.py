@@ -0,0 +1,602 @@
+import asyncio
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import config
+from models import AhHaSnippet
+from services.changes import to_micros
+from services.search_index import InvertedIndex, intersect_matches, snippet_tokens, tokenize
+
+logger = logging.getLogger(__name__)
+
+# File layout (little-endian): a header, then ten u32 arrays / UTF-8 blobs,
+# each starting on a 4-byte boundary. Strings are stored as an offsets array
+# (n + 1 entries) into a blob, sorted by their UTF-8 bytes so lookups can
+# bisect without decoding. Postings are doc ordinals (positions in the ID
+# table), sorted, with their own offsets array per term or tag.
+_MAGIC = b"AHIX"
+_VERSION = 1
+_SECTIONS = (
+    "id_offsets",
+    "id_blob",
+    "term_offsets",
+    "term_blob",
+    "posting_offsets",
+    "postings",
+    "tag_offsets",
+    "tag_blob",
+    "tag_posting_offsets",
+    "tag_postings",
+)
+# magic, version, generation (µs since the epoch), then (offset, length) per section.
+_HEADER = struct.Struct("<4sIQ" + "QQ" * len(_SECTIONS))
+
+
+def _now_micros() -> int:
+    return int(time.time() * 1_000_000)
+
+
+def _u32(values: Iterable[int]) -> bytes:
+    data = array("I", values)
+    if data.itemsize != 4:
+        raise RuntimeError("array('I') is not 32 bits on this platform.")
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data.tobytes()
+
+
+def _string_table(strings: List[bytes]) -> Tuple[bytes, bytes]:
+    offsets = [0]
+    for value in strings:
+        offsets.append(offsets[-1] + len(value))
+    return _u32(offsets), b"".join(strings)
+
+
+def _postings_table(postings: List[List[int]]) -> Tuple[bytes, bytes]:
+    offsets = [0]
+    flat: List[int] = []
+    for ordinals in postings:
+        flat.extend(ordinals)
+        offsets.append(len(flat))
+    return _u32(offsets), _u32(flat)
+
+
+# A document as the snapshot holds it: its search terms and exact tags.
+Document = Tuple[Set[str], List[str]]
+
+
+def write_snapshot(path: str, snippets: Iterable[AhHaSnippet], generation: int) -> int:
+    """Builds a snapshot of `snippets` and atomically replaces `path` with it.
+
+    Workers that still have the previous file mapped keep reading it until
+    they reload. Returns the number of snippets written.
+    """
+    return write_documents(
+        path,
+        {
+            snippet.id: (snippet_tokens(snippet), snippet.generated_tags or [])
+            for snippet in snippets
+            if snippet.id
+        },
+        generation,
+    )
+
+
+def write_documents(path: str, documents: Dict[str, Document], generation: int) -> int:
+    """write_snapshot() for documents already reduced to terms and tags."""
+    docs = {snippet_id.encode("utf-8"): document for snippet_id, document in documents.items()}
+    ids = sorted(docs)
+    term_docs: Dict[bytes, List[int]] = {}
+    tag_docs: Dict[bytes, List[int]] = {}
+    for ordinal, snippet_id in enumerate(ids):
+        terms, tags = docs[snippet_id]
+        for term in terms:
+            term_docs.setdefault(term.encode("utf-8"), []).append(ordinal)
+        for tag in set(tags):
+            tag_docs.setdefault(tag.encode("utf-8"), []).append(ordinal)
+    terms = sorted(term_docs)
+    tags = sorted(tag_docs)
+
+    sections = [
+        *_string_table(ids),
+        *_string_table(terms),
+        *_postings_table([term_docs[term] for term in terms]),
+        *_string_table(tags),
+        *_postings_table([tag_docs[tag] for tag in tags]),
+    ]
+    table = []
+    offset = _HEADER.size
+    for data in sections:
+        offset += -offset % 4
+        table.extend((offset, len(data)))
+        offset += len(data)
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, generation, *table))
+        for data in sections:
+            f.write(b"\0" * (-f.tell() % 4))
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(ids)
+
+
+class IndexSnapshot:
+    """A published snapshot, mapped read-only; lookups slice the mapping directly."""
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise RuntimeError("Index snapshots are only readable on little-endian hosts.")
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.file_id = (stat.st_ino, stat.st_mtime_ns)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self._mmap)
+        header = _HEADER.unpack_from(self._mmap, 0)
+        magic, version, self.generation = header[:3]
+        if magic != _MAGIC or version != _VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a version {_VERSION} index snapshot.")
+        view = memoryview(self._mmap)
+        self._views = []
+        sections = {}
+        for name, offset, length in zip(_SECTIONS, header[3::2], header[4::2]):
+            section = view[offset : offset + length]
+            if not name.endswith("_blob"):
+                section = section.cast("I")
+            self._views.append(section)
+            sections[name] = section
+        self._views.append(view)
+        self._id_offsets = sections["id_offsets"]
+        self._id_blob = sections["id_blob"]
+        self._term_offsets = sections["term_offsets"]
+        self._term_blob = sections["term_blob"]
+        self._posting_offsets = sections["posting_offsets"]
+        self._postings = sections["postings"]
+        self._tag_offsets = sections["tag_offsets"]
+        self._tag_blob = sections["tag_blob"]
+        self._tag_posting_offsets = sections["tag_posting_offsets"]
+        self._tag_postings = sections["tag_postings"]
+        self.doc_count = len(self._id_offsets) - 1
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    @staticmethod
+    def _string(offsets, blob, index: int) -> bytes:
+        return blob[offsets[index] : offsets[index + 1]].tobytes()
+
+    @classmethod
+    def _bisect(cls, offsets, blob, key: bytes) -> int:
+        """Position of the first string >= key."""
+        lo, hi = 0, len(offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if cls._string(offsets, blob, mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def doc_id(self, ordinal: int) -> str:
+        return self._string(self._id_offsets, self._id_blob, ordinal).decode("utf-8")
+
+    def contains(self, snippet_id: str) -> bool:
+        key = snippet_id.encode("utf-8")
+        pos = self._bisect(self._id_offsets, self._id_blob, key)
+        return pos < self.doc_count and self._string(self._id_offsets, self._id_blob, pos) == key
+
+    def doc_ids(self) -> Iterable[str]:
+        return (self.doc_id(ordinal) for ordinal in range(self.doc_count))
+
+    def documents(self) -> Dict[str, Document]:
+        """Every document's terms and tags, read back out of the postings."""
+        ids = list(self.doc_ids())
+        terms: List[Set[str]] = [set() for _ in ids]
+        tags: List[List[str]] = [[] for _ in ids]
+        for pos in range(len(self._term_offsets) - 1):
+            term = self._string(self._term_offsets, self._term_blob, pos).decode("utf-8")
+            for ordinal in self._postings[self._posting_offsets[pos] : self._posting_offsets[pos + 1]]:
+                terms[ordinal].add(term)
+        for pos in range(len(self._tag_offsets) - 1):
+            tag = self._string(self._tag_offsets, self._tag_blob, pos).decode("utf-8")
+            for ordinal in self._tag_postings[
+                self._tag_posting_offsets[pos] : self._tag_posting_offsets[pos + 1]
+            ]:
+                tags[ordinal].append(tag)
+        return {snippet_id: (terms[ordinal], tags[ordinal]) for ordinal, snippet_id in enumerate(ids)}
+
+    def prefix_ordinals(self, prefix: str) -> Set[int]:
+        key = prefix.encode("utf-8")
+        term_count = len(self._term_offsets) - 1
+        pos = self._bisect(self._term_offsets, self._term_blob, key)
+        matches: Set[int] = set()
+        while pos < term_count and self._string(
+            self._term_offsets, self._term_blob, pos
+        ).startswith(key):
+            matches.update(
+                self._postings[self._posting_offsets[pos] : self._posting_offsets[pos + 1]]
+            )
+            pos += 1
+        return matches
+
+    def tag_ordinals(self, tag: str) -> Set[int]:
+        key = tag.encode("utf-8")
+        pos = self._bisect(self._tag_offsets, self._tag_blob, key)
+        if pos >= len(self._tag_offsets) - 1 or self._string(self._tag_offsets, self._tag_blob, pos) != key:
+            return set()
+        return set(
+            self._tag_postings[self._tag_posting_offsets[pos] : self._tag_posting_offsets[pos + 1]]
+        )
+
+
+class SnapshotSearchIndex:
+    """The search index as one snapshot file shared by every worker, plus a delta.
+
+    One worker (whichever holds the lock file) builds the snapshot and
+    publishes it with an atomic rename; all workers map it read-only, so the
+    postings exist once per host instead of once per worker. Writes this
+    worker makes after the snapshot's generation go to a small in-memory
+    InvertedIndex, and the snapshot's copy of a rewritten or deleted snippet
+    is masked. When a newer generation is published, each worker swaps to
+    it and replays only the writes the new snapshot may not contain.
+
+    Without a usable snapshot everything lives in the delta, which is just
+    the per-worker index this replaces.
+
+    Only the first worker to start builds a generation from the whole
+    collection; the others attach() to it and catch up from the change
+    feed. Later generations are compacted from the builder's own snapshot
+    and delta, which the change feed keeps complete.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_age_seconds: float = config.SEARCH_SNAPSHOT_MAX_AGE_SECONDS,
+        check_seconds: float = config.SEARCH_SNAPSHOT_CHECK_SECONDS,
+    ):
+        self.path = path
+        self._max_age_seconds = max_age_seconds
+        self._check_seconds = check_seconds
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._delta = InvertedIndex()
+        self._masked: Set[str] = set()  # Snapshot IDs superseded by the delta or deleted
+        self._delta_ids: Set[str] = set()  # Snippets whose current version is in the delta
+        # (µs, op, snippet ID, terms, tags) for every write since the snapshot's generation.
+        self._log: List[Tuple[int, str, str, Set[str], List[str]]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._source: Optional[Callable[[], Awaitable[List[AhHaSnippet]]]] = None
+        self._complete_until: Optional[Callable[[], Awaitable[Optional[int]]]] = None
+        self._on_publish: Optional[Callable[[int], Awaitable[None]]] = None
+        self.ready = False
+        self.builds = 0
+        self.reloads = 0
+
+    def __len__(self) -> int:
+        if self._snapshot is None:
+            return len(self._delta)
+        return self._snapshot.doc_count - len(self._masked) + len(self._delta_ids)
+
+    # Writes: applied to the delta and logged for replay after a swap.
+
+    def _apply(self, op: str, snippet_id: str, terms: Set[str], tags: List[str]):
+        in_snapshot = self._snapshot is not None and self._snapshot.contains(snippet_id)
+        if op == "remove":
+            self._delta.remove(snippet_id)
+            self._delta_ids.discard(snippet_id)
+            if in_snapshot:
+                self._masked.add(snippet_id)
+        elif op == "add":
+            self._delta.remove(snippet_id)
+            self._delta.extend(snippet_id, terms, tags)
+            self._delta_ids.add(snippet_id)
+            if in_snapshot:
+                self._masked.add(snippet_id)
+        elif snippet_id in self._delta or (in_snapshot and snippet_id not in self._masked):
+            # "tags": the snapshot keeps the snippet's other terms.
+            self._delta.extend(snippet_id, terms, tags)
+
+    def _write(self, op: str, snippet_id: str, terms: Set[str], tags: List[str]):
+        self._log.append((_now_micros(), op, snippet_id, terms, tags))
+        self._apply(op, snippet_id, terms, tags)
+
+    def add(self, snippet: AhHaSnippet):
+        if snippet.id:
+            self._write("add", snippet.id, snippet_tokens(snippet), list(snippet.generated_tags or []))
+
+    def add_tags(self, snippet_id: str, tags: Iterable[str]):
+        tags = list(tags)
+        self._write("tags", snippet_id, {term for tag in tags for term in tokenize(tag)}, tags)
+
+    def remove(self, snippet_id: str):
+        self._write("remove", snippet_id, set(), [])
+
+    def rebuild(self, snippets: List[AhHaSnippet]):
+        """Indexes `snippets` in memory only, without touching the published snapshot."""
+        self._log.clear()
+        self._swap(None)
+        self._delta.rebuild(snippets)
+        self._delta_ids = {snippet.id for snippet in snippets if snippet.id}
+        self.ready = True
+
+    # Reads.
+
+    def _match(self, snapshot_ordinals: Set[int], delta_ids: Set[str]) -> Set[str]:
+        matches = {self._snapshot.doc_id(ordinal) for ordinal in snapshot_ordinals}
+        if self._masked:
+            matches -= self._masked
+        return matches | delta_ids
+
+    def prefix_matches(self, prefix: str) -> Set[str]:
+        if self._snapshot is None:
+            return self._delta.prefix_matches(prefix)
+        return self._match(self._snapshot.prefix_ordinals(prefix), self._delta.prefix_matches(prefix))
+
+    def tag_matches(self, tag: str) -> Set[str]:
+        if self._snapshot is None:
+            return self._delta.tag_matches(tag)
+        return self._match(self._snapshot.tag_ordinals(tag), self._delta.tag_matches(tag))
+
+    def search(self, query: str, tag: Optional[str] = None) -> Set[str]:
+        result = intersect_matches(query, self.prefix_matches)
+        if tag and result:
+            result &= self.tag_matches(tag)
+        return result
+
+    # Publishing and reloading generations.
+
+    def _swap(self, snapshot: Optional[IndexSnapshot]):
+        """Makes `snapshot` current and replays the writes it may be missing."""
+        previous, self._snapshot = self._snapshot, snapshot
+        if previous is not None:
+            previous.close()
+        self._delta = InvertedIndex()
+        self._masked = set()
+        self._delta_ids = set()
+        if snapshot is not None:
+            # Writes logged before the generation began are in the snapshot;
+            # replaying the ones after it is harmless even if they are too.
+            self._log = [entry for entry in self._log if entry[0] >= snapshot.generation]
+        for _, op, snippet_id, terms, tags in self._log:
+            self._apply(op, snippet_id, terms, tags)
+        self._delta.ready = True
+
+    def _open_published(self) -> Optional[IndexSnapshot]:
+        try:
+            return IndexSnapshot(self.path)
+        except FileNotFoundError:
+            return None
+
+    def _published_generation(self) -> int:
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(_HEADER.size)
+            return _HEADER.unpack(header)[2] if len(header) == _HEADER.size else 0
+        except OSError:
+            return 0
+
+    def _stale(self, generation: int, now_micros: int) -> bool:
+        return generation < now_micros - self._max_age_seconds * 1_000_000
+
+    def _lock(self, blocking: bool) -> Optional[int]:
+        fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    @staticmethod
+    def _unlock(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def publish(self, snippets: List[AhHaSnippet], streamed_at: int, force: bool = False) -> bool:
+        """Builds and publishes a generation unless (without `force`) another
+        process already published a fresh enough one, typically while this
+        one waited for the lock. Blocks; returns whether it published."""
+        fd = self._lock(blocking=True)
+        try:
+            if not force and not self._stale(self._published_generation(), streamed_at):
+                return False
+            count = write_snapshot(self.path, snippets, streamed_at)
+            logger.info("Published search index snapshot %s with %d snippets.", self.path, count)
+            return True
+        finally:
+            self._unlock(fd)
+
+    async def load(self, snippets: List[AhHaSnippet], streamed_at: int):
+        """Startup: publish a snapshot if none is fresh, map it, and add what it lacks.
+
+        `snippets` is the whole collection as streamed from `streamed_at`
+        (µs) on; snippets written since the snapshot's generation go to the
+        delta, and snapshot IDs missing from the stream are masked.
+        """
+        try:
+            if await asyncio.to_thread(self.publish, snippets, streamed_at):
+                self.builds += 1
+            snapshot = self._open_published()
+        except Exception as e:
+            logger.warning("Search index snapshot unavailable, indexing in memory: %s", e)
+            snapshot = None
+        if snapshot is None:
+            self.rebuild(snippets)
+            return
+        self._log.clear()
+        self._swap(snapshot)
+        streamed_ids = set()
+        for snippet in snippets:
+            streamed_ids.add(snippet.id)
+            if to_micros(snippet.updated_at or snippet.timestamp) >= snapshot.generation:
+                self._apply("add", snippet.id, snippet_tokens(snippet), snippet.generated_tags or [])
+        self._masked.update(
+            snippet_id for snippet_id in snapshot.doc_ids() if snippet_id not in streamed_ids
+        )
+        self.reloads += 1
+        self.ready = True
+
+    def attach(self) -> Optional[int]:
+        """Startup without reading the collection: maps the published snapshot
+        if it is fresh and returns its generation, for the caller to bring
+        up to date from the change feed. None if there is no fresh one."""
+        if self._stale(self._published_generation(), _now_micros()):
+            return None
+        try:
+            snapshot = self._open_published()
+        except Exception as e:
+            logger.warning("Could not map search index snapshot %s: %s", self.path, e)
+            return None
+        if snapshot is None:
+            return None
+        self._log.clear()
+        self._swap(snapshot)
+        self.reloads += 1
+        self.ready = True
+        return snapshot.generation
+
+    def reload_if_published(self) -> bool:
+        """Swaps to a generation another worker published, if there is one."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if self._snapshot is not None and self._snapshot.file_id == (stat.st_ino, stat.st_mtime_ns):
+            return False
+        snapshot = self._open_published()
+        if snapshot is None:
+            return False
+        self._swap(snapshot)
+        self.reloads += 1
+        logger.info("Search index snapshot reloaded (%d snippets).", snapshot.doc_count)
+        return True
+
+    def _compact(
+        self,
+        file_id: Optional[Tuple[int, int]],
+        masked: Set[str],
+        delta: Dict[str, Document],
+        generation: int,
+    ) -> int:
+        """Writes the mapped snapshot, less what is masked, merged with the delta
+        as a new generation. Runs in a thread, so it maps the file itself."""
+        documents: Dict[str, Document] = {}
+        if file_id is not None:
+            snapshot = IndexSnapshot(self.path)
+            try:
+                if snapshot.file_id != file_id:
+                    raise RuntimeError("the published snapshot changed while compacting it")
+                documents = snapshot.documents()
+            finally:
+                snapshot.close()
+            for snippet_id in masked:
+                documents.pop(snippet_id, None)
+        for snippet_id, (terms, tags) in delta.items():
+            if snippet_id in documents:
+                # Tags added to a snapshot document: it keeps its other terms.
+                old_terms, old_tags = documents[snippet_id]
+                documents[snippet_id] = (old_terms | terms, list(set(old_tags) | set(tags)))
+            else:
+                documents[snippet_id] = (terms, tags)
+        return write_documents(self.path, documents, generation)
+
+    async def _rebuild_if_stale(self):
+        if self._source is None:
+            return
+        now = _now_micros()
+        if not self._stale(self._published_generation(), now):
+            return
+        fd = self._lock(blocking=False)
+        if fd is None:
+            return  # Another worker is building it.
+        try:
+            if not self._stale(self._published_generation(), now):
+                return
+            generation = await self._complete_until() if self._complete_until else None
+            if generation is not None:
+                # This worker's view already holds every write: no need to read them all again.
+                file_id = self._snapshot.file_id if self._snapshot is not None else None
+                count = await asyncio.to_thread(
+                    self._compact, file_id, set(self._masked), self._delta.documents(), generation
+                )
+            else:
+                generation = _now_micros()
+                snippets = await self._source()
+                count = await asyncio.to_thread(write_snapshot, self.path, snippets, generation)
+            self.builds += 1
+            logger.info("Published search index snapshot %s with %d snippets.", self.path, count)
+            if self._on_publish is not None:
+                await self._on_publish(generation)
+        finally:
+            self._unlock(fd)
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(self._check_seconds)
+            try:
+                await self._rebuild_if_stale()
+                self.reload_if_published()
+            except Exception as e:
+                logger.warning("Search index snapshot maintenance failed: %s", e)
+
+    def start(
+        self,
+        source: Callable[[], Awaitable[List[AhHaSnippet]]],
+        complete_until: Optional[Callable[[], Awaitable[Optional[int]]]] = None,
+        on_publish: Optional[Callable[[int], Awaitable[None]]] = None,
+    ):
+        """Starts checking for new generations, and publishing one when the current
+        is older than the max age.
+
+        `complete_until` returns the time (µs) before which every write is in
+        this worker's view, or None if it can't tell; the new generation is
+        then compacted from the snapshot and delta instead of streaming the
+        collection from `source`. `on_publish` gets the generation of every
+        snapshot this worker publishes.
+        """
+        self._source = source
+        self._complete_until = complete_until
+        self._on_publish = on_publish
+        if self._task is None:
+            self._task = asyncio.create_task(self._maintain())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+
+    def stats(self) -> Dict[str, float]:
+        snapshot = self._snapshot
+        return {
+            "docs": len(self),
+            "snapshot_docs": snapshot.doc_count if snapshot else 0,
+            "snapshot_bytes": snapshot.size if snapshot else 0,
+            "snapshot_age_seconds": (
+                time.time() - snapshot.generation / 1_000_000 if snapshot else 0
+            ),
+            "delta_docs": len(self._delta),
+            "masked": len(self._masked),
+            "log_entries": len(self._log),
+            "builds": self.builds,
+            "reloads": self.reloads,
+        }
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import config
+import numpy as np
+from services.dedup_index import dedup_index
+from services.embedding_index import embedding_index
+from services.keyword_engine import keyword_engine
+
+logger = logging.getLogger(__name__)
+
+# The derived indexes saved next to a published search snapshot, so a worker
+# that maps the snapshot can load them too instead of reading every snippet.
+# Each index's state() is a dict of arrays and lists of strings; a list is
+# stored as "<name>.<key>.offsets" into the UTF-8 bytes "<name>.<key>.blob".
+
+
+def _indexes() -> Dict[str, object]:
+    indexes = {"keyword": keyword_engine, "embedding": embedding_index}
+    if config.DEDUP_MODE != "off":
+        indexes["dedup"] = dedup_index
+    return indexes
+
+
+def _pack(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [value.encode("utf-8") for value in strings]
+    offsets = np.cumsum([0] + [len(value) for value in encoded], dtype=np.int64)
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _unpack(offsets: np.ndarray, blob: np.ndarray) -> List[str]:
+    data = blob.tobytes()
+    return [data[offsets[i] : offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+def _write(path: str, arrays: Dict[str, np.ndarray]):
+    # Written aside and renamed into place, like the snapshot itself.
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read(path: str) -> Dict[str, np.ndarray]:
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+
+async def save_index_state(path: str, generation: int):
+    """Saves the derived indexes as of now for a snapshot of `generation` (µs).
+
+    The state is taken on the event loop and written in a thread.
+    """
+    arrays = {"generation": np.array([generation], dtype=np.int64)}
+    for name, index in _indexes().items():
+        for key, value in index.state().items():
+            if isinstance(value, list):
+                arrays[f"{name}.{key}.offsets"], arrays[f"{name}.{key}.blob"] = _pack(value)
+            else:
+                arrays[f"{name}.{key}"] = np.asarray(value)
+    await asyncio.to_thread(_write, path, arrays)
+    logger.info("Saved derived index state %s.", path)
+
+
+async def load_index_state(path: str) -> Optional[int]:
+    """Replaces the derived indexes with the saved state and returns its
+    generation; None, leaving them as they were, if there is no usable state."""
+    try:
+        arrays = await asyncio.to_thread(_read, path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Ignoring unreadable derived index state %s: %s", path, e)
+        return None
+    indexes = _indexes()
+    states: Dict[str, dict] = {name: {} for name in indexes}
+    for full_key, value in arrays.items():
+        name, _, key = full_key.partition(".")
+        if name not in states or key.endswith(".blob"):
+            continue
+        if key.endswith(".offsets"):
+            key = key[: -len(".offsets")]
+            value = _unpack(value, arrays[f"{name}.{key}.blob"])
+        states[name][key] = value
+    if "generation" not in arrays or not all(states.values()):
+        return None
+    # The embedder may have changed since; then nothing is loaded.
+    if not embedding_index.load_state(states["embedding"]):
+        return None
+    keyword_engine.load_state(states["keyword"])
+    if "dedup" in indexes:
+        dedup_index.load_state(states["dedup"])
+    return int(arrays["generation"][0])
@@ -0,0 +1,193 @@
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+import config
+import numpy as np
+from models import AhHaSnippet
+
+# Compiled once: lowercase word tokens, and a cheap tag stripper for corpus statistics.
+# Apostrophes inside a word keep it whole, so "doesn't" is not "doesn" and "t".
+WORD_RE = re.compile(r"[^\W_]+(?:['\u2019][^\W_]+)*", re.UNICODE)
+HTML_TAG_RE = re.compile(r"<[^>]+>")
+
+MIN_WORD_LENGTH = 3
+DEFAULT_TOP_N = 7
+
+
+def _keyword_word(word: str) -> Optional[str]:
+    # A possessive counts as its noun; other contractions ("we're", "isn't") are function words.
+    if "'" not in word and "\u2019" not in word:
+        return word
+    if word[-2:] in ("'s", "\u2019s"):
+        return word[:-2]
+    return None
+
+
+def keyword_terms(text: str) -> List[str]:
+    """Unigrams (minus stop words and short words) plus bigrams of adjacent unigrams."""
+    words = [
+        word
+        for word in map(_keyword_word, WORD_RE.findall(text.lower()))
+        if word
+        and word not in config.STOP_WORDS
+        and len(word) >= MIN_WORD_LENGTH
+        and not word.isdigit()
+    ]
+    bigrams = [f"{first} {second}" for first, second in zip(words, words[1:])]
+    return words + bigrams
+
+
+def snippet_text(snippet: AhHaSnippet) -> str:
+    content = snippet.content or ""
+    if snippet.content_type == "html":
+        content = HTML_TAG_RE.sub(" ", content)
+    return " ".join(part for part in (snippet.title, content, snippet.notes) if part)
+
+
+class KeywordEngine:
+    """Corpus-aware TF-IDF keyword extractor.
+
+    Document frequencies are kept in a NumPy array indexed by a vocabulary
+    dict and maintained incrementally as snippets are stored and deleted,
+    so common words across the corpus are down-weighted.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._vocab: Dict[str, int] = {}
+        self._terms: List[Optional[str]] = []  # Index -> term, None for a free slot
+        self._free: List[int] = []
+        self._df = np.zeros(1024, dtype=np.int32)
+        self._doc_terms: Dict[str, np.ndarray] = {}
+
+    @property
+    def num_docs(self) -> int:
+        return len(self._doc_terms)
+
+    def _term_index(self, term: str) -> int:
+        index = self._vocab.get(term)
+        if index is None:
+            if self._free:
+                index = self._free.pop()
+                self._terms[index] = term
+            else:
+                index = len(self._terms)
+                self._terms.append(term)
+                if index >= len(self._df):
+                    self._df = np.concatenate([self._df, np.zeros_like(self._df)])
+            self._vocab[term] = index
+        return index
+
+    def add_document(self, doc_id: str, text: str):
+        if doc_id in self._doc_terms:
+            self.remove_document(doc_id)
+        indices = np.fromiter(
+            (self._term_index(term) for term in set(keyword_terms(text))), dtype=np.int64
+        )
+        self._doc_terms[doc_id] = indices
+        self._df[indices] += 1
+
+    def add_snippet(self, snippet: AhHaSnippet):
+        if snippet.id:
+            self.add_document(snippet.id, snippet_text(snippet))
+
+    def remove_document(self, doc_id: str):
+        indices = self._doc_terms.pop(doc_id, None)
+        if indices is None:
+            return
+        self._df[indices] -= 1
+        # Terms no document uses any more leave the vocabulary, so it tracks
+        # the live corpus instead of every bigram ever seen; slots are reused.
+        for index in indices[self._df[indices] == 0].tolist():
+            del self._vocab[self._terms[index]]
+            self._terms[index] = None
+            self._free.append(index)
+
+    def rebuild(self, snippets: Iterable[AhHaSnippet]):
+        self._reset()
+        for snippet in snippets:
+            self.add_snippet(snippet)
+
+    def state(self) -> Dict[str, object]:
+        """Everything rebuild() would derive, for load_state() in another process."""
+        ids = list(self._doc_terms)
+        lengths = [len(self._doc_terms[doc_id]) for doc_id in ids]
+        return {
+            "ids": ids,
+            "terms": [term or "" for term in self._terms],
+            "offsets": np.cumsum([0] + lengths, dtype=np.int64),
+            "indices": np.concatenate(
+                [self._doc_terms[doc_id] for doc_id in ids] or [np.zeros(0, dtype=np.int64)]
+            ),
+        }
+
+    def load_state(self, state: Dict[str, object]):
+        self._reset()
+        # Keyword terms are never empty, so "" marks a free slot.
+        self._terms = [term or None for term in state["terms"]]
+        self._vocab = {term: index for index, term in enumerate(self._terms) if term}
+        self._free = [index for index, term in enumerate(self._terms) if term is None]
+        indices = np.asarray(state["indices"], dtype=np.int64)
+        self._df = np.bincount(indices, minlength=max(1024, len(self._terms))).astype(np.int32)
+        offsets = state["offsets"]
+        for position, doc_id in enumerate(state["ids"]):
+            self._doc_terms[doc_id] = indices[offsets[position] : offsets[position + 1]]
+
+    def _idf(self, terms: List[str]) -> np.ndarray:
+        # Smoothed IDF; unseen terms get df=0 and therefore the highest weight.
+        df = np.array(
+            [
+                self._df[self._vocab[term]] if term in self._vocab else 0
+                for term in terms
+            ],
+            dtype=np.float64,
+        )
+        return np.log((1.0 + self.num_docs) / (1.0 + df)) + 1.0
+
+    def suggest_batch(
+        self, texts: List[str], top_n: int = DEFAULT_TOP_N
+    ) -> List[List[str]]:
+        """Scores many texts in one pass over a shared term matrix."""
+        term_counts = [Counter(keyword_terms(text)) for text in texts]
+        columns: Dict[str, int] = {}
+        for counts in term_counts:
+            for term in counts:
+                columns.setdefault(term, len(columns))
+        if not columns:
+            return [[] for _ in texts]
+
+        column_terms = list(columns)
+        tf = np.zeros((len(texts), len(column_terms)), dtype=np.float64)
+        for row, counts in enumerate(term_counts):
+            if counts:
+                tf[row, [columns[t] for t in counts]] = list(counts.values())
+        # Sublinear TF so one repeated word doesn't swamp the rest.
+        np.log1p(tf, out=tf)
+        scores = tf * self._idf(column_terms)
+
+        suggestions = []
+        for row in range(len(texts)):
+            nonzero = np.count_nonzero(scores[row])
+            if not nonzero:
+                suggestions.append([])
+                continue
+            # Stable sort on negated scores keeps first-seen order for ties.
+            order = np.argsort(-scores[row], kind="stable")[: min(top_n, nonzero)]
+            suggestions.append([column_terms[i] for i in order])
+        return suggestions
+
+    def suggest(self, text: str, top_n: int = DEFAULT_TOP_N) -> List[str]:
+        return self.suggest_batch([text], top_n=top_n)[0]
+
+    def stats(self) -> Dict[str, int]:
+        return {"documents": self.num_docs, "vocabulary": len(self._vocab)}
+
+
+keyword_engine = KeywordEngine()
+
+
+def get_keyword_engine() -> KeywordEngine:
+    return keyword_engine
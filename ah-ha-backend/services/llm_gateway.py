@@ -0,0 +1,240 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import config
+from services.metrics import observe_stage
+
+T = TypeVar("T")
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_HALF_OPEN = "half_open"
+CIRCUIT_OPEN = "open"
+_CIRCUIT_STATE_VALUES = {CIRCUIT_CLOSED: 0, CIRCUIT_HALF_OPEN: 1, CIRCUIT_OPEN: 2}
+
+
+class LlmUnavailable(Exception):
+    """The gateway would not (or could not) get an answer from the model in time.
+
+    Callers should fall back to a local answer rather than retry: the
+    breaker is open, the wait queue is full, the deadline passed or the
+    model's quota is exhausted.
+    """
+
+    def __init__(self, reason: str, message: str = ""):
+        super().__init__(message or reason)
+        self.reason = reason
+
+
+def is_quota_error(error: Exception) -> bool:
+    """True for 429 / RESOURCE_EXHAUSTED errors from the Gemini API."""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code == 429:
+        return True
+    text = str(error)
+    return "RESOURCE_EXHAUSTED" in text or "429" in text.split(" ", 1)[0]
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average with bursts of up to `burst`.
+
+    Waiters are served in arrival order; a rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
+        # Created on first use so it binds to the server's running event loop.
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self):
+        if self._rate <= 0:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures.
+
+    While open every call is refused. After `reset_seconds` a single probe
+    call is let through (half-open): its success closes the breaker, its
+    failure opens it again for another `reset_seconds`.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self._failure_threshold = max(1, failure_threshold)
+        self._reset_seconds = reset_seconds
+        self._state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == CIRCUIT_OPEN and time.monotonic() - self._opened_at >= self._reset_seconds:
+            return CIRCUIT_HALF_OPEN
+        return self._state
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == CIRCUIT_CLOSED:
+            return True
+        if state == CIRCUIT_HALF_OPEN and not self._probe_in_flight:
+            self._state = CIRCUIT_HALF_OPEN
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self._state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._state == CIRCUIT_HALF_OPEN or self._failures >= self._failure_threshold:
+            if self._state != CIRCUIT_OPEN:
+                self.opened += 1
+            self._state = CIRCUIT_OPEN
+            self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release(self):
+        """The call never reached the model (e.g. it timed out in the queue)."""
+        self._probe_in_flight = False
+
+
+class LlmGateway:
+    """Admission control for model calls.
+
+    Each call waits for a rate-limit token and a free in-flight slot, then
+    runs, all within one deadline. Calls beyond `max_waiting` queued ones,
+    calls that miss the deadline and calls made while the circuit breaker
+    is open raise LlmUnavailable. Timeouts and errors of calls that reached
+    the model count against the breaker.
+    """
+
+    def __init__(
+        self,
+        rate_per_second: float = config.LLM_RATE_LIMIT_PER_SECOND,
+        burst: int = config.LLM_RATE_LIMIT_BURST,
+        max_in_flight: int = config.LLM_MAX_IN_FLIGHT,
+        max_waiting: int = config.LLM_MAX_WAITING,
+        deadline_seconds: float = config.LLM_CALL_DEADLINE_SECONDS,
+        failure_threshold: int = config.LLM_CIRCUIT_FAILURE_THRESHOLD,
+        reset_seconds: float = config.LLM_CIRCUIT_RESET_SECONDS,
+    ):
+        self._bucket = TokenBucket(rate_per_second, burst)
+        self._max_in_flight = max_in_flight
+        self._max_waiting = max_waiting
+        self._deadline_seconds = deadline_seconds
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.refused: Dict[str, int] = {}
+        self.fallbacks = 0
+
+    def _refuse(self, reason: str, message: str = "") -> LlmUnavailable:
+        self.refused[reason] = self.refused.get(reason, 0) + 1
+        return LlmUnavailable(reason, message)
+
+    async def call(
+        self, make_call: Callable[[], Awaitable[T]], deadline_seconds: Optional[float] = None
+    ) -> T:
+        """Runs `make_call()` under the rate limit, concurrency cap and deadline."""
+        self.calls += 1
+        if self.waiting >= self._max_waiting:
+            raise self._refuse("overloaded", f"{self.waiting} model calls already waiting")
+        if not self.breaker.allow():
+            raise self._refuse("circuit_open", "Circuit breaker is open")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_in_flight)
+        deadline = deadline_seconds if deadline_seconds is not None else self._deadline_seconds
+        queued_at = time.perf_counter()
+        started = False
+
+        async def admitted_call():
+            nonlocal started
+            await self._bucket.acquire()
+            async with self._semaphore:
+                self.waiting -= 1
+                started = True
+                observe_stage("llm_queue_wait", time.perf_counter() - queued_at)
+                self.in_flight += 1
+                try:
+                    return await make_call()
+                finally:
+                    self.in_flight -= 1
+
+        self.waiting += 1
+        try:
+            result = await asyncio.wait_for(admitted_call(), timeout=deadline or None)
+        except asyncio.TimeoutError:
+            if started:
+                self.failed += 1
+                self.breaker.record_failure()
+            else:
+                # Still queued: the model is fine, we just couldn't get to it in time.
+                self.breaker.release()
+            raise self._refuse("deadline", f"No model reply within {deadline}s")
+        except Exception as e:
+            self.failed += 1
+            self.breaker.record_failure()
+            if is_quota_error(e):
+                raise self._refuse("quota", str(e)) from e
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        finally:
+            if not started:
+                self.waiting -= 1
+        self.succeeded += 1
+        self.breaker.record_success()
+        return result
+
+    def record_fallback(self):
+        self.fallbacks += 1
+
+    def stats(self) -> Dict[str, float]:
+        stats = {
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "fallbacks": self.fallbacks,
+            "fallback_rate": self.fallbacks / self.calls if self.calls else 0.0,
+            "circuit_state": _CIRCUIT_STATE_VALUES[self.breaker.state],
+            "circuit_opened": self.breaker.opened,
+        }
+        for reason, count in self.refused.items():
+            stats[f"refused_{reason}"] = count
+        return stats
+
+
+llm_gateway = LlmGateway()
+
+
+def get_llm_gateway() -> LlmGateway:
+    return llm_gateway
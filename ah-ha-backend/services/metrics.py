@@ -0,0 +1,169 @@
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Latency buckets in seconds, from sub-millisecond index hits to slow LLM calls.
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> LabelValues:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: LabelValues, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = _labels(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self._buckets = tuple(buckets)
+        # Per label set: [per-bucket counts..., +Inf count], sum
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = _labels(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = ([0] * (len(self._buckets) + 1), [0.0])
+            self._series[key] = series
+        counts, total = series
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self._buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(labels, [('le', _format_value(float(bound)))])} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class GaugeCollector:
+    """Gauges whose values are read from a callback at scrape time."""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+    ):
+        self.name = name
+        self.help_text = help_text
+        self._collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = list(self._collect())
+        except Exception as e:
+            return lines + [f"# collection failed: {e}"]
+        for labels, value in samples:
+            lines.append(f"{self.name}{_format_labels(_labels(labels))} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Metrics are per process; with gunicorn -w 4 each worker reports its own
+# series and Prometheus aggregates across scrapes of the instances.
+registry = Registry()
+
+stage_duration = registry.register(
+    Histogram(
+        "ah_ha_stage_duration_seconds",
+        "Latency of individual capture/read pipeline stages.",
+    )
+)
+http_requests = registry.register(
+    Counter("ah_ha_http_requests_total", "HTTP requests by method, route and status.")
+)
+http_errors = registry.register(
+    Counter("ah_ha_http_errors_total", "HTTP requests that ended in a 5xx or an unhandled exception.")
+)
+http_request_duration = registry.register(
+    Histogram("ah_ha_http_request_duration_seconds", "End-to-end HTTP request latency.")
+)
+
+
+def time_stage(stage: str):
+    """Context manager recording the duration of a pipeline stage."""
+    return stage_duration.time(stage=stage)
+
+
+def observe_stage(stage: str, seconds: float):
+    stage_duration.observe(seconds, stage=stage)
+
+
+def register_gauges(
+    name: str, help_text: str, collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]]
+):
+    registry.register(GaugeCollector(name, help_text, collect))
+
+
+def render_metrics() -> str:
+    return registry.render()
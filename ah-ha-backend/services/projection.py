@@ -0,0 +1,68 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import config
+from models import AhHaSnippet
+from services.text_extraction import extract_text
+
+SNIPPET_FIELDS = tuple(
+    name for name, field in AhHaSnippet.model_fields.items() if not field.exclude
+)
+# What the list UI renders: no content, notes or other large fields.
+SUMMARY_FIELDS = (
+    "id",
+    "title",
+    "preview",
+    "permalink_to_origin",
+    "content_type",
+    "generated_tags",
+    "tagging_status",
+    "duplicate_of",
+    "timestamp",
+)
+
+
+def parse_fields(fields: Optional[str], view: Optional[str]) -> Optional[List[str]]:
+    """Fields to return for a `fields=a,b` or `view=summary` request; None means all.
+
+    The ID is always included since it is the pagination cursor. Raises
+    ValueError for a field AhHaSnippet doesn't have.
+    """
+    if fields:
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in requested if field not in SNIPPET_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        return list(dict.fromkeys(["id"] + requested))
+    if view == "summary":
+        return list(SUMMARY_FIELDS)
+    return None
+
+
+def project(snippet: AhHaSnippet, fields: List[str]) -> Dict[str, Any]:
+    return {field: getattr(snippet, field) for field in fields}
+
+
+async def make_preview(snippet: AhHaSnippet) -> str:
+    """First SNIPPET_PREVIEW_CHARS of the visible text, cut at a word boundary.
+
+    HTML is parsed in the text extraction pool, off the event loop.
+    """
+    limit = config.SNIPPET_PREVIEW_CHARS
+    content = snippet.content or ""
+    if snippet.content_type == "html":
+        # The extractor stops parsing once it has this much text.
+        content = await extract_text(content, max_chars=limit * 2)
+    text = " ".join(content[: limit * 4].split())
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    space = cut.rfind(" ")
+    if space > limit // 2:
+        cut = cut[:space]
+    return cut.rstrip() + "…"
+
+
+async def make_previews(snippets: List[AhHaSnippet]) -> List[str]:
+    """make_preview for many snippets, parsed side by side in the pool."""
+    return list(await asyncio.gather(*(make_preview(snippet) for snippet in snippets)))
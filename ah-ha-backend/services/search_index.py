@@ -0,0 +1,191 @@
+import bisect
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import config
+from models import AhHaSnippet
+
+# Tokens are runs of word characters; everything is matched lowercase.
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Splits text into lowercase word tokens."""
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+
+def snippet_tokens(snippet: AhHaSnippet) -> Set[str]:
+    """Collects the searchable tokens of a snippet (title, content, notes, tags)."""
+    tokens = set(tokenize(snippet.title))
+    tokens.update(tokenize(snippet.content))
+    tokens.update(tokenize(snippet.notes))
+    for tag in snippet.generated_tags or []:
+        tokens.update(tokenize(tag))
+    return tokens
+
+
+def intersect_matches(query: str, match_token: Callable[[str], Set[str]]) -> Set[str]:
+    """IDs matching every token of the query, where `match_token` does one token.
+
+    This is what a search means, on every backend: each word of the query
+    must start a word of the snippet, in any order. "asyn loop" finds
+    "asyncio event loop"; "ing" doesn't find "testing" and "script"
+    doesn't find "JavaScript", which the old substring scan did.
+    """
+    query_tokens = tokenize(query)
+    if not query_tokens:
+        return set()
+    # Look up the longest (most selective) tokens first so we can stop early.
+    result: Optional[Set[str]] = None
+    for token in sorted(set(query_tokens), key=len, reverse=True):
+        matches = match_token(token)
+        result = matches if result is None else result & matches
+        if not result:
+            return set()
+    return result or set()
+
+
+class InvertedIndex:
+    """In-process token -> snippet ID postings with prefix lookup.
+
+    Terms are also kept in a sorted list so a query token can match every
+    indexed term it is a prefix of, which keeps "typing as you search"
+    queries working (see intersect_matches for what matches). Exact tags get
+    postings of their own so a tag filter can narrow a search before any
+    document is read.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = {}
+        self._doc_terms: Dict[str, Set[str]] = {}
+        self._sorted_terms: List[str] = []
+        self._tag_docs: Dict[str, Set[str]] = {}
+        self._doc_tags: Dict[str, Set[str]] = {}
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def __contains__(self, snippet_id: str) -> bool:
+        return snippet_id in self._doc_terms
+
+    def clear(self):
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._sorted_terms = []
+        self._tag_docs.clear()
+        self._doc_tags.clear()
+        self.ready = False
+
+    def add(self, snippet: AhHaSnippet):
+        """Indexes (or re-indexes) a snippet. The snippet must have an ID."""
+        if not snippet.id:
+            return
+        if snippet.id in self._doc_terms:
+            self.remove(snippet.id)
+        self.extend(snippet.id, snippet_tokens(snippet), snippet.generated_tags or [])
+
+    def add_tags(self, snippet_id: str, tags: Iterable[str]):
+        """Adds tag tokens to an already indexed snippet (e.g. after background tagging)."""
+        if snippet_id not in self._doc_terms:
+            return
+        tags = list(tags)
+        self.extend(snippet_id, {term for tag in tags for term in tokenize(tag)}, tags)
+
+    def extend(self, snippet_id: str, terms: Iterable[str], tags: Iterable[str]):
+        """Adds terms and exact tags to a snippet, indexing it if it isn't yet."""
+        doc_terms = self._doc_terms.setdefault(snippet_id, set())
+        for term in terms:
+            if term in doc_terms:
+                continue
+            doc_terms.add(term)
+            postings = self._postings.get(term)
+            if postings is None:
+                self._postings[term] = {snippet_id}
+                bisect.insort(self._sorted_terms, term)
+            else:
+                postings.add(snippet_id)
+        doc_tags = self._doc_tags.setdefault(snippet_id, set())
+        for tag in tags:
+            doc_tags.add(tag)
+            self._tag_docs.setdefault(tag, set()).add(snippet_id)
+
+    def remove(self, snippet_id: str):
+        """Drops a snippet from every posting list it appears in."""
+        terms = self._doc_terms.pop(snippet_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.discard(snippet_id)
+            if not postings:
+                del self._postings[term]
+                pos = bisect.bisect_left(self._sorted_terms, term)
+                if pos < len(self._sorted_terms) and self._sorted_terms[pos] == term:
+                    del self._sorted_terms[pos]
+        for tag in self._doc_tags.pop(snippet_id, ()):
+            docs = self._tag_docs.get(tag)
+            if docs is None:
+                continue
+            docs.discard(snippet_id)
+            if not docs:
+                del self._tag_docs[tag]
+
+    def documents(self) -> Dict[str, Tuple[Set[str], List[str]]]:
+        """A copy of every snippet's terms and exact tags."""
+        return {
+            snippet_id: (set(terms), list(self._doc_tags.get(snippet_id, ())))
+            for snippet_id, terms in self._doc_terms.items()
+        }
+
+    def rebuild(self, snippets: Iterable[AhHaSnippet]):
+        self.clear()
+        for snippet in snippets:
+            self.add(snippet)
+        self.ready = True
+
+    def prefix_matches(self, prefix: str) -> Set[str]:
+        matches: Set[str] = set()
+        pos = bisect.bisect_left(self._sorted_terms, prefix)
+        while pos < len(self._sorted_terms) and self._sorted_terms[pos].startswith(
+            prefix
+        ):
+            matches |= self._postings[self._sorted_terms[pos]]
+            pos += 1
+        return matches
+
+    def tag_matches(self, tag: str) -> Set[str]:
+        """IDs of snippets that were indexed with this exact tag (a superset: tags
+        replaced later are not dropped)."""
+        return set(self._tag_docs.get(tag, ()))
+
+    def search(self, query: str, tag: Optional[str] = None) -> Set[str]:
+        """Returns IDs of snippets matching every token of the query by prefix."""
+        result = intersect_matches(query, self.prefix_matches)
+        if tag and result:
+            result &= self.tag_matches(tag)
+        return result
+
+
+def _build_search_index():
+    if config.SEARCH_SNAPSHOT_PATH:
+        # Shared across workers through an mmap'd file; see services.index_snapshot.
+        from services.index_snapshot import SnapshotSearchIndex
+
+        return SnapshotSearchIndex(config.SEARCH_SNAPSHOT_PATH)
+    return InvertedIndex()
+
+
+_search_index = None
+
+
+def get_search_index():
+    # Built on first use: the snapshot-backed index imports this module.
+    global _search_index
+    if _search_index is None:
+        _search_index = _build_search_index()
+    return _search_index
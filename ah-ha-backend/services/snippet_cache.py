@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import config
+from models import AhHaSnippet
+
+logger = logging.getLogger(__name__)
+
+
+class SnippetCache:
+    """Read-through cache for snippet detail and list queries.
+
+    Two tiers: a bounded LRU of AhHaSnippet objects by ID, and a small
+    TTL'd cache of list/search results keyed by the query arguments. Writes
+    in this worker invalidate synchronously. Writes made by other workers
+    invalidate when the periodic search index refresh reads them from the
+    change feed, or at once with the optional Firestore snapshot listener;
+    the TTLs bound staleness when neither runs.
+    """
+
+    def __init__(
+        self,
+        max_snippets: int = config.SNIPPET_CACHE_MAX_ENTRIES,
+        snippet_ttl_seconds: float = config.SNIPPET_CACHE_TTL_SECONDS,
+        max_results: int = config.LIST_CACHE_MAX_ENTRIES,
+        result_ttl_seconds: float = config.LIST_CACHE_TTL_SECONDS,
+    ):
+        self._max_snippets = max_snippets
+        self._snippet_ttl_seconds = snippet_ttl_seconds
+        self._max_results = max_results
+        self._result_ttl_seconds = result_ttl_seconds
+        self._snippets: "OrderedDict[str, Tuple[AhHaSnippet, float]]" = OrderedDict()
+        self._results: "OrderedDict[Hashable, Tuple[List[AhHaSnippet], float]]" = (
+            OrderedDict()
+        )
+        self.snippet_hits = 0
+        self.snippet_misses = 0
+        self.result_hits = 0
+        self.result_misses = 0
+        self.invalidations = 0
+        self.remote_invalidations = 0
+        # Age of entries at the moment they were served, i.e. worst-case staleness.
+        self._served_age_total = 0.0
+        self._served_age_max = 0.0
+
+    def _record_served(self, cached_at: float):
+        age = time.monotonic() - cached_at
+        self._served_age_total += age
+        self._served_age_max = max(self._served_age_max, age)
+
+    @staticmethod
+    def _lru_put(entries: OrderedDict, key, value, max_entries: int):
+        entries[key] = (value, time.monotonic())
+        entries.move_to_end(key)
+        while len(entries) > max_entries:
+            entries.popitem(last=False)
+
+    def get_snippet(self, snippet_id: str) -> Optional[AhHaSnippet]:
+        entry = self._snippets.get(snippet_id)
+        if entry is not None:
+            snippet, cached_at = entry
+            if time.monotonic() - cached_at <= self._snippet_ttl_seconds:
+                self._snippets.move_to_end(snippet_id)
+                self.snippet_hits += 1
+                self._record_served(cached_at)
+                return snippet
+            del self._snippets[snippet_id]
+        self.snippet_misses += 1
+        return None
+
+    def put_snippet(self, snippet: AhHaSnippet):
+        if snippet.id:
+            self._lru_put(self._snippets, snippet.id, snippet, self._max_snippets)
+
+    def get_results(self, key: Hashable) -> Optional[List[AhHaSnippet]]:
+        entry = self._results.get(key)
+        if entry is not None:
+            snippets, cached_at = entry
+            if time.monotonic() - cached_at <= self._result_ttl_seconds:
+                self._results.move_to_end(key)
+                self.result_hits += 1
+                self._record_served(cached_at)
+                return list(snippets)
+            del self._results[key]
+        self.result_misses += 1
+        return None
+
+    def put_results(self, key: Hashable, snippets: List[AhHaSnippet]):
+        self._lru_put(self._results, key, list(snippets), self._max_results)
+        # List results double as a warm-up for the detail view (projected
+        # results are plain dicts and can't serve it).
+        for snippet in snippets:
+            if isinstance(snippet, AhHaSnippet):
+                self.put_snippet(snippet)
+
+    def invalidate(self, snippet_id: Optional[str] = None, remote: bool = False):
+        """Drops a snippet and every cached list, since any list may contain it."""
+        if snippet_id:
+            self._snippets.pop(snippet_id, None)
+        self._results.clear()
+        if remote:
+            self.remote_invalidations += 1
+        else:
+            self.invalidations += 1
+
+    def invalidate_many(self, snippet_ids: Iterable[str], remote: bool = False):
+        """invalidate() for a batch of snippets, clearing the lists once."""
+        for snippet_id in snippet_ids:
+            self._snippets.pop(snippet_id, None)
+            if remote:
+                self.remote_invalidations += 1
+            else:
+                self.invalidations += 1
+        self._results.clear()
+
+    def stats(self) -> Dict[str, float]:
+        hits = self.snippet_hits + self.result_hits
+        lookups = hits + self.snippet_misses + self.result_misses
+        return {
+            "snippet_entries": len(self._snippets),
+            "result_entries": len(self._results),
+            "snippet_hits": self.snippet_hits,
+            "snippet_misses": self.snippet_misses,
+            "result_hits": self.result_hits,
+            "result_misses": self.result_misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "remote_invalidations": self.remote_invalidations,
+            "served_age_avg_seconds": self._served_age_total / hits if hits else 0.0,
+            "served_age_max_seconds": self._served_age_max,
+        }
+
+
+snippet_cache = SnippetCache()
+_snapshot_watch = None
+
+
+def get_snippet_cache() -> SnippetCache:
+    return snippet_cache
+
+
+def start_snapshot_listener(
+    collection_name: str,
+    on_change: Optional[Callable[[str, str, Optional[dict]], None]] = None,
+):
+    """Keeps this worker's cache coherent with writes made by other workers.
+
+    The async Firestore client has no on_snapshot, so this uses the sync
+    client, whose callbacks arrive on a background thread; they are handed
+    back to the event loop before touching the cache. `on_change`, if given,
+    also gets every change as (ADDED | MODIFIED | REMOVED, id, data), so one
+    listener per worker serves both the cache and GET /events.
+    """
+    global _snapshot_watch
+    if _snapshot_watch is not None:
+        return
+    from google.cloud import firestore_v1 as firestore
+
+    loop = asyncio.get_running_loop()
+    initial_snapshot = [True]
+
+    def on_snapshot(_docs, changes, _read_time):
+        if initial_snapshot[0]:
+            # The first callback lists every existing document; nothing changed yet.
+            initial_snapshot[0] = False
+            return
+        for change in changes:
+            loop.call_soon_threadsafe(
+                snippet_cache.invalidate, change.document.id, True
+            )
+            if on_change is not None:
+                change_type = change.type.name
+                data = change.document.to_dict() if change_type != "REMOVED" else None
+                loop.call_soon_threadsafe(on_change, change_type, change.document.id, data)
+
+    try:
+        _snapshot_watch = (
+            firestore.Client().collection(collection_name).on_snapshot(on_snapshot)
+        )
+        logger.info("Snippet cache snapshot listener started on %s.", collection_name)
+    except Exception as e:
+        logger.warning("Could not start snippet cache snapshot listener: %s", e)
+        _snapshot_watch = None
+
+
+def stop_snapshot_listener():
+    global _snapshot_watch
+    if _snapshot_watch is not None:
+        _snapshot_watch.unsubscribe()
+        _snapshot_watch = None
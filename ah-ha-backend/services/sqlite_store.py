@@ -0,0 +1,639 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+
+import config
+from models import AhHaSnippet, TagCount
+from services.changes import ChangeBatch, ChangeCursor
+from services.metrics import time_stage
+from services.projection import make_previews
+from services.search_index import tokenize
+from services.storage import (
+    SnippetFields,
+    SnippetStore,
+    index_created,
+    index_deleted,
+    index_loaded,
+    index_tags_updated,
+)
+from services.text_extraction import html_to_text
+
+logger = logging.getLogger(__name__)
+
+# bm25() column weights for (title, body, notes, tags): title and tag hits rank highest.
+_BM25_WEIGHTS = "10.0, 1.0, 2.0, 5.0"
+# Rows fetched per query while streaming an unbounded listing.
+_STREAM_PAGE_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snippets (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    ts REAL NOT NULL,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL,
+    notes TEXT,
+    tags TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snippets_ts ON snippets (ts);
+CREATE VIRTUAL TABLE IF NOT EXISTS snippets_fts USING fts5(
+    title, body, notes, tags,
+    content='snippets', content_rowid='seq', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS snippets_ai AFTER INSERT ON snippets BEGIN
+    INSERT INTO snippets_fts (rowid, title, body, notes, tags)
+    VALUES (new.seq, new.title, new.body, new.notes, new.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS snippets_ad AFTER DELETE ON snippets BEGIN
+    INSERT INTO snippets_fts (snippets_fts, rowid, title, body, notes, tags)
+    VALUES ('delete', old.seq, old.title, old.body, old.notes, old.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS snippets_au AFTER UPDATE ON snippets BEGIN
+    INSERT INTO snippets_fts (snippets_fts, rowid, title, body, notes, tags)
+    VALUES ('delete', old.seq, old.title, old.body, old.notes, old.tags);
+    INSERT INTO snippets_fts (rowid, title, body, notes, tags)
+    VALUES (new.seq, new.title, new.body, new.notes, new.tags);
+END;
+CREATE TABLE IF NOT EXISTS tag_counts (
+    tag TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS snippets_tags_ai AFTER INSERT ON snippets BEGIN
+    INSERT INTO tag_counts (tag, count)
+    SELECT DISTINCT value, 1 FROM json_each(new.data, '$.generated_tags') WHERE type = 'text'
+    ON CONFLICT (tag) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS snippets_tags_ad AFTER DELETE ON snippets BEGIN
+    UPDATE tag_counts SET count = count - 1
+    WHERE tag IN (SELECT value FROM json_each(old.data, '$.generated_tags'));
+END;
+CREATE TRIGGER IF NOT EXISTS snippets_tags_au AFTER UPDATE OF data ON snippets BEGIN
+    UPDATE tag_counts SET count = count - 1
+    WHERE tag IN (SELECT value FROM json_each(old.data, '$.generated_tags'));
+    INSERT INTO tag_counts (tag, count)
+    SELECT DISTINCT value, 1 FROM json_each(new.data, '$.generated_tags') WHERE type = 'text'
+    ON CONFLICT (tag) DO UPDATE SET count = count + 1;
+END;
+CREATE TABLE IF NOT EXISTS snippet_changes (
+    change_seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    changed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snippet_changes_tombstones ON snippet_changes (deleted, changed_at);
+CREATE TRIGGER IF NOT EXISTS snippets_changes_ai AFTER INSERT ON snippets BEGIN
+    INSERT OR REPLACE INTO snippet_changes (id, deleted, changed_at) VALUES (new.id, 0, {now});
+END;
+CREATE TRIGGER IF NOT EXISTS snippets_changes_au AFTER UPDATE ON snippets BEGIN
+    INSERT OR REPLACE INTO snippet_changes (id, deleted, changed_at) VALUES (new.id, 0, {now});
+END;
+CREATE TRIGGER IF NOT EXISTS snippets_changes_ad AFTER DELETE ON snippets BEGIN
+    INSERT OR REPLACE INTO snippet_changes (id, deleted, changed_at) VALUES (old.id, 1, {now});
+END;
+""".format(
+    # Unix time in seconds; unixepoch('subsec') needs SQLite 3.42.
+    now="(julianday('now') - 2440587.5) * 86400.0"
+)
+# Tag counts are kept by the triggers above, in the same transaction as the write.
+_COUNT_ALL_TAGS = (
+    "INSERT INTO tag_counts (tag, count) SELECT value, COUNT(DISTINCT seq) "
+    "FROM snippets, json_each(snippets.data, '$.generated_tags') WHERE type = 'text' GROUP BY value"
+)
+# The change feed keeps one row per snippet ID: INSERT OR REPLACE moves a
+# snippet to the end of the feed (a new change_seq) on every write, and a
+# delete leaves a tombstone row in its place.
+_RECORD_ALL_CHANGES = (
+    "INSERT INTO snippet_changes (id, deleted, changed_at) SELECT id, 0, ts FROM snippets ORDER BY seq"
+)
+_TAG_FILTER_SQL = "EXISTS (SELECT 1 FROM json_each(data, '$.generated_tags') WHERE value = ?)"
+
+# A page key is (ts, seq) for listings and (score, seq) for ranked searches.
+PageKey = Tuple[float, int]
+
+
+def _fts_query(search_term: str) -> str:
+    # Same semantics as the in-process index (see intersect_matches): every
+    # token must prefix-match a word; there is no infix matching.
+    return " ".join(f'"{token}"*' for token in dict.fromkeys(tokenize(search_term)))
+
+
+def _epoch(timestamp: Optional[datetime.datetime]) -> float:
+    if timestamp is None:
+        return 0.0
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp.timestamp()
+
+
+def _columns_sql(fields: Optional[List[str]]) -> Tuple[str, list]:
+    """SELECT expression (and its parameters) for full rows or a field projection."""
+    if not fields:
+        return "data", []
+    # With two or more paths json_extract returns a JSON array of the values.
+    return f"json_extract(data, {', '.join('?' * (len(fields) + 1))})", [
+        "$.id",
+        *(f"$.{field}" for field in fields),
+    ]
+
+
+def _decode(data: str, fields: Optional[List[str]]) -> Union[AhHaSnippet, SnippetFields]:
+    if not fields:
+        return AhHaSnippet.model_validate_json(data)
+    return dict(zip(fields, json.loads(data)[1:]))
+
+
+def _row_values(snippet: AhHaSnippet) -> tuple:
+    body = snippet.content or ""
+    if snippet.content_type == "html" and body:
+        body = html_to_text(body)
+    return (
+        snippet.id,
+        _epoch(snippet.timestamp),
+        snippet.title,
+        body,
+        snippet.notes,
+        " ".join(snippet.generated_tags or []),
+        snippet.model_dump_json(),
+    )
+
+
+class SqliteSnippetStore(SnippetStore):
+    """Embedded single-node backend: SQLite in WAL mode with an FTS5 index.
+
+    Writes go through one writer thread; reads use a small pool of threads,
+    each with its own connection, which WAL lets run alongside the writer.
+    Searches are ranked with bm25 and every listing uses keyset pagination
+    on an indexed sort key, so a page costs the same wherever it starts.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, read_connections: int = config.SQLITE_READ_CONNECTIONS):
+        self._path = path
+        self._read_connections = read_connections
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._readers = ThreadPoolExecutor(
+            max_workers=read_connections, thread_name_prefix="sqlite-reader"
+        )
+
+    # --- connections, run on the executor threads ---------------------------
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    async def _write(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._writer, fn, *args)
+
+    async def _read(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._readers, fn, *args)
+
+    # --- synchronous operations ---------------------------------------------
+
+    def _create_schema(self):
+        self._connection().executescript(_SCHEMA)
+
+    def _insert(self, snippets: List[AhHaSnippet]):
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO snippets (id, ts, title, body, notes, tags, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [_row_values(snippet) for snippet in snippets],
+            )
+
+    def _upsert(self, snippets: List[AhHaSnippet]) -> List[str]:
+        """Inserts or replaces snippets by ID; returns the IDs that already existed."""
+        conn = self._connection()
+        ids = [snippet.id for snippet in snippets]
+        with conn:
+            existing = {
+                snippet_id
+                for (snippet_id,) in conn.execute(
+                    f"SELECT id FROM snippets WHERE id IN ({', '.join('?' * len(ids))})", ids
+                )
+            }
+            # Separate UPDATE and INSERT rather than an upsert: an ON CONFLICT
+            # clause would override the triggers' INSERT OR REPLACE.
+            conn.executemany(
+                "UPDATE snippets SET ts = ?, title = ?, body = ?, notes = ?, tags = ?, data = ? WHERE id = ?",
+                [
+                    (*_row_values(snippet)[1:], snippet.id)
+                    for snippet in snippets
+                    if snippet.id in existing
+                ],
+            )
+            conn.executemany(
+                "INSERT INTO snippets (id, ts, title, body, notes, tags, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [_row_values(snippet) for snippet in snippets if snippet.id not in existing],
+            )
+        return list(existing)
+
+    def _delete_many(self, snippet_ids: List[str]) -> List[str]:
+        """Deletes snippets by ID; returns the IDs that existed."""
+        conn = self._connection()
+        placeholders = ", ".join("?" * len(snippet_ids))
+        with conn:
+            existing = [
+                snippet_id
+                for (snippet_id,) in conn.execute(
+                    f"SELECT id FROM snippets WHERE id IN ({placeholders})", snippet_ids
+                )
+            ]
+            conn.execute(f"DELETE FROM snippets WHERE id IN ({placeholders})", snippet_ids)
+        return existing
+
+    def _export_page(self, after: str, limit: int) -> List[AhHaSnippet]:
+        rows = self._connection().execute(
+            "SELECT data FROM snippets WHERE id > ? ORDER BY id LIMIT ?", (after, limit)
+        ).fetchall()
+        return [AhHaSnippet.model_validate_json(data) for (data,) in rows]
+
+    def _set_previews(self, previews: List[Tuple[str, str]]):
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "UPDATE snippets SET data = json_set(data, '$.preview', ?) WHERE id = ?",
+                previews,
+            )
+
+    def _load_all(self) -> List[AhHaSnippet]:
+        rows = self._connection().execute("SELECT data FROM snippets").fetchall()
+        return [AhHaSnippet.model_validate_json(data) for (data,) in rows]
+
+    def _get(self, snippet_id: str) -> Optional[AhHaSnippet]:
+        row = self._connection().execute(
+            "SELECT data FROM snippets WHERE id = ?", (snippet_id,)
+        ).fetchone()
+        return AhHaSnippet.model_validate_json(row[0]) if row else None
+
+    def _get_many(
+        self, snippet_ids: List[str], fields: Optional[List[str]]
+    ) -> Dict[str, Union[AhHaSnippet, SnippetFields]]:
+        columns, params = _columns_sql(fields)
+        placeholders = ", ".join("?" * len(snippet_ids))
+        rows = self._connection().execute(
+            f"SELECT id, {columns} FROM snippets WHERE id IN ({placeholders})",
+            (*params, *snippet_ids),
+        ).fetchall()
+        return {snippet_id: _decode(data, fields) for snippet_id, data in rows}
+
+    def _cursor_key(self, match: Optional[str], snippet_id: str) -> PageKey:
+        conn = self._connection()
+        if match is None:
+            row = conn.execute("SELECT ts, seq FROM snippets WHERE id = ?", (snippet_id,)).fetchone()
+        else:
+            row = conn.execute(
+                f"SELECT bm25(snippets_fts, {_BM25_WEIGHTS}), rowid FROM snippets_fts "
+                "WHERE snippets_fts MATCH ? AND rowid = (SELECT seq FROM snippets WHERE id = ?)",
+                (match, snippet_id),
+            ).fetchone()
+        if row is None:
+            raise ValueError(f"Unknown start_after cursor: {snippet_id}")
+        return row[0], row[1]
+
+    def _page(
+        self,
+        match: Optional[str],
+        start_after: Optional[str],
+        after_key: Optional[PageKey],
+        limit: int,
+        fields: Optional[List[str]] = None,
+        tag: Optional[str] = None,
+    ) -> List[Tuple[Union[AhHaSnippet, SnippetFields], PageKey]]:
+        if after_key is None and start_after:
+            after_key = self._cursor_key(match, start_after)
+        conn = self._connection()
+        columns, params = _columns_sql(fields)
+        conditions = []
+        if match is None:
+            sql = f"SELECT {columns}, ts, seq FROM snippets"
+            if after_key is not None:
+                conditions.append("(ts < ? OR (ts = ? AND seq < ?))")
+                params += [after_key[0], after_key[0], after_key[1]]
+            order = " ORDER BY ts DESC, seq DESC LIMIT ?"
+        else:
+            # bm25 scores are negative; lower is a better match.
+            sql = (
+                f"SELECT {columns}, score, seq FROM (SELECT s.data AS data, s.seq AS seq, "
+                f"bm25(snippets_fts, {_BM25_WEIGHTS}) AS score FROM snippets_fts "
+                "JOIN snippets s ON s.seq = snippets_fts.rowid WHERE snippets_fts MATCH ?)"
+            )
+            params.append(match)
+            if after_key is not None:
+                conditions.append("(score > ? OR (score = ? AND seq < ?))")
+                params += [after_key[0], after_key[0], after_key[1]]
+            order = " ORDER BY score, seq DESC LIMIT ?"
+        if tag:
+            conditions.append(_TAG_FILTER_SQL)
+            params.append(tag)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        rows = conn.execute(sql + order, params + [limit]).fetchall()
+        return [(_decode(data, fields), (key, seq)) for data, key, seq in rows]
+
+    def _update_tags(self, snippet_id: str, generated_tags: List[str], tagging_status: str) -> int:
+        conn = self._connection()
+        updated_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with conn:
+            return conn.execute(
+                "UPDATE snippets SET tags = ?, data = json_set(data, '$.generated_tags', json(?), "
+                "'$.tagging_status', ?, '$.updated_at', ?) WHERE id = ?",
+                (
+                    " ".join(generated_tags),
+                    json.dumps(generated_tags),
+                    tagging_status,
+                    updated_at,
+                    snippet_id,
+                ),
+            ).rowcount
+
+    def _changes(self, after_seq: int, limit: int) -> List[tuple]:
+        return self._connection().execute(
+            "SELECT c.change_seq, c.changed_at, c.id, c.deleted, s.data FROM snippet_changes c "
+            "LEFT JOIN snippets s ON s.id = c.id WHERE c.change_seq > ? ORDER BY c.change_seq LIMIT ?",
+            (after_seq, limit),
+        ).fetchall()
+
+    def _prepare_changes(self) -> int:
+        """Records existing snippets in a feed created after them, once, and
+        purges tombstones past their retention; returns the number purged."""
+        conn = self._connection()
+        with conn:
+            if not conn.execute("SELECT 1 FROM snippet_changes LIMIT 1").fetchone():
+                conn.execute(_RECORD_ALL_CHANGES)
+            return conn.execute(
+                "DELETE FROM snippet_changes WHERE deleted = 1 AND changed_at < ?",
+                (time.time() - config.CHANGES_TOMBSTONE_TTL_DAYS * 86400,),
+            ).rowcount
+
+    def _tag_counts(self, limit: Optional[int]) -> List[TagCount]:
+        rows = self._connection().execute(
+            "SELECT tag, count FROM tag_counts WHERE count > 0 ORDER BY count DESC, tag LIMIT ?",
+            (limit or -1,),
+        ).fetchall()
+        return [TagCount(tag=tag, count=count) for tag, count in rows]
+
+    def _rebuild_tag_counts(self, only_if_empty: bool = False) -> int:
+        conn = self._connection()
+        with conn:
+            if only_if_empty and conn.execute("SELECT 1 FROM tag_counts LIMIT 1").fetchone():
+                return 0
+            conn.execute("DELETE FROM tag_counts")
+            conn.execute(_COUNT_ALL_TAGS)
+        return conn.execute("SELECT COUNT(*) FROM tag_counts").fetchone()[0]
+
+    def _delete(self, snippet_id: str) -> int:
+        conn = self._connection()
+        with conn:
+            return conn.execute("DELETE FROM snippets WHERE id = ?", (snippet_id,)).rowcount
+
+    def _close_connections(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+    # --- SnippetStore --------------------------------------------------------
+
+    async def warm_up(self):
+        # Open the writer and every reader connection (WAL setup included) up front.
+        await asyncio.gather(
+            self._write(self._connection),
+            *(self._read(self._connection) for _ in range(self._read_connections)),
+        )
+
+    async def start(self):
+        await self._write(self._create_schema)
+        # Databases created before tag counts existed are counted once.
+        await self._write(self._rebuild_tag_counts, True)
+        purged = await self._write(self._prepare_changes)
+        if purged:
+            logger.info("Purged %d expired deletion tombstones.", purged)
+        with time_stage("sqlite_read"):
+            snippets = await self._read(self._load_all)
+        # Rows written before previews existed get one now, once.
+        without_preview = [snippet for snippet in snippets if snippet.preview is None]
+        previews = []
+        for snippet, preview in zip(without_preview, await make_previews(without_preview)):
+            snippet.preview = preview
+            previews.append((preview, snippet.id))
+        if previews:
+            with time_stage("sqlite_write"):
+                await self._write(self._set_previews, previews)
+        await index_loaded(snippets)
+        logger.info("SQLite store %s opened with %d snippets.", self._path, len(snippets))
+
+    async def close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self._close_connections()
+
+    async def _new_snippets(self, snippets: List[AhHaSnippet]) -> List[AhHaSnippet]:
+        # Like Firestore's SERVER_TIMESTAMP, the store sets the creation time.
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return [
+            snippet.model_copy(
+                update={
+                    "id": os.urandom(10).hex(),
+                    "timestamp": now,
+                    "updated_at": now,
+                    "preview": preview,
+                }
+            )
+            for snippet, preview in zip(snippets, await make_previews(snippets))
+        ]
+
+    async def create_snippet(self, snippet: AhHaSnippet) -> AhHaSnippet:
+        (created,) = await self._new_snippets([snippet])
+        with time_stage("sqlite_write"):
+            await self._write(self._insert, [created])
+        await index_created([created])
+        return created
+
+    async def create_snippets_batch(
+        self, snippets: List[AhHaSnippet]
+    ) -> List[Union[AhHaSnippet, Exception]]:
+        """Inserts the whole batch in one transaction; on failure every item gets the error."""
+        created = await self._new_snippets(snippets)
+        try:
+            with time_stage("sqlite_write"):
+                await self._write(self._insert, created)
+        except Exception as e:
+            logger.error("Error inserting batch of %d snippets into SQLite: %s", len(created), e)
+            return [e] * len(created)
+        await index_created(created)
+        return list(created)
+
+    async def get_snippet_by_id(self, snippet_id: str) -> Optional[AhHaSnippet]:
+        with time_stage("sqlite_read"):
+            return await self._read(self._get, snippet_id)
+
+    async def get_snippets_by_ids(
+        self, snippet_ids: List[str], fields: Optional[List[str]] = None
+    ) -> List[Union[AhHaSnippet, SnippetFields]]:
+        if not snippet_ids:
+            return []
+        with time_stage("sqlite_read"):
+            found = await self._read(self._get_many, list(dict.fromkeys(snippet_ids)), fields)
+        return [found[snippet_id] for snippet_id in snippet_ids if snippet_id in found]
+
+    async def iter_snippets(
+        self,
+        search_term: Optional[str] = None,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        tag: Optional[str] = None,
+    ) -> AsyncIterator[Union[AhHaSnippet, SnippetFields]]:
+        match = _fts_query(search_term) if search_term else None
+        if search_term and not match:
+            return
+        after_key: Optional[PageKey] = None
+        yielded = 0
+        while True:
+            page_size = _STREAM_PAGE_SIZE if not limit else min(_STREAM_PAGE_SIZE, limit - yielded)
+            with time_stage("sqlite_read"):
+                rows = await self._read(
+                    self._page,
+                    match,
+                    start_after if after_key is None else None,
+                    after_key,
+                    page_size,
+                    fields,
+                    tag,
+                )
+            for snippet, after_key in rows:
+                yield snippet
+            yielded += len(rows)
+            if len(rows) < page_size or (limit and yielded >= limit):
+                return
+
+    async def get_all_snippets(
+        self,
+        search_term: Optional[str] = None,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        tag: Optional[str] = None,
+    ) -> List[Union[AhHaSnippet, SnippetFields]]:
+        return [
+            snippet
+            async for snippet in self.iter_snippets(
+                search_term=search_term,
+                limit=limit,
+                start_after=start_after,
+                fields=fields,
+                tag=tag,
+            )
+        ]
+
+    async def update_snippet_tags(
+        self, snippet_id: str, generated_tags: List[str], tagging_status: str
+    ) -> None:
+        with time_stage("sqlite_write"):
+            updated = await self._write(
+                self._update_tags, snippet_id, generated_tags, tagging_status
+            )
+        if not updated:
+            logger.warning("Snippet %s was deleted before its tags were stored.", snippet_id)
+            return
+        index_tags_updated(snippet_id, generated_tags, tagging_status)
+
+    async def delete_snippet_by_id(self, snippet_id: str) -> bool:
+        with time_stage("sqlite_write"):
+            deleted = await self._write(self._delete, snippet_id)
+        if deleted:
+            index_deleted(snippet_id)
+        return bool(deleted)
+
+    async def export_snippets(
+        self, after: Optional[str] = None, page_size: int = config.EXPORT_PAGE_SIZE
+    ) -> AsyncIterator[AhHaSnippet]:
+        after = after or ""
+        while True:
+            with time_stage("sqlite_read"):
+                page = await self._read(self._export_page, after, page_size)
+            for snippet in page:
+                yield snippet
+            if len(page) < page_size:
+                return
+            after = page[-1].id
+
+    async def import_snippets(self, snippets: List[AhHaSnippet]) -> List[AhHaSnippet]:
+        if not snippets:
+            return []
+        now = datetime.datetime.now(datetime.timezone.utc)
+        # Made only for snippets that arrive without one, in the same order.
+        previews = iter(await make_previews([snippet for snippet in snippets if not snippet.preview]))
+        imported = [
+            snippet.model_copy(
+                update={
+                    "id": snippet.id or os.urandom(10).hex(),
+                    "timestamp": snippet.timestamp or now,
+                    # A write like any other as far as the change feed is concerned.
+                    "updated_at": now,
+                    "preview": snippet.preview or next(previews),
+                }
+            )
+            for snippet in snippets
+        ]
+        # The last copy of an ID repeated within the batch wins, as it would in order.
+        imported = list({snippet.id: snippet for snippet in imported}.values())
+        with time_stage("sqlite_write"):
+            replaced = await self._write(self._upsert, imported)
+        for snippet_id in replaced:
+            index_deleted(snippet_id)
+        await index_created(imported)
+        return imported
+
+    async def delete_snippets(self, snippet_ids: List[str]) -> int:
+        if not snippet_ids:
+            return 0
+        with time_stage("sqlite_write"):
+            deleted = await self._write(self._delete_many, snippet_ids)
+        for snippet_id in deleted:
+            index_deleted(snippet_id)
+        return len(deleted)
+
+    async def get_changes(self, since: Optional[ChangeCursor], limit: int) -> ChangeBatch:
+        if since is not None and not isinstance(since.key, int):
+            raise ValueError("Change cursor is not from this store.")
+        with time_stage("sqlite_read"):
+            rows = await self._read(self._changes, since.key if since else 0, limit + 1)
+        batch = ChangeBatch(cursor=since or ChangeCursor(0, 0), has_more=len(rows) > limit)
+        for change_seq, changed_at, snippet_id, deleted, data in rows[:limit]:
+            if deleted or data is None:
+                batch.deleted.append(snippet_id)
+            else:
+                batch.changed.append(AhHaSnippet.model_validate_json(data))
+            batch.cursor = ChangeCursor(int(changed_at * 1_000_000), change_seq)
+        return batch
+
+    async def get_tag_counts(self, limit: Optional[int] = None) -> List[TagCount]:
+        with time_stage("sqlite_read"):
+            return await self._read(self._tag_counts, limit)
+
+    async def rebuild_tag_counts(self) -> int:
+        await self._write(self._create_schema)
+        with time_stage("sqlite_write"):
+            return await self._write(self._rebuild_tag_counts)
@@ -0,0 +1,215 @@
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+import config
+from models import AhHaSnippet, TagCount
+from services.changes import ChangeBatch, ChangeCursor
+from services.dedup_index import dedup_index
+from services.embedding_index import embedding_index
+from services.events import EVENT_CREATED, EVENT_DELETED, EVENT_UPDATED, event_bus
+from services.keyword_engine import keyword_engine
+from services.projection import SUMMARY_FIELDS, project
+
+# A projected snippet: only the requested fields, keyed by field name.
+SnippetFields = Dict[str, Any]
+
+
+class SnippetStore:
+    """Interface for snippet persistence.
+
+    Firestore is the default backend; SQLite (WAL + FTS5) serves self-hosted
+    and single-node deployments. The API layer only talks to this interface,
+    so a new backend only needs to implement these methods.
+    """
+
+    name = "abstract"
+
+    async def warm_up(self):
+        """Opens clients and connections so the first request doesn't pay for them."""
+        raise NotImplementedError
+
+    async def start(self):
+        """Builds per-process state (search indexes, keyword statistics)."""
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    async def create_snippet(self, snippet: AhHaSnippet) -> AhHaSnippet:
+        raise NotImplementedError
+
+    async def create_snippets_batch(
+        self, snippets: List[AhHaSnippet]
+    ) -> List[Union[AhHaSnippet, Exception]]:
+        raise NotImplementedError
+
+    async def get_snippet_by_id(self, snippet_id: str) -> Optional[AhHaSnippet]:
+        raise NotImplementedError
+
+    async def get_snippets_by_ids(
+        self, snippet_ids: List[str], fields: Optional[List[str]] = None
+    ) -> List[Union[AhHaSnippet, SnippetFields]]:
+        """The snippets with these IDs, in the given order, skipping any that
+        no longer exist. `fields` projects as in iter_snippets."""
+        raise NotImplementedError
+
+    def iter_snippets(
+        self,
+        search_term: Optional[str] = None,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        tag: Optional[str] = None,
+    ) -> AsyncIterator[Union[AhHaSnippet, SnippetFields]]:
+        """Yields snippets newest first (best match first when searching).
+
+        Raises ValueError if `start_after` does not refer to a snippet in the
+        result set. With `fields`, yields dicts holding only those fields and
+        avoids reading the others where the backend allows it. `tag` keeps
+        only snippets carrying exactly that tag.
+
+        `content` is always the whole content: content stored out of line is
+        read back whenever `content` is among the fields returned (all of
+        them without `fields`), and never read otherwise.
+        """
+        raise NotImplementedError
+
+    async def get_all_snippets(
+        self,
+        search_term: Optional[str] = None,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        tag: Optional[str] = None,
+    ) -> List[Union[AhHaSnippet, SnippetFields]]:
+        raise NotImplementedError
+
+    async def update_snippet_tags(
+        self, snippet_id: str, generated_tags: List[str], tagging_status: str
+    ) -> None:
+        raise NotImplementedError
+
+    async def delete_snippet_by_id(self, snippet_id: str) -> bool:
+        raise NotImplementedError
+
+    def export_snippets(
+        self, after: Optional[str] = None, page_size: int = config.EXPORT_PAGE_SIZE
+    ) -> AsyncIterator[AhHaSnippet]:
+        """Yields every snippet in ID order, reading a page at a time.
+
+        ID order is unaffected by snippets written during the export, so an
+        interrupted export resumes with `after` set to the last ID received.
+        """
+        raise NotImplementedError
+
+    async def import_snippets(self, snippets: List[AhHaSnippet]) -> List[AhHaSnippet]:
+        """Writes snippets as given (IDs, timestamps and tags included), replacing
+        any snippet with the same ID; returns them as written.
+
+        Snippets without an ID get a new one. Writing the same snippets
+        again is harmless, so a failed import can be retried or resumed.
+        """
+        raise NotImplementedError
+
+    async def delete_snippets(self, snippet_ids: List[str]) -> int:
+        """Deletes many snippets with batched writes; returns how many existed."""
+        raise NotImplementedError
+
+    async def get_changes(self, since: Optional[ChangeCursor], limit: int) -> ChangeBatch:
+        """Up to `limit` snippets created, updated or deleted after `since`.
+
+        Changes come in the order they were written; `since=None` starts from
+        the beginning. Each snippet appears at most once, in its latest
+        state, or as a deleted ID if it no longer exists.
+        """
+        raise NotImplementedError
+
+    async def get_tag_counts(self, limit: Optional[int] = None) -> List[TagCount]:
+        """Tags by number of snippets carrying them, most used first.
+
+        Counts are maintained in the same commit as each snippet write, so
+        this never reads the snippets themselves.
+        """
+        raise NotImplementedError
+
+    async def rebuild_tag_counts(self) -> int:
+        """Recomputes the tag counts from all snippets; returns the number of tags."""
+        raise NotImplementedError
+
+
+# Per-process indexes derived from the stored snippets. Every backend calls
+# these hooks so keyword statistics, similarity and duplicate detection stay
+# in step with whatever is persisted, and so GET /events clients connected
+# to this worker hear about the write.
+
+
+async def index_loaded(snippets: List[AhHaSnippet]):
+    keyword_engine.rebuild(snippets)
+    if config.DEDUP_MODE != "off":
+        dedup_index.rebuild(snippets)
+    await embedding_index.rebuild(snippets)
+
+
+async def index_created(snippets: List[AhHaSnippet]):
+    for snippet in snippets:
+        keyword_engine.add_snippet(snippet)
+        if config.DEDUP_MODE != "off":
+            dedup_index.add(snippet)
+    await embedding_index.add_snippets(snippets)
+    for snippet in snippets:
+        event_bus.publish_local(EVENT_CREATED, project(snippet, SUMMARY_FIELDS))
+
+
+async def index_refreshed(changed: List[AhHaSnippet], deleted: List[str]):
+    """Applies writes read back from the change feed, any worker's (this
+    one's included), without publishing events: those went out with the write."""
+    for snippet in changed:
+        keyword_engine.add_snippet(snippet)
+        if config.DEDUP_MODE != "off":
+            dedup_index.add(snippet)
+    for snippet_id in deleted:
+        keyword_engine.remove_document(snippet_id)
+        dedup_index.remove(snippet_id)
+        embedding_index.remove(snippet_id)
+    # Only new snippets are embedded, so this worker's own writes don't cost
+    # another model call. Content changes only when an import replaces a
+    # snippet; other workers keep its old vector until their next rebuild.
+    await embedding_index.add_snippets(
+        [snippet for snippet in changed if snippet.id not in embedding_index]
+    )
+
+
+def index_tags_updated(snippet_id: str, generated_tags: List[str], tagging_status: str):
+    event_bus.publish_local(
+        EVENT_UPDATED,
+        {"id": snippet_id, "generated_tags": generated_tags, "tagging_status": tagging_status},
+    )
+
+
+def index_deleted(snippet_id: str):
+    keyword_engine.remove_document(snippet_id)
+    dedup_index.remove(snippet_id)
+    embedding_index.remove(snippet_id)
+    event_bus.publish_local(EVENT_DELETED, {"id": snippet_id})
+
+
+def _build_store() -> SnippetStore:
+    if config.STORAGE_BACKEND == "sqlite":
+        from services.sqlite_store import SqliteSnippetStore
+
+        return SqliteSnippetStore(config.SQLITE_DB_PATH)
+    if config.STORAGE_BACKEND != "firestore":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {config.STORAGE_BACKEND}")
+    from services.firestore_service import FirestoreSnippetStore
+
+    return FirestoreSnippetStore()
+
+
+_snippet_store: Optional[SnippetStore] = None
+
+
+def get_snippet_store() -> SnippetStore:
+    # Built on first use so only the configured backend's client is imported.
+    global _snippet_store
+    if _snippet_store is None:
+        _snippet_store = _build_store()
+    return _snippet_store
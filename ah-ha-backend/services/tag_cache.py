@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+TAG_CACHE_COLLECTION = "ah_ha_tag_cache"
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Lowercases and collapses whitespace so trivially different captures share a key."""
+    if not text:
+        return ""
+    return _WHITESPACE_RE.sub(" ", text).strip().lower()
+
+
+def cache_key(title: str, text: str, model: str, instruction: str) -> str:
+    """Content address for a tagging request.
+
+    The model and agent instruction are part of the key so that changing
+    either one naturally invalidates previously cached tags.
+    """
+    digest = hashlib.sha256()
+    for part in (model, instruction, normalize_text(title), normalize_text(text)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class SqliteTagStore:
+    """Persistent tier backed by a local SQLite file."""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tag_cache (key TEXT PRIMARY KEY, tags TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _get(self, key: str) -> Optional[Tuple[List[str], float]]:
+        row = self._conn.execute(
+            "SELECT tags, created_at FROM tag_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _set(self, key: str, tags: List[str], created_at: float):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO tag_cache (key, tags, created_at) VALUES (?, ?, ?)",
+            (key, json.dumps(tags), created_at),
+        )
+        self._conn.commit()
+
+    async def get(self, key: str) -> Optional[Tuple[List[str], float]]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, tags: List[str], created_at: float):
+        await asyncio.to_thread(self._set, key, tags, created_at)
+
+
+class FirestoreTagStore:
+    """Persistent tier backed by a Firestore collection shared by all workers."""
+
+    def __init__(self, db, collection: str = TAG_CACHE_COLLECTION):
+        self._collection = db.collection(collection)
+
+    async def get(self, key: str) -> Optional[Tuple[List[str], float]]:
+        doc = await self._collection.document(key).get()
+        if not doc.exists:
+            return None
+        data = doc.to_dict() or {}
+        return data.get("tags", []), data.get("created_at", 0.0)
+
+    async def set(self, key: str, tags: List[str], created_at: float):
+        await self._collection.document(key).set(
+            {"tags": tags, "created_at": created_at}
+        )
+
+
+class TagCache:
+    """Two-tier cache of LLM-generated tags: in-memory LRU plus an optional persistent store."""
+
+    def __init__(
+        self,
+        max_entries: int = config.TAG_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = config.TAG_CACHE_TTL_SECONDS,
+        store=None,
+    ):
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._store = store
+        self._entries: "OrderedDict[str, Tuple[List[str], float]]" = OrderedDict()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def attach_store(self, store):
+        self._store = store
+
+    def _expired(self, created_at: float) -> bool:
+        return self._ttl_seconds > 0 and time.time() - created_at > self._ttl_seconds
+
+    def _remember(self, key: str, tags: List[str], created_at: float):
+        self._entries[key] = (tags, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[List[str]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            tags, created_at = entry
+            if not self._expired(created_at):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(tags)
+            del self._entries[key]
+
+        if self._store is not None:
+            try:
+                stored = await self._store.get(key)
+            except Exception as e:
+                logger.warning("Tag cache persistent lookup failed: %s", e)
+                stored = None
+            if stored is not None and not self._expired(stored[1]):
+                self._remember(key, stored[0], stored[1])
+                self.persistent_hits += 1
+                return list(stored[0])
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, tags: List[str]):
+        # Empty results are not cached so a transient bad reply isn't pinned.
+        if not tags:
+            return
+        created_at = time.time()
+        self._remember(key, list(tags), created_at)
+        if self._store is not None:
+            try:
+                await self._store.set(key, list(tags), created_at)
+            except Exception as e:
+                logger.warning("Tag cache persistent write failed: %s", e)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.persistent_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+        }
+
+
+def _build_store():
+    try:
+        if config.TAG_CACHE_BACKEND == "sqlite":
+            return SqliteTagStore(config.TAG_CACHE_SQLITE_PATH)
+        if config.TAG_CACHE_BACKEND == "firestore":
+            from services.firestore_service import get_db
+
+            db = get_db()
+            if db:
+                return FirestoreTagStore(db)
+            logger.warning("Firestore tag cache requested but client not initialized.")
+    except Exception as e:
+        logger.exception("Failed to initialize persistent tag cache, using memory only: %s", e)
+    return None
+
+
+# The persistent tier is attached from the app lifespan (start_tag_cache) so
+# importing this module never opens a database or constructs a cloud client.
+tag_cache = TagCache()
+
+
+def start_tag_cache():
+    if tag_cache._store is None:
+        tag_cache.attach_store(_build_store())
+
+
+def get_tag_cache() -> TagCache:
+    return tag_cache
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+import config
+from models import AhHaSnippet
+
+logger = logging.getLogger(__name__)
+
+TAGGING_PENDING = "pending"
+TAGGING_DONE = "done"
+TAGGING_FAILED = "failed"
+TAGGING_SKIPPED = "skipped"
+# Tagged by the local keyword extractor because the model was unavailable.
+TAGGING_FALLBACK = "fallback"
+
+
+@dataclass
+class TaggingJob:
+    snippet: AhHaSnippet
+    attempt: int = 0
+
+
+TaggingHandler = Callable[[TaggingJob], Awaitable[None]]
+FailureHandler = Callable[[TaggingJob, Exception], Awaitable[None]]
+
+
+class TaggingQueue:
+    """Interface for the background tagging queue.
+
+    The in-process asyncio queue below is the default backend. A durable
+    backend (Cloud Tasks, Pub/Sub, ...) only needs to implement these methods.
+    """
+
+    async def start(self):
+        raise NotImplementedError
+
+    async def enqueue(self, job: TaggingJob):
+        raise NotImplementedError
+
+    async def drain(self, timeout: Optional[float] = None):
+        raise NotImplementedError
+
+    def qsize(self) -> int:
+        raise NotImplementedError
+
+
+class AsyncioTaggingQueue(TaggingQueue):
+    """Bounded in-process queue served by a fixed pool of asyncio workers."""
+
+    def __init__(
+        self,
+        handler: TaggingHandler,
+        on_failure: Optional[FailureHandler] = None,
+        concurrency: int = config.TAGGING_CONCURRENCY,
+        max_attempts: int = config.TAGGING_MAX_ATTEMPTS,
+        backoff_base_seconds: float = config.TAGGING_BACKOFF_BASE_SECONDS,
+        max_queue_size: int = config.TAGGING_MAX_QUEUE_SIZE,
+    ):
+        self._handler = handler
+        self._on_failure = on_failure
+        self._concurrency = concurrency
+        self._max_attempts = max_attempts
+        self._backoff_base_seconds = backoff_base_seconds
+        self._max_queue_size = max_queue_size
+        # Created in start() so the queue binds to the server's running event loop.
+        self._queue: Optional["asyncio.Queue[TaggingJob]"] = None
+        self._workers: List[asyncio.Task] = []
+        self._retry_tasks: set = set()
+
+    def qsize(self) -> int:
+        queued = self._queue.qsize() if self._queue else 0
+        return queued + len(self._retry_tasks)
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self._max_queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self._concurrency)
+        ]
+        logger.info("Tagging queue started with %d workers.", self._concurrency)
+
+    async def enqueue(self, job: TaggingJob):
+        if self._queue is None:
+            raise RuntimeError("Tagging queue has not been started.")
+        # Blocks the caller when the queue is full, which is our backpressure.
+        await self._queue.put(job)
+
+    async def _retry_later(self, job: TaggingJob, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            await self._queue.put(job)
+        finally:
+            self._retry_tasks.discard(asyncio.current_task())
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                job.attempt += 1
+                await self._handler(job)
+            except Exception as e:
+                if job.attempt < self._max_attempts:
+                    delay = self._backoff_base_seconds * (2 ** (job.attempt - 1))
+                    delay += random.uniform(0, delay / 2)  # Jitter
+                    logger.warning(
+                        "Tagging job for snippet %s failed (attempt %d/%d): %s. Retrying in %.1fs.",
+                        job.snippet.id, job.attempt, self._max_attempts, e, delay,
+                    )
+                    task = asyncio.create_task(self._retry_later(job, delay))
+                    self._retry_tasks.add(task)
+                else:
+                    logger.error(
+                        "Tagging job for snippet %s failed after %d attempts: %s",
+                        job.snippet.id, job.attempt, e,
+                    )
+                    if self._on_failure:
+                        try:
+                            await self._on_failure(job, e)
+                        except Exception as failure_error:
+                            logger.exception(
+                                "Error recording tagging failure for snippet %s: %s",
+                                job.snippet.id, failure_error,
+                            )
+            finally:
+                self._queue.task_done()
+
+    async def drain(self, timeout: Optional[float] = config.TAGGING_DRAIN_TIMEOUT_SECONDS):
+        """Waits for queued and retrying jobs to finish, then stops the workers."""
+        if not self._workers:
+            return
+
+        async def wait_until_empty():
+            while True:
+                await self._queue.join()
+                if not self._retry_tasks:
+                    return
+                await asyncio.gather(*list(self._retry_tasks), return_exceptions=True)
+
+        try:
+            await asyncio.wait_for(wait_until_empty(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Tagging queue drain timed out with %d jobs outstanding.", self.qsize()
+            )
+        for task in list(self._retry_tasks):
+            task.cancel()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Tagging queue drained and stopped.")
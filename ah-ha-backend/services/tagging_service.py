@@ -0,0 +1,376 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import List, Optional
+
+import config
+from models import AhHaSnippet
+from services.adk_service import (
+    get_adk_runner,
+    get_batch_adk_runner,
+    get_tagging_agent,
+    init_adk,
+)
+from services.adk_session_manager import session_manager
+from services.genai_tagging import get_genai_tagger, init_genai_tagger
+from services.keyword_engine import keyword_engine, snippet_text
+from services.llm_gateway import LlmUnavailable, get_llm_gateway
+from services.metrics import observe_stage, time_stage
+from services.storage import get_snippet_store
+from services.tag_cache import cache_key, tag_cache
+from services.tagging_queue import (
+    TAGGING_DONE,
+    TAGGING_FAILED,
+    TAGGING_FALLBACK,
+    TaggingJob,
+)
+from services.text_extraction import extract_text
+
+logger = logging.getLogger(__name__)
+
+
+class UnparseableTags(ValueError):
+    """The model answered, but not with a usable list of tags."""
+
+
+def _use_genai() -> bool:
+    return config.TAGGING_ENGINE == "genai"
+
+
+def init_tagging_engine():
+    """Builds the configured tagging engine (slow imports; run it off the event loop)."""
+    if _use_genai():
+        init_genai_tagger()
+    else:
+        init_adk()
+
+
+def tagging_available() -> bool:
+    if _use_genai():
+        return get_genai_tagger() is not None
+    return bool(get_adk_runner() and get_tagging_agent())
+
+
+def batch_tagging_available() -> bool:
+    if _use_genai():
+        return get_genai_tagger() is not None
+    return bool(get_batch_adk_runner())
+
+
+async def text_for_llm(snippet: AhHaSnippet) -> str:
+    """Returns the snippet content as plain text, stripping HTML if needed.
+
+    HTML is parsed in the extraction pool, never on the event loop, and only
+    up to the character budget the tagging prompt can use.
+    """
+    content_for_llm = snippet.content
+    if snippet.content_type == "html" and snippet.content:
+        content_for_llm = await extract_text(snippet.content)
+        logger.debug(
+            "HTML content stripped for LLM. Original length: %d, Stripped length: %d",
+            len(snippet.content),
+            len(content_for_llm),
+        )
+    return content_for_llm
+
+
+def tag_cache_key(snippet: AhHaSnippet, content_for_llm: str) -> str:
+    """Content-addressed cache key for the tags the agent would generate for a snippet."""
+    engine = get_genai_tagger() if _use_genai() else get_tagging_agent()
+    instruction = engine.instruction if engine else ""
+    return cache_key(
+        snippet.title, content_for_llm, config.GOOGLE_GENAI_MODEL, str(instruction)
+    )
+
+
+async def cached_tags(snippet: AhHaSnippet) -> Optional[List[str]]:
+    """Returns previously generated tags for identical content, if any."""
+    if not snippet.content:
+        return None
+    return await tag_cache.get(tag_cache_key(snippet, await text_for_llm(snippet)))
+
+
+def parse_tags(final_tags_text: Optional[str]) -> List[str]:
+    """Parses the LlmAgent's comma-separated reply into lowercase tags."""
+    if not final_tags_text:
+        return []
+    return [tag.strip().lower() for tag in final_tags_text.split(",") if tag.strip()]
+
+
+def _dump_event(event, event_count: int, session_id: str):
+    logger.debug(
+        "[%s EVENT %d] ID: %s, Author: %s, Invocation ID: %s",
+        session_id,
+        event_count,
+        event.id,
+        event.author,
+        event.invocation_id,
+    )
+    if event.content and event.content.parts:
+        for i, part in enumerate(event.content.parts):
+            if part.text:
+                logger.debug(
+                    "  Part %d text: '%s...' (Partial: %s)", i, part.text[:200], event.partial
+                )
+    if event.actions:  # Should be minimal for direct LlmAgent
+        logger.debug(
+            "  Actions: state_delta=%s, artifact_delta=%s, transfer=%s, escalate=%s",
+            event.actions.state_delta,
+            event.actions.artifact_delta,
+            event.actions.transfer_to_agent,
+            event.actions.escalate,
+        )
+
+
+async def _run_agent(runner, user_prompt: str, temp_adk_id_part: str) -> Optional[str]:
+    """Sends one prompt through an ADK runner and returns the agent's final text.
+
+    The call goes through the LLM gateway, so it may raise LlmUnavailable
+    instead of reaching the model.
+    """
+    return await get_llm_gateway().call(
+        lambda: _run_agent_call(runner, user_prompt, temp_adk_id_part)
+    )
+
+
+async def _run_agent_call(runner, user_prompt: str, temp_adk_id_part: str) -> Optional[str]:
+    from google.genai import types as genai_types
+
+    input_message = genai_types.Content(
+        role="user", parts=[genai_types.Part(text=user_prompt)]
+    )
+    # Full event dumps are expensive under load: DEBUG only, and only for a sample of calls.
+    verbose = (
+        logger.isEnabledFor(logging.DEBUG)
+        and random.random() < config.ADK_EVENT_LOG_SAMPLE_RATE
+    )
+
+    final_text = None
+    fallback_text = None
+    event_count = 0
+    # The session only lives for this call and is deleted once the final response is read.
+    async with session_manager.session(runner, temp_adk_id_part) as (
+        user_id,
+        session_id_for_adk,
+    ):
+        if verbose:
+            logger.debug("ADK Prompt for %s (to LlmAgent): %s", session_id_for_adk, user_prompt)
+
+        started = time.perf_counter()
+        async for event in runner.run_async(
+            user_id=user_id,
+            session_id=session_id_for_adk,
+            new_message=input_message,
+        ):
+            event_count += 1
+            if event_count == 1:
+                observe_stage("llm_first_event", time.perf_counter() - started)
+            if verbose:
+                _dump_event(event, event_count, session_id_for_adk)
+            if event.is_final_response() and event.content and event.content.parts:
+                texts = [p.text for p in event.content.parts if p.text]
+                if texts and not event.partial:
+                    # If it's the final text from the LlmAgent, capture it
+                    final_text = texts[-1].strip()
+                elif texts:
+                    fallback_text = "".join(texts).strip()
+        observe_stage("llm_last_event", time.perf_counter() - started)
+
+    if final_text is None and fallback_text:
+        logger.info(
+            "Final event from %s had text, but not a complete final response: '%s'",
+            session_id_for_adk,
+            fallback_text[:200],
+        )
+    logger.debug(
+        "ADK call %s finished after %d events. Final text: '%s'",
+        session_id_for_adk,
+        event_count,
+        final_text,
+    )
+    return final_text
+
+
+async def generate_tags(snippet: AhHaSnippet) -> List[str]:
+    """Runs the tagging LlmAgent over a snippet's title and content.
+
+    Returns an empty list when the agent replies with nothing parseable.
+    Errors from the ADK runner propagate so callers can decide whether to retry;
+    LlmUnavailable means the gateway refused the call and retrying won't help.
+    A GenAI structured reply without tags raises UnparseableTags, so the
+    queue retries it and finally records the failure with keyword tags.
+    """
+    if not tagging_available() or not snippet.content:
+        return []
+
+    content_for_llm = await text_for_llm(snippet)
+    key = tag_cache_key(snippet, content_for_llm)
+    cached = await tag_cache.get(key)
+    if cached is not None:
+        logger.info("Tag cache hit for '%s', skipping LlmAgent call.", snippet.title)
+        return cached
+
+    user_prompt = f'Title: "{snippet.title}"\nContent: "{content_for_llm}"'
+    if _use_genai():
+        tagger = get_genai_tagger()
+        started = time.perf_counter()
+        parsed_tags_list = await get_llm_gateway().call(lambda: tagger.generate(user_prompt))
+        observe_stage("llm_last_event", time.perf_counter() - started)
+        if not parsed_tags_list:
+            raise UnparseableTags(f"GenAI tagging reply for '{snippet.title}' had no tags.")
+        logger.info("Tags from GenAI structured output: %s", parsed_tags_list)
+        await tag_cache.set(key, parsed_tags_list)
+        return parsed_tags_list
+
+    # Use a temporary ID for ADK session if snippet ID is not yet available.
+    temp_adk_id_part = snippet.id if snippet.id else os.urandom(4).hex()
+    final_tags_text = await _run_agent(get_adk_runner(), user_prompt, temp_adk_id_part)
+
+    with time_stage("tag_parse"):
+        parsed_tags_list = parse_tags(final_tags_text)
+    if parsed_tags_list:
+        logger.info("Tags parsed from LlmAgent direct output: %s", parsed_tags_list)
+    else:
+        logger.warning(
+            "ADK LlmAgent response did not yield parseable tags: '%s'", final_tags_text
+        )
+    await tag_cache.set(key, parsed_tags_list)
+    return parsed_tags_list
+
+
+def parse_batch_tags(final_text: Optional[str], count: int) -> List[Optional[List[str]]]:
+    """Parses the batch agent's JSON reply into one tag list per snippet.
+
+    Items the model left out (or the whole reply, if it isn't valid JSON)
+    come back as None so the caller can fall back for just those items.
+    """
+    results: List[Optional[List[str]]] = [None] * count
+    if not final_text:
+        return results
+    start, end = final_text.find("{"), final_text.rfind("}")
+    if start == -1 or end <= start:
+        return results
+    try:
+        parsed = json.loads(final_text[start : end + 1])
+    except ValueError:
+        logger.warning("Could not parse batch tagging reply as JSON: '%s'", final_text[:200])
+        return results
+    if not isinstance(parsed, dict):
+        return results
+    for raw_index, raw_tags in parsed.items():
+        try:
+            index = int(raw_index)
+        except (TypeError, ValueError):
+            continue
+        if not 0 <= index < count:
+            continue
+        if isinstance(raw_tags, str):
+            tags = parse_tags(raw_tags)
+        elif isinstance(raw_tags, list):
+            tags = [str(tag).strip().lower() for tag in raw_tags if str(tag).strip()]
+        else:
+            continue
+        results[index] = tags or None
+    return results
+
+
+async def _generate_tags_for_group(
+    snippets: List[AhHaSnippet], texts: List[str]
+) -> List[Optional[List[str]]]:
+    prompt_parts = []
+    for index, (snippet, text) in enumerate(zip(snippets, texts)):
+        text = text[: config.BATCH_TAGGING_MAX_CHARS_PER_ITEM]
+        prompt_parts.append(f'Snippet {index}:\nTitle: "{snippet.title}"\nContent: "{text}"')
+    if _use_genai():
+        tagger = get_genai_tagger()
+        return await get_llm_gateway().call(
+            lambda: tagger.generate_batch("\n\n".join(prompt_parts), len(snippets))
+        )
+    final_text = await _run_agent(
+        get_batch_adk_runner(), "\n\n".join(prompt_parts), f"batch_{os.urandom(4).hex()}"
+    )
+    with time_stage("tag_parse"):
+        return parse_batch_tags(final_text, len(snippets))
+
+
+async def generate_tags_batch(snippets: List[AhHaSnippet]) -> List[Optional[List[str]]]:
+    """Tags many snippets using a few grouped LLM requests.
+
+    Returns one entry per input snippet: its tags, or None when the item
+    could not be tagged (no agent, group request failed, or the model
+    omitted it). Cached results are reused and never sent to the model.
+    """
+    results: List[Optional[List[str]]] = [None] * len(snippets)
+    if not tagging_available():
+        return results
+
+    pending = []  # (index, snippet, text, cache key)
+    for index, snippet in enumerate(snippets):
+        if not snippet.content:
+            results[index] = []
+            continue
+        text = await text_for_llm(snippet)
+        key = tag_cache_key(snippet, text)
+        cached = await tag_cache.get(key)
+        if cached is not None:
+            results[index] = cached
+        else:
+            pending.append((index, snippet, text, key))
+
+    if not pending or not batch_tagging_available():
+        return results
+
+    group_size = config.BATCH_TAGGING_GROUP_SIZE
+    groups = [pending[i : i + group_size] for i in range(0, len(pending), group_size)]
+    semaphore = asyncio.Semaphore(config.BATCH_TAGGING_CONCURRENCY)
+
+    async def run_group(group):
+        async with semaphore:
+            try:
+                group_tags = await _generate_tags_for_group(
+                    [item[1] for item in group], [item[2] for item in group]
+                )
+            except Exception as e:
+                logger.error("Error generating tags for a batch group of %d: %s", len(group), e)
+                return
+        for (index, _, _, key), tags in zip(group, group_tags):
+            results[index] = tags
+            if tags:
+                await tag_cache.set(key, tags)
+
+    await asyncio.gather(*(run_group(group) for group in groups))
+    return results
+
+
+def fallback_tags(snippet: AhHaSnippet) -> List[str]:
+    """Keyword-extractor tags (as /suggest-tags/ gives) for when the model can't be used."""
+    get_llm_gateway().record_fallback()
+    return keyword_engine.suggest(snippet_text(snippet))
+
+
+async def run_tagging_job(job: TaggingJob):
+    """Queue handler: tags a stored snippet and patches the tags onto its document."""
+    try:
+        tags = await generate_tags(job.snippet)
+        status = TAGGING_DONE
+    except LlmUnavailable as e:
+        # Not retried: the queue would only pile more calls onto an unhealthy model.
+        tags = fallback_tags(job.snippet)
+        status = TAGGING_FALLBACK
+        logger.warning(
+            "Model unavailable for snippet %s (%s), using keyword tags: %s",
+            job.snippet.id,
+            e.reason,
+            tags,
+        )
+    await get_snippet_store().update_snippet_tags(job.snippet.id, tags, status)
+    logger.info("Background tagging finished for snippet %s: %s", job.snippet.id, tags)
+
+
+async def record_tagging_failure(job: TaggingJob, error: Exception):
+    await get_snippet_store().update_snippet_tags(
+        job.snippet.id, fallback_tags(job.snippet), TAGGING_FAILED
+    )
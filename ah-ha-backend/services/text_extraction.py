@@ -0,0 +1,134 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from html.parser import HTMLParser
+from typing import List, Optional
+
+import config
+from services.metrics import time_stage
+
+# Same elements BeautifulSoup's get_text() leaves out by default.
+_SKIPPED_TAGS = {"script", "style", "template"}
+_FEED_CHUNK_CHARS = 64 * 1024
+
+
+class _StreamingTextExtractor(HTMLParser):
+    """Collects visible text without building a tree, stopping at a character budget."""
+
+    def __init__(self, max_chars: Optional[int]):
+        super().__init__(convert_charrefs=True)
+        self._max_chars = max_chars
+        self._parts: List[str] = []
+        self._pending: List[str] = []
+        self._length = 0
+        self._skip_depth = 0
+        self.done = False
+
+    def _flush(self):
+        # A text node can arrive in several handle_data calls (e.g. across feed
+        # chunks); like BeautifulSoup, treat everything between two pieces of
+        # markup as one string before stripping it.
+        if not self._pending:
+            return
+        text = "".join(self._pending).strip()
+        self._pending = []
+        if not text or self.done:
+            return
+        self._parts.append(text)
+        self._length += len(text) + 1
+        if self._max_chars is not None and self._length >= self._max_chars:
+            self.done = True
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush()
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag in _SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+        # BeautifulSoup keeps a CDATA section's text, as a string of its own.
+        if data.startswith("CDATA["):
+            self.handle_data(data[len("CDATA[") :])
+            self._flush()
+
+    def handle_data(self, data):
+        if not self.done and not self._skip_depth:
+            self._pending.append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+    def text(self) -> str:
+        joined = " ".join(self._parts)
+        if self._max_chars is not None:
+            joined = joined[: self._max_chars]
+        return joined
+
+
+def html_to_text(html: str, max_chars: Optional[int] = None) -> str:
+    """Extracts text like BeautifulSoup's get_text(separator=" ", strip=True).
+
+    Input is fed to the parser in chunks and parsing stops once `max_chars`
+    of text have been collected, so huge pages cost only what the prompt
+    needs. Input beyond TEXT_EXTRACTION_MAX_INPUT_CHARS is ignored.
+    """
+    html = html[: config.TEXT_EXTRACTION_MAX_INPUT_CHARS]
+    extractor = _StreamingTextExtractor(max_chars)
+    for start in range(0, len(html), _FEED_CHUNK_CHARS):
+        extractor.feed(html[start : start + _FEED_CHUNK_CHARS])
+        if extractor.done:
+            break
+    else:
+        extractor.close()
+    return extractor.text()
+
+
+_executor: Optional[Executor] = None
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if config.TEXT_EXTRACTION_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=config.TEXT_EXTRACTION_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=config.TEXT_EXTRACTION_WORKERS,
+                thread_name_prefix="text-extraction",
+            )
+    return _executor
+
+
+async def extract_text(
+    html: str, max_chars: Optional[int] = config.TEXT_EXTRACTION_MAX_OUTPUT_CHARS
+) -> str:
+    """Runs html_to_text in the extraction pool so the event loop is never blocked."""
+    loop = asyncio.get_running_loop()
+    with time_stage("html_strip"):
+        return await loop.run_in_executor(
+            _get_executor(), html_to_text, html, max_chars
+        )
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
@@ -0,0 +1,50 @@
+import asyncio
+import gzip
+import zlib
+
+import pytest
+
+from services.bulk import LineTooLong, ndjson_lines
+
+
+async def chunked(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+def read_lines(data: bytes, size: int = 7, max_line_bytes: int = 1000):
+    async def run():
+        return [line async for line in ndjson_lines(chunked(data, size), max_line_bytes)]
+
+    return asyncio.run(run())
+
+
+def test_plain_and_gzipped_bodies_give_the_same_lines():
+    body = b'{"n": 1}\n\n{"n": 2}\n{"n": 3}'
+    expected = [b'{"n": 1}', b'{"n": 2}', b'{"n": 3}']
+    assert read_lines(body) == expected
+    assert read_lines(gzip.compress(body)) == expected
+
+
+@pytest.mark.parametrize("size", [1, 5, 64, 4096])
+def test_every_member_of_a_multi_member_gzip_body_is_read(size):
+    members = [gzip.compress(b"".join(b'{"n": %d}\n' % n for n in range(start, start + 50)))
+               for start in (0, 50, 100)]
+    lines = read_lines(b"".join(members), size)
+    assert lines == [b'{"n": %d}' % n for n in range(150)]
+
+
+def test_a_line_split_across_members_is_joined():
+    body = gzip.compress(b'{"n": 1}\n{"n"') + gzip.compress(b': 2}\n')
+    assert read_lines(body) == [b'{"n": 1}', b'{"n": 2}']
+
+
+def test_corrupt_gzip_raises():
+    body = gzip.compress(b'{"n": 1}\n') + b"\x1f\x8bnot gzip"
+    with pytest.raises(zlib.error):
+        read_lines(body)
+
+
+def test_runaway_lines_raise():
+    with pytest.raises(LineTooLong):
+        read_lines(b"x" * 50, max_line_bytes=10)
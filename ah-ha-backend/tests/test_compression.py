@@ -0,0 +1,53 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from main import _etag_response
+from services.compression import CompressionMiddleware
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=500)
+
+
+@app.get("/big")
+def big(request: Request):
+    return _etag_response(request, {"text": "ah-ha " * 1000})
+
+
+@app.get("/small")
+def small(request: Request):
+    return _etag_response(request, {"text": "ah-ha"})
+
+
+client = TestClient(app)
+GZIP = {"Accept-Encoding": "gzip"}
+
+
+def test_304_keeps_the_etag_of_the_compressed_200():
+    first = client.get("/big", headers=GZIP)
+    assert first.headers["content-encoding"] == "gzip"
+    etag = first.headers["etag"]
+    assert etag.endswith('-gzip"')
+
+    again = client.get("/big", headers={**GZIP, "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["etag"] == etag
+    assert "Accept-Encoding" in again.headers["vary"]
+
+
+def test_304_keeps_the_etag_of_an_uncompressed_200():
+    first = client.get("/small", headers=GZIP)
+    assert "content-encoding" not in first.headers
+    etag = first.headers["etag"]
+
+    again = client.get("/small", headers={**GZIP, "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["etag"] == etag
+
+
+def test_either_form_of_the_etag_validates():
+    plain = client.get("/big", headers={"Accept-Encoding": "identity"}).headers["etag"]
+    suffixed = client.get("/big", headers=GZIP).headers["etag"]
+    assert suffixed == f'{plain[:-1]}-gzip"'
+    for etag in (plain, suffixed, f"W/{suffixed}"):
+        response = client.get("/big", headers={**GZIP, "If-None-Match": etag})
+        assert response.status_code == 304
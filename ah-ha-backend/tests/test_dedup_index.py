@@ -0,0 +1,16 @@
+from models import AhHaSnippet
+from services.dedup_index import MinHashIndex
+
+TEXT = "the quick brown fox jumps over the lazy dog near the quiet river bank today"
+
+
+def test_state_round_trips():
+    index = MinHashIndex(threshold=0.5, min_words=5)
+    index.add(AhHaSnippet(id="a", title="a", content=TEXT))
+    index.add(AhHaSnippet(id="b", title="b", content="something else entirely, with more words here"))
+    index.remove("b")
+
+    loaded = MinHashIndex(threshold=0.5, min_words=5)
+    loaded.load_state(index.state())
+    assert len(loaded) == 1
+    assert loaded.find(AhHaSnippet(title="c", content=TEXT + " again"))[0] == "a"
@@ -0,0 +1,42 @@
+import asyncio
+
+from models import AhHaSnippet
+from services.embedding_index import EmbeddingIndex, HashingEmbedder, LazyEmbedder
+
+
+def test_lazy_embedder_is_built_on_first_use():
+    built = []
+
+    def build():
+        built.append(True)
+        return HashingEmbedder(256)
+
+    index = EmbeddingIndex(LazyEmbedder(build, 256))
+    assert built == []
+
+    snippets = [
+        AhHaSnippet(id="a", title="rust borrow checker", content="lifetimes"),
+        AhHaSnippet(id="b", title="python asyncio", content="event loop"),
+    ]
+    asyncio.run(index.rebuild(snippets))
+    assert built == [True]
+    assert [snippet_id for snippet_id, _ in asyncio.run(index.search("asyncio loop", 1))] == ["b"]
+    assert built == [True]
+
+
+def test_a_second_process_does_not_share_the_vector_file(tmp_path):
+    path = str(tmp_path / "vectors.f32")
+    snippets = [AhHaSnippet(id="a", title="rust borrow checker", content="lifetimes")]
+    owner = EmbeddingIndex(HashingEmbedder(256), path=path)
+    asyncio.run(owner.rebuild(snippets))
+
+    # flock locks are per open file, so a second index stands in for another worker.
+    other = EmbeddingIndex(HashingEmbedder(256), path=path)
+    asyncio.run(other.rebuild(snippets + [AhHaSnippet(id="b", title="python", content="asyncio")]))
+    assert other.stats()["vectors"] == 2
+
+    with open(f"{path}.json") as f:
+        assert '"b"' not in f.read()
+    # The owner reopens its file as before.
+    asyncio.run(owner.rebuild(snippets))
+    assert owner.stats()["vectors"] == 1
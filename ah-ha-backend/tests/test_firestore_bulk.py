@@ -0,0 +1,296 @@
+import asyncio
+import datetime
+import os
+
+import pytest
+
+import config
+from benchmarks.fakes import FakeFirestoreClient
+from models import AhHaSnippet
+from services import content_store
+from services import firestore_service
+from services.embedding_index import embedding_index
+from services.index_snapshot import IndexSnapshot, SnapshotSearchIndex
+from services.keyword_engine import keyword_engine
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    client = FakeFirestoreClient()
+    monkeypatch.setattr(firestore_service, "db", client)
+    monkeypatch.setattr(firestore_service, "_index_cursor", None)
+    monkeypatch.setattr(content_store, "_stores", {})
+    monkeypatch.setattr(config, "CONTENT_STORE", "firestore")
+    monkeypatch.setattr(config, "CONTENT_STORE_PATH", str(tmp_path))
+    firestore_service.snippet_cache.invalidate()
+    return client
+
+
+def seed(db, contents):
+    db.seed(
+        firestore_service.SNIPPETS_COLLECTION,
+        {
+            snippet_id: {"id": snippet_id, "title": snippet_id, "content": content}
+            for snippet_id, content in contents.items()
+        },
+    )
+
+
+def export_ids(after=None, page_size=3):
+    async def run():
+        return [
+            snippet.id
+            async for snippet in firestore_service.export_snippets(after, page_size=page_size)
+        ]
+
+    return asyncio.run(run())
+
+
+def test_export_pages_through_the_collection_in_id_order(db):
+    ids = [f"s{n:02d}" for n in range(8)]
+    seed(db, {snippet_id: "text" for snippet_id in reversed(ids)})
+
+    assert export_ids(page_size=3) == ids
+    # A full last page needs one more, empty, query to finish.
+    assert export_ids(page_size=4) == ids
+    assert export_ids(after="s02", page_size=3) == ids[3:]
+    assert export_ids(after="s07", page_size=3) == []
+
+
+def test_offload_moves_large_content_page_by_page(db, monkeypatch):
+    monkeypatch.setattr(config, "EXPORT_PAGE_SIZE", 2)
+    monkeypatch.setattr(config, "CONTENT_OFFLOAD_BYTES", 100)
+    large = {f"big{n}": f"word{n} " * 100 for n in range(3)}
+    seed(db, {**large, "small0": "short", "small1": "short"})
+
+    assert asyncio.run(firestore_service.offload_large_content()) == 3
+
+    docs = db._collections[firestore_service.SNIPPETS_COLLECTION]
+    for snippet_id, content in large.items():
+        assert docs[snippet_id]["content"] == ""
+        assert docs[snippet_id]["content_blob"]["size"] == len(content)
+        snippet = asyncio.run(firestore_service.get_snippet_by_id(snippet_id))
+        assert snippet.content == content
+    assert docs["small0"]["content"] == "short"
+    assert "content_blob" not in docs["small0"]
+    # Already offloaded content is left where it is.
+    assert asyncio.run(firestore_service.offload_large_content()) == 0
+
+
+def test_reimported_snippet_is_no_longer_reported_deleted(db):
+    store = firestore_service.FirestoreSnippetStore()
+    seed(db, {"kept": "text", "gone": "text"})
+
+    async def run():
+        exported = [snippet async for snippet in store.export_snippets()]
+        await store.delete_snippets(["gone"])
+        await store.import_snippets([s for s in exported if s.id == "gone"])
+        return await store.get_changes(None, 10)
+
+    changes = asyncio.run(run())
+    assert sorted(snippet.id for snippet in changes.changed) == ["gone", "kept"]
+    assert changes.deleted == []
+    assert "gone" not in db._collections[firestore_service.TOMBSTONES_COLLECTION]
+
+
+def test_changes_report_a_leftover_tombstone_only_if_it_is_newer(db):
+    seed(db, {"back": "text"})
+    docs = db._collections[firestore_service.SNIPPETS_COLLECTION]
+    written = datetime.datetime(2024, 1, 2, tzinfo=datetime.timezone.utc)
+    docs["back"]["updated_at"] = written
+    db.seed(
+        firestore_service.TOMBSTONES_COLLECTION,
+        {"back": {"id": "back", "updated_at": written - datetime.timedelta(days=1)}},
+    )
+
+    changes = asyncio.run(firestore_service.get_changes(None, 10))
+    assert [snippet.id for snippet in changes.changed] == ["back"]
+    assert changes.deleted == []
+    assert changes.cursor.key == "back"
+
+
+def test_refresh_picks_up_other_workers_writes(db):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    seed(db, {"mine": "walrus", "theirs-deleted": "narwhal"})
+    asyncio.run(firestore_service.rebuild_search_index())
+    search = firestore_service.search_index.search
+    assert search("narwhal") == {"theirs-deleted"}
+
+    # Written by another worker: a new snippet, and a delete with its tombstone.
+    seed(db, {"theirs-new": "walrus"})
+    db._collections[firestore_service.SNIPPETS_COLLECTION]["theirs-new"]["updated_at"] = now
+    del db._collections[firestore_service.SNIPPETS_COLLECTION]["theirs-deleted"]
+    db.seed(
+        firestore_service.TOMBSTONES_COLLECTION,
+        {"theirs-deleted": {"id": "theirs-deleted", "updated_at": now}},
+    )
+    assert search("walrus") == {"mine"}
+
+    assert asyncio.run(firestore_service.refresh_search_index()) >= 2
+    assert search("walrus") == {"mine", "theirs-new"}
+    assert search("narwhal") == set()
+    # Nothing new: the cursor moved past what was applied.
+    assert asyncio.run(firestore_service.refresh_search_index()) == 0
+
+
+def test_failed_import_commit_deletes_the_content_it_stored(db, monkeypatch):
+    monkeypatch.setattr(config, "CONTENT_OFFLOAD_BYTES", 100)
+    store = firestore_service.FirestoreSnippetStore()
+    seed(db, {"kept": "kept " * 100})
+    asyncio.run(firestore_service.offload_large_content())
+    chunks = db._collections[content_store.CONTENT_CHUNKS_COLLECTION]
+    kept_chunks = set(chunks)
+
+    async def failing_commit(self):
+        raise RuntimeError("commit failed")
+
+    monkeypatch.setattr(type(db.batch()), "commit", failing_commit)
+    snippets = [
+        AhHaSnippet(id="kept", title="kept", content="kept " * 100),
+        AhHaSnippet(id="new", title="new", content="new " * 100),
+    ]
+    with pytest.raises(RuntimeError):
+        asyncio.run(store.import_snippets(snippets))
+
+    # The new snippet's blob is gone; the one "kept" still refers to stays.
+    assert set(chunks) == kept_chunks
+    assert asyncio.run(firestore_service.get_snippet_by_id("kept")).content == "kept " * 100
+
+
+def test_listings_read_offloaded_content_only_when_it_is_returned(db, monkeypatch):
+    monkeypatch.setattr(config, "CONTENT_OFFLOAD_BYTES", 100)
+    store = firestore_service.FirestoreSnippetStore()
+    seed(db, {"big": "big " * 100, "small": "short"})
+    asyncio.run(firestore_service.offload_large_content())
+    loaded = []
+    load_contents = firestore_service.load_contents
+
+    async def recording_load_contents(snippets):
+        loaded.extend(snippet.id for snippet in snippets if content_store.offloaded(snippet))
+        return await load_contents(snippets)
+
+    monkeypatch.setattr(firestore_service, "load_contents", recording_load_contents)
+
+    async def run():
+        by_ids = await store.get_snippets_by_ids(["small", "gone", "big"])
+        summary = await store.get_snippets_by_ids(["big"], fields=["id", "title"])
+        listed = await store.get_all_snippets(fields=["id", "content"])
+        streamed = [item async for item in store.iter_snippets()]
+        return by_ids, summary, listed, streamed
+
+    by_ids, summary, listed, streamed = asyncio.run(run())
+    assert [snippet.id for snippet in by_ids] == ["small", "big"]
+    assert by_ids[1].content == "big " * 100
+    assert summary == [{"id": "big", "title": "big"}]
+    assert {item["id"]: item["content"] for item in listed}["big"] == "big " * 100
+    assert {snippet.id: snippet.content for snippet in streamed}["big"] == "big " * 100
+    # Three reads of "big", none of them for the summary.
+    assert loaded == ["big"] * 3
+
+
+def test_refresh_drops_cached_copies_of_other_workers_writes(db):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    seed(db, {"edited": "old", "deleted": "text"})
+    asyncio.run(firestore_service.rebuild_search_index())
+    for snippet_id in ("edited", "deleted"):
+        asyncio.run(firestore_service.get_snippet_by_id(snippet_id))
+
+    docs = db._collections[firestore_service.SNIPPETS_COLLECTION]
+    docs["edited"].update(content="new", updated_at=now)
+    del docs["deleted"]
+    db.seed(
+        firestore_service.TOMBSTONES_COLLECTION,
+        {"deleted": {"id": "deleted", "updated_at": now}},
+    )
+    # Served from this worker's cache until the refresh reads the change feed.
+    assert asyncio.run(firestore_service.get_snippet_by_id("edited")).content == "old"
+
+    asyncio.run(firestore_service.refresh_search_index())
+    assert asyncio.run(firestore_service.get_snippet_by_id("edited")).content == "new"
+    assert asyncio.run(firestore_service.get_snippet_by_id("deleted")) is None
+
+
+@pytest.fixture
+def snapshot_path(db, monkeypatch, tmp_path):
+    path = str(tmp_path / "search.snapshot")
+    monkeypatch.setattr(config, "SEARCH_SNAPSHOT_PATH", path)
+    return path
+
+
+def use_snapshot_index(monkeypatch, path, **kwargs):
+    index = SnapshotSearchIndex(path, **kwargs)
+    monkeypatch.setattr(firestore_service, "search_index", index)
+    return index
+
+
+def write_elsewhere(db, now):
+    # Another worker's capture of "new" and deletion of "deleted".
+    seed(db, {"new": "walrus pup"})
+    docs = db._collections[firestore_service.SNIPPETS_COLLECTION]
+    docs["new"]["updated_at"] = now
+    del docs["deleted"]
+    db.seed(
+        firestore_service.TOMBSTONES_COLLECTION,
+        {"deleted": {"id": "deleted", "updated_at": now}},
+    )
+
+
+def forbid_streaming(monkeypatch):
+    async def stream():
+        raise AssertionError("streamed the whole collection")
+
+    monkeypatch.setattr(firestore_service, "_stream_all_snippets", stream)
+
+
+def test_later_workers_start_from_the_published_snapshot_and_the_change_feed(
+    db, monkeypatch, snapshot_path
+):
+    seed(db, {"kept": "walrus tusks", "deleted": "narwhal horn"})
+    first = use_snapshot_index(monkeypatch, snapshot_path)
+    asyncio.run(firestore_service.rebuild_search_index())
+    assert first.builds == 1
+    assert os.path.exists(f"{snapshot_path}.state.npz")
+
+    write_elsewhere(db, datetime.datetime.now(datetime.timezone.utc))
+    # A fresh worker: empty indexes, and no reading of every snippet.
+    second = use_snapshot_index(monkeypatch, snapshot_path)
+    keyword_engine.rebuild([])
+    asyncio.run(embedding_index.rebuild([]))
+    forbid_streaming(monkeypatch)
+
+    asyncio.run(firestore_service.rebuild_search_index())
+    assert second.builds == 0
+    assert second.search("walrus") == {"kept", "new"}
+    assert second.search("narwhal") == set()
+    assert keyword_engine.num_docs == 2
+    assert "new" in embedding_index and "deleted" not in embedding_index
+    asyncio.run(first.stop())
+    asyncio.run(second.stop())
+
+
+def test_a_stale_snapshot_is_rebuilt_from_the_workers_own_indexes(
+    db, monkeypatch, snapshot_path
+):
+    seed(db, {"kept": "walrus tusks", "deleted": "narwhal horn"})
+    # Every generation is stale at once.
+    index = use_snapshot_index(monkeypatch, snapshot_path, max_age_seconds=0, check_seconds=3600)
+    asyncio.run(firestore_service.rebuild_search_index())
+    write_elsewhere(db, datetime.datetime.now(datetime.timezone.utc))
+    forbid_streaming(monkeypatch)
+
+    async def run():
+        index.start(
+            firestore_service._stream_all_snippets,
+            firestore_service._index_complete_until,
+            firestore_service._save_index_state,
+        )
+        await index._rebuild_if_stale()
+        await index.stop()
+
+    asyncio.run(run())
+    assert index.builds == 2
+    snapshot = IndexSnapshot(snapshot_path)
+    documents = snapshot.documents()
+    snapshot.close()
+    assert set(documents) == {"kept", "new"}
+    assert "walrus" in documents["new"][0]
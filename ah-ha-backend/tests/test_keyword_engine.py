@@ -0,0 +1,43 @@
+from services.keyword_engine import KeywordEngine, keyword_terms
+
+
+def test_contractions_do_not_become_keywords():
+    terms = keyword_terms("Rust doesn't have nulls and isn't garbage collected; it’s Ferris's")
+    assert {"doesn", "isn", "doesn't", "isn't", "it’s"}.isdisjoint(terms)
+    # A possessive counts as its noun.
+    assert "ferris" in terms
+    assert "rust" in terms
+
+
+def test_removed_documents_leave_the_vocabulary():
+    engine = KeywordEngine()
+    engine.add_document("a", "walrus narwhal")
+    engine.add_document("b", "walrus penguin")
+    vocabulary = engine.stats()["vocabulary"]
+
+    engine.remove_document("a")
+    assert "narwhal" not in engine._vocab
+    assert "walrus narwhal" not in engine._vocab
+    assert "walrus" in engine._vocab
+
+    # Freed slots are reused rather than growing the arrays.
+    engine.add_document("c", "walrus narwhal")
+    assert engine.stats()["vocabulary"] == vocabulary
+    assert len(engine._terms) == vocabulary
+    engine.remove_document("b")
+    engine.remove_document("c")
+    assert engine.stats() == {"documents": 0, "vocabulary": 0}
+
+
+def test_state_round_trips_with_free_slots():
+    engine = KeywordEngine()
+    engine.add_document("a", "walrus narwhal")
+    engine.add_document("b", "walrus penguin")
+    engine.remove_document("a")
+
+    loaded = KeywordEngine()
+    loaded.load_state(engine.state())
+    assert loaded.stats() == engine.stats()
+    assert loaded.suggest("walrus penguin krill") == engine.suggest("walrus penguin krill")
+    loaded.add_document("c", "narwhal")
+    assert len(loaded._terms) == len(engine._terms)
@@ -0,0 +1,28 @@
+import pytest
+
+from models import AhHaSnippet
+from services.firestore_service import _matches_search
+from services.search_index import InvertedIndex
+
+SNIPPET = AhHaSnippet(
+    id="s", title="JavaScript testing", content="asyncio event loop", generated_tags=["python"]
+)
+
+
+@pytest.mark.parametrize(
+    "query, matches",
+    [
+        ("asyn", True),
+        ("loop asyncio", True),
+        ("Pyth", True),
+        ("asyncio rust", False),
+        ("ing", False),
+        ("script", False),
+        ("", False),
+    ],
+)
+def test_the_startup_scan_matches_like_the_index(query, matches):
+    index = InvertedIndex()
+    index.rebuild([SNIPPET])
+    assert (index.search(query) == {"s"}) is matches
+    assert _matches_search(SNIPPET, query) is matches
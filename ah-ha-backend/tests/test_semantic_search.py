@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from models import AhHaSnippet
+from services.embedding_index import EmbeddingIndex, HashingEmbedder
+from services.sqlite_store import SqliteSnippetStore
+from services.storage import get_snippet_store
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    store = SqliteSnippetStore(str(tmp_path / "snippets.db"))
+    index = EmbeddingIndex(HashingEmbedder(256), min_score=-1.0)
+    snippets = [
+        AhHaSnippet(
+            title=f"python asyncio note {n}",
+            content="event loop",
+            generated_tags=["kept"] if n % 3 == 0 else ["other"],
+        )
+        for n in range(12)
+    ]
+
+    async def setup():
+        await store.warm_up()
+        await store.start()
+        created = await store.import_snippets(snippets)
+        await index.rebuild(created)
+
+    asyncio.run(setup())
+    monkeypatch.setattr(main, "embedding_index", index)
+    main.app.dependency_overrides[get_snippet_store] = lambda: store
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+    asyncio.run(store.close())
+
+
+def test_a_tag_filtered_semantic_page_is_full_and_resumes_after_itself(client):
+    params = {"search": "asyncio loop", "mode": "semantic", "tag": "kept", "limit": 3}
+    first = client.get("/ah-has/", params={**params, "view": "summary"})
+    assert first.status_code == 200
+    assert len(first.json()) == 3
+    assert all(item["generated_tags"] == ["kept"] for item in first.json())
+    assert first.headers["X-Next-Cursor"] == first.json()[-1]["id"]
+
+    rest = client.get("/ah-has/", params={**params, "start_after": first.headers["X-Next-Cursor"]})
+    assert [item["generated_tags"] for item in rest.json()] == [["kept"]]
+    assert "X-Next-Cursor" not in rest.headers
+    assert {item["id"] for item in first.json()}.isdisjoint(item["id"] for item in rest.json())
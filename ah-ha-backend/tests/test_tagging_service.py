@@ -0,0 +1,85 @@
+import asyncio
+import types
+
+import pytest
+
+import config
+from models import AhHaSnippet
+from services import genai_tagging, tagging_service
+from services.genai_tagging import GenAiTagger
+from services.tag_cache import TagCache
+from services.tagging_queue import TAGGING_FAILED, AsyncioTaggingQueue, TaggingJob
+
+
+class ReplyingClient:
+    """A google.genai client whose model always gives the same reply."""
+
+    def __init__(self, text):
+        self.calls = 0
+
+        async def generate_content(model, contents, config=None):
+            self.calls += 1
+            return types.SimpleNamespace(text=text)
+
+        self.aio = types.SimpleNamespace(
+            models=types.SimpleNamespace(generate_content=generate_content)
+        )
+
+
+class RecordingStore:
+    def __init__(self):
+        self.updates = []
+
+    async def update_snippet_tags(self, snippet_id, tags, tagging_status):
+        self.updates.append((snippet_id, tags, tagging_status))
+
+
+@pytest.fixture
+def genai(monkeypatch):
+    def install(reply):
+        client = ReplyingClient(reply)
+        monkeypatch.setattr(config, "TAGGING_ENGINE", "genai")
+        monkeypatch.setattr(genai_tagging, "genai_tagger", GenAiTagger(client=client))
+        monkeypatch.setattr(tagging_service, "tag_cache", TagCache())
+        return client
+
+    return install
+
+
+SNIPPET = AhHaSnippet(id="s1", title="Event loops", content="asyncio event loop scheduling tasks")
+
+
+@pytest.mark.parametrize("reply", ["not json", "[]", '{"tags": ["x"]}', ""])
+def test_a_reply_without_tags_is_a_failure(genai, reply):
+    genai(reply)
+    with pytest.raises(tagging_service.UnparseableTags):
+        asyncio.run(tagging_service.generate_tags(SNIPPET))
+
+
+def test_a_reply_with_tags_is_used(genai):
+    genai('["Asyncio", "events"]')
+    assert asyncio.run(tagging_service.generate_tags(SNIPPET)) == ["asyncio", "events"]
+
+
+def test_unparseable_replies_end_as_failed_with_keyword_tags(genai, monkeypatch):
+    client = genai("not json")
+    store = RecordingStore()
+    monkeypatch.setattr(tagging_service, "get_snippet_store", lambda: store)
+
+    async def run():
+        queue = AsyncioTaggingQueue(
+            tagging_service.run_tagging_job,
+            tagging_service.record_tagging_failure,
+            concurrency=1,
+            max_attempts=2,
+            backoff_base_seconds=0,
+        )
+        await queue.start()
+        await queue.enqueue(TaggingJob(snippet=SNIPPET))
+        await queue.drain(timeout=5)
+
+    asyncio.run(run())
+    assert client.calls == 2
+    [(snippet_id, tags, status)] = store.updates
+    assert (snippet_id, status) == ("s1", TAGGING_FAILED)
+    assert tags == tagging_service.keyword_engine.suggest(tagging_service.snippet_text(SNIPPET))
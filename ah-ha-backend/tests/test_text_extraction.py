@@ -0,0 +1,51 @@
+import asyncio
+import threading
+
+import pytest
+from bs4 import BeautifulSoup
+
+from benchmarks.bench_text_extraction import synthetic_html
+from models import AhHaSnippet
+from services import text_extraction
+from services.projection import make_preview
+from services.text_extraction import html_to_text
+
+
+def bs4_text(html: str) -> str:
+    return BeautifulSoup(html, "html.parser").get_text(separator=" ", strip=True)
+
+
+@pytest.mark.parametrize(
+    "html",
+    [
+        "<p>Hello <b>world</b></p><script>var x = 1;</script><style>p {}</style>",
+        "<p>a<![CDATA[x < y]]>b</p>",
+        "<p>a <![CDATA[ spaced ]]> b</p>",
+        "<p>a<![CDATA[]]>b</p>",
+        "<svg><![CDATA[<text>inside</text>]]></svg> after",
+        "<![if !IE]>conditional<![endif]>",
+        "<!DOCTYPE html><!-- note --><p>x &amp; y</p><?pi data?>",
+        "<template>hidden</template>shown",
+    ],
+)
+def test_matches_beautifulsoup(html):
+    assert html_to_text(html) == bs4_text(html)
+
+
+def test_matches_beautifulsoup_on_a_large_page():
+    html = synthetic_html(200_000)
+    assert html_to_text(html) == bs4_text(html)
+
+
+def test_previews_parse_html_off_the_event_loop(monkeypatch):
+    threads = []
+
+    def recording_html_to_text(html, max_chars=None):
+        threads.append(threading.current_thread())
+        return html_to_text(html, max_chars)
+
+    monkeypatch.setattr(text_extraction, "html_to_text", recording_html_to_text)
+    snippet = AhHaSnippet(title="t", content="<p>Hello <b>world</b></p>", content_type="html")
+
+    assert asyncio.run(make_preview(snippet)) == "Hello world"
+    assert threads and threading.main_thread() not in threads